@@ -1,65 +1,31 @@
 """Flask application for connection to GEO database. Use -h for more help."""
 import argparse
+import contextlib
+import functools
 import re
 
 import flask
 import flask_httpauth
 import flask_restful
-import getpass
+import flask_restful.inputs
+import flask_restful.reqparse
 import nltk
 import psycopg2
 import psycopg2.errors
-import psycopg2.pool
 import werkzeug.routing
 
-try:
-    import config  # Try to import attributes from config.py
-except Exception as e:  # If no config.py, define Object with empty attributes
-    print('Warning: No config.py found. ' +
-          'Using empty values for non-provided connection attributes. ' +
-          str(e))
-    import passlib  # for default pwd_context
-
-    class Object(object):
-        """Dummy class for config attributes."""
-        pass
-
-    config = Object()
-    config.MIN_CONNECTIONS = -1
-    config.MAX_CONNECTIONS = -1
-    config.HOSTNAME = ''
-    config.PORT = -1
-    config.DBNAME = ''
-    config.USERNAME = ''
-    config.PASSWORD = ''
-    config.pwd_context = passlib.context.CryptContext(
-        schemes=["pbkdf2_sha256"], deprecated="auto")
-
-
-class PasswordPromptAction(argparse.Action):
-    """Custom class for argparse.Action for password prompt with getpass."""
-    def __init__(self,
-                 option_strings,
-                 dest=None,
-                 nargs=0,
-                 default=None,
-                 required=False,
-                 type=None,
-                 metavar=None,
-                 help=None):
-        super(PasswordPromptAction,
-              self).__init__(option_strings=option_strings,
-                             dest=dest,
-                             nargs=nargs,
-                             default=default,
-                             required=required,
-                             metavar=metavar,
-                             type=type,
-                             help=help)
-
-    def __call__(self, parser, args, values, option_string=None):
-        password = getpass.getpass()
-        setattr(args, self.dest, password)
+import bow_export
+import connection_pool
+import credentials
+import lexicon
+import metrics
+import queries
+import representations
+import search_cache
+import serialization
+import settings
+import slow_queries
+from settings import config
 
 
 def generate_argparser():
@@ -67,71 +33,8 @@ def generate_argparser():
     parser = argparse.ArgumentParser(
         description='Flask application for connection to GEO database.',
         epilog='Report bugs to <https://github.com/andremsouza/ic-geo>')
-    parser.add_argument('-H',
-                        '--host',
-                        action='store',
-                        default=config.HOSTNAME,
-                        type=str,
-                        required=False,
-                        help='database server host or socket directory ' +
-                        '(default=config.HOSTNAME)',
-                        metavar='HOSTNAME',
-                        dest='hostname')
-    parser.add_argument('-p',
-                        '--port',
-                        action='store',
-                        default=config.PORT,
-                        type=int,
-                        required=False,
-                        help='database server port ' + '(default=config.PORT)',
-                        metavar='PORT',
-                        dest='port')
-    parser.add_argument('-d',
-                        '--dbname',
-                        action='store',
-                        default=config.DBNAME,
-                        type=str,
-                        required=False,
-                        help='database name to connect to ' +
-                        '(default=config.DBNAME)',
-                        metavar='DBNAME',
-                        dest='dbname')
-    parser.add_argument('-u',
-                        '--username',
-                        action='store',
-                        default=config.USERNAME,
-                        type=str,
-                        required=False,
-                        help='database user name ' +
-                        '(default=config.USERNAME)',
-                        metavar='USERNAME',
-                        dest='username')
-    parser.add_argument('--password',
-                        action=PasswordPromptAction,
-                        default=config.PASSWORD,
-                        type=str,
-                        required=False,
-                        help='password prompt ' + '(default=config.PASSWORD)',
-                        metavar='',
-                        dest='password')
-    parser.add_argument('--min-connections',
-                        action='store',
-                        default=config.MIN_CONNECTIONS,
-                        type=int,
-                        required=False,
-                        help='minimum number of connections in pool' +
-                        '(default=config.MIN_CONNECTIONS)',
-                        metavar='MIN-CONNECTIONS',
-                        dest='min_connections')
-    parser.add_argument('--max-connections',
-                        action='store',
-                        default=config.MAX_CONNECTIONS,
-                        type=int,
-                        required=False,
-                        help='maximum number of connections in pool' +
-                        '(default=config.MAX_CONNECTIONS)',
-                        metavar='MAX-CONNECTIONS',
-                        dest='max_connections')
+    settings.add_connection_arguments(parser)
+    settings.add_pool_arguments(parser)
     parser.add_argument("--debug",
                         action="store_true",
                         help="Activate debug mode for Flask")
@@ -184,11 +87,17 @@ if __name__ == "__main__":
     # Setting up nltk resources and database connection pool
     print("Downloading resources from NLTK...")
     nltk.download('stopwords')
+    lexicon_data = lexicon.Lexicon()
     print("Establishing connection pool to database...")
     try:
-        postgresql_pool = psycopg2.pool.SimpleConnectionPool(
+        postgresql_pool = connection_pool.ConnectionPool(
             args.min_connections,
             args.max_connections,
+            timeout=config.POOL_TIMEOUT,
+            max_idle=config.POOL_MAX_IDLE,
+            max_age=config.POOL_MAX_AGE,
+            on_wait=functools.partial(metrics.record, 'pool_wait'),
+            connection_factory=queries.PreparedConnection,
             dbname=args.dbname,
             user=args.username,
             password=args.password,
@@ -205,27 +114,55 @@ if __name__ == "__main__":
     app = flask.Flask(__name__)
     app.url_map.converters['int_list'] = IntListConverter
     api = flask_restful.Api(app)
-    auth = flask_httpauth.HTTPBasicAuth()
-
-
-@auth.verify_password
+    basic_auth = flask_httpauth.HTTPBasicAuth()
+    token_auth = flask_httpauth.HTTPTokenAuth(scheme='Bearer')
+    auth = flask_httpauth.MultiAuth(basic_auth, token_auth)
+    credential_cache = credentials.CredentialCache(
+        config.CREDENTIAL_CACHE_TTL, config.CREDENTIAL_CACHE_SIZE)
+    token_signer = credentials.TokenSigner(config.TOKEN_SECRET_KEY,
+                                           config.TOKEN_TTL)
+    result_cache = search_cache.SearchCache(config.SEARCH_CACHE_MAX_BYTES)
+    bow_cache = bow_export.ExportCache(config.BOW_EXPORT_DIR)
+    request_metrics = metrics.Metrics()
+    slow_query_log = None
+    if config.SLOW_QUERY_MS is not None:
+        slow_query_log = slow_queries.SlowQueryLog(
+            config.SLOW_QUERY_MS,
+            connect=functools.partial(psycopg2.connect,
+                                      dbname=args.dbname,
+                                      user=args.username,
+                                      password=args.password,
+                                      host=args.hostname,
+                                      port=args.port)
+            if config.SLOW_QUERY_EXPLAIN else None,
+            path=config.SLOW_QUERY_LOG,
+            explain_timeout=config.SLOW_QUERY_EXPLAIN_TIMEOUT)
+        queries.slow_query_log = slow_query_log
+
+
+@basic_auth.verify_password
+@metrics.timed('auth')
 def verify_password(username, password):
     """Password verification function for user authentication.
 
     Compares given username and password with the data stored in the database,
-    using the current pwd_context.
+    using the current pwd_context. Verified credentials are kept in the
+    credential_cache, skipping the database query and password hashing for
+    subsequent requests.
     """
+    user = credential_cache.get(username, password)
+    if user:
+        flask.g.user = user
+        return True
     try:
-        conn = postgresql_pool.getconn()
-        with conn.cursor() as cur:
-            cur.execute(
-                """SELECT username, password FROM api_users
-                    WHERE username = %(username)s;""", {"username": username})
-            user = cur.fetchone()
-            cur.close()
-        postgresql_pool.putconn(conn)
+        with postgresql_pool.connection() as conn:
+            with conn.cursor() as cur:
+                queries.execute(cur, 'user_select', {"username": username})
+                user = cur.fetchone()
+                cur.close()
         if (not user or not config.pwd_context.verify(password, user[1])):
             return False
+        credential_cache.add(username, password, user)
         flask.g.user = user
         return True
     except psycopg2.errors.InsufficientPrivilege:
@@ -242,6 +179,31 @@ def verify_password(username, password):
         }, 500
 
 
+@token_auth.verify_token
+@metrics.timed('auth')
+def verify_token(token):
+    """Token verification function for user authentication.
+
+    Accepts bearer tokens issued by the UserToken resource, which are signed
+    and short-lived, skipping password verification entirely. The user is
+    read from the database, so tokens of deleted users, or issued before a
+    password change, are rejected.
+    """
+    payload = token_signer.verify(token)
+    if payload is None:
+        return False
+    username, fingerprint = payload
+    with postgresql_pool.connection() as conn:
+        with conn.cursor() as cur:
+            queries.execute(cur, 'user_select', {"username": username})
+            user = cur.fetchone()
+            cur.close()
+    if not token_signer.matches(fingerprint, user):
+        return False
+    flask.g.user = user
+    return True
+
+
 class Users(flask_restful.Resource):
     """Users resource for management of the API's users.
 
@@ -275,21 +237,20 @@ class Users(flask_restful.Resource):
                 "authorization:[username, password]\n",
             }, 400
         try:
-            conn = psycopg2.connect(dbname=args.dbname,
-                                    user=db_username,
-                                    password=db_password,
-                                    host=args.hostname,
-                                    port=args.port)
-            with conn.cursor() as cur:
-                cur.execute(
-                    """INSERT INTO api_users
-                            VALUES(%(username)s, %(password)s);""", {
-                        'username': new_username,
-                        'password': config.pwd_context.hash(new_password)
-                    })
-                cur.close()
-            conn.commit()
-            conn.close()
+            with contextlib.closing(
+                    psycopg2.connect(dbname=args.dbname,
+                                     user=db_username,
+                                     password=db_password,
+                                     host=args.hostname,
+                                     port=args.port)) as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        queries.USER_INSERT, {
+                            'username': new_username,
+                            'password': config.pwd_context.hash(new_password)
+                        })
+                    cur.close()
+                conn.commit()
         except psycopg2.errors.InsufficientPrivilege:
             return {
                 "message": "Insufficient privileges for this operation."
@@ -311,7 +272,7 @@ class Users(flask_restful.Resource):
             'username': new_username
         }, 201
 
-    @auth.login_required
+    @basic_auth.login_required
     def put(self):
         """PUT requests' handler. Changes an API user's password.
 
@@ -321,7 +282,7 @@ class Users(flask_restful.Resource):
         """
         username = flask.request.authorization['username']
         password = flask.request.authorization['password']
-        new_password = flask.request.json.get['new_password']
+        new_password = flask.request.json.get('new_password')
         if None in [username, password, new_password]:
             return {
                 "message":
@@ -329,17 +290,18 @@ class Users(flask_restful.Resource):
                 "authorization:[username, password]",
             }, 400
         try:
-            conn = postgresql_pool.getconn()
-            with conn.cursor() as cur:
-                cur.execute(
-                    """UPDATE api_users SET password = %(new_password)s
-                    WHERE username = %(username)s;""", {
-                        'username': username,
-                        'new_password': config.pwd_context.hash(new_password),
-                    })
-                cur.close()
-            conn.commit()
-            postgresql_pool.putconn(conn)
+            with postgresql_pool.connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        queries.USER_UPDATE, {
+                            'username':
+                            username,
+                            'new_password':
+                            config.pwd_context.hash(new_password),
+                        })
+                    cur.close()
+                conn.commit()
+            credential_cache.invalidate(username)
         except psycopg2.errors.InsufficientPrivilege:
             return {
                 "message": "Insufficient privileges for this operation."
@@ -378,20 +340,20 @@ class Users(flask_restful.Resource):
                 "authorization:[username, password]",
             }, 400
         try:
-            conn = psycopg2.connect(dbname=args.dbname,
-                                    user=db_username,
-                                    password=db_password,
-                                    host=args.hostname,
-                                    port=args.port)
-            with conn.cursor() as cur:
-                cur.execute(
-                    """DELETE FROM api_users WHERE username = %(username)s;""",
-                    {
-                        'username': username,
-                    })
-                cur.close()
-            conn.commit()
-            conn.close()
+            with contextlib.closing(
+                    psycopg2.connect(dbname=args.dbname,
+                                     user=db_username,
+                                     password=db_password,
+                                     host=args.hostname,
+                                     port=args.port)) as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        queries.USER_DELETE, {
+                            'username': username,
+                        })
+                    cur.close()
+                conn.commit()
+            credential_cache.invalidate(username)
         except psycopg2.errors.InsufficientPrivilege:
             return {
                 "message": "Insufficient privileges for this operation."
@@ -411,28 +373,264 @@ class Users(flask_restful.Resource):
         return {'username': username}, 200
 
 
-class InterviewAll(flask_restful.Resource):
-    """Resource class for access to all data from the interviews.
+def generate_pagination_parser():
+    """Return RequestParser object for pagination of interview listings.
 
-    This resource class accepst GET requests. All requests to this resource
-    require user authentication parameters (in the Authorization header).
-    The response data is JSON formatted.
+    The 'limit' argument sets the maximum number of rows in the response
+    (bounded by config.MAX_PAGE_SIZE), and 'after_id' sets the keyset cursor:
+    only interviews with an id greater than 'after_id' are returned. If
+    'stream' is true, rows are streamed as NDJSON instead of paginated.
+    """
+    parser = flask_restful.reqparse.RequestParser()
+    parser.add_argument('limit',
+                        type=flask_restful.inputs.positive,
+                        location='args',
+                        help='maximum number of rows (positive integer)')
+    parser.add_argument('after_id',
+                        type=flask_restful.inputs.natural,
+                        default=0,
+                        location='args',
+                        help='id of the last row of the previous page')
+    parser.add_argument('stream',
+                        type=flask_restful.inputs.boolean,
+                        default=False,
+                        location='args',
+                        help='stream rows as NDJSON (true or false)')
+    return parser
+
+
+pagination_parser = generate_pagination_parser()
+
+
+def generate_search_parser():
+    """Return RequestParser object for top-k interview searches.
+
+    The 'limit' argument sets the maximum number of ranked rows in the
+    response (default config.SEARCH_PAGE_SIZE, bounded by
+    config.MAX_PAGE_SIZE), 'offset' skips the first ranked rows, and
+    'min_rank' discards rows ranked below a threshold. If 'ids_only' is true,
+    only the ids and ranks of the interviews are returned. The 'field'
+    argument selects the searched tsvector column (see queries.SEARCH_FIELDS).
+    """
+    parser = flask_restful.reqparse.RequestParser()
+    parser.add_argument('limit',
+                        type=flask_restful.inputs.positive,
+                        location='args',
+                        help='maximum number of rows (positive integer)')
+    parser.add_argument('offset',
+                        type=flask_restful.inputs.natural,
+                        default=0,
+                        location='args',
+                        help='number of ranked rows to skip')
+    parser.add_argument('min_rank',
+                        type=float,
+                        default=0.0,
+                        location='args',
+                        help='minimum rank of the returned rows')
+    parser.add_argument('ids_only',
+                        type=flask_restful.inputs.boolean,
+                        default=False,
+                        location='args',
+                        help='return only ids and ranks (true or false)')
+    parser.add_argument('field',
+                        choices=tuple(queries.SEARCH_FIELDS),
+                        location='args',
+                        help='searched field: ' +
+                        ', '.join(queries.SEARCH_FIELDS))
+    return parser
+
+
+search_parser = generate_search_parser()
+
+
+def generate_slow_queries_parser():
+    """Return RequestParser object for listings of the slow-query log.
+
+    The 'limit' argument sets the maximum number of listed queries, and
+    'order' sorts them by total_ms (default), max_ms or count.
+    """
+    parser = flask_restful.reqparse.RequestParser()
+    parser.add_argument('limit',
+                        type=flask_restful.inputs.positive,
+                        default=20,
+                        location='args',
+                        help='maximum number of queries (positive integer)')
+    parser.add_argument('order',
+                        choices=('total_ms', 'max_ms', 'count'),
+                        default='total_ms',
+                        location='args',
+                        help='sort key (total_ms, max_ms or count)')
+    return parser
+
+
+slow_queries_parser = generate_slow_queries_parser()
+
+
+def stream_interviews(projection, after_id=0, limit=None):
+    """Return a chunked NDJSON response with a projection of the interviews.
+
+    Rows are read through a server-side (named) cursor, fetching
+    config.STREAM_ITERSIZE rows per round trip, so memory usage does not
+    depend on the size of the table. Each line of the response is a JSON
+    object, mapping column names to values. The pool connection is returned
+    (and its transaction rolled back) when the response is fully consumed or
+    closed by the client.
+    """
+    columns = queries.PROJECTIONS[projection]
+
+    def generate():
+        with postgresql_pool.connection() as conn:
+            with conn.cursor(name='interviews_stream') as cur:
+                cur.itersize = config.STREAM_ITERSIZE
+                serialization.register_raw_json(cur)
+                cur.execute(queries.STATEMENTS['all_' + projection].sql, {
+                    'after_id': after_id,
+                    'limit': limit
+                })
+                for row in cur:
+                    yield serialization.dumps(dict(zip(columns, row))) + b'\n'
+
+    return flask.Response(generate(), mimetype='application/x-ndjson')
+
+
+def representation_output(media_type):
+    """Return a flask_restful output function for a media type of
+    representations.ENCODERS (JSON, MessagePack or NDJSON), selected by the
+    Accept header of requests. JSON replaces flask_restful's own encoder,
+    embedding raw json/jsonb values (see serialization.py)."""
+    encoder = representations.ENCODERS[media_type]
+
+    def output(data, code, headers=None):
+        with metrics.phase('serialize'):
+            body = encoder(data)
+        response = flask.make_response(body, code)
+        response.headers.extend(headers or {})
+        response.headers['Content-Type'] = media_type
+        return response
+
+    return output
+
+
+def compress_response(response):
+    """Compress a response with the coding negotiated by the Accept-Encoding
+    header (brotli or gzip).
+
+    Responses smaller than config.COMPRESSION_MIN_SIZE bytes, of binary media
+    types or passed through directly (e.g., files) are not compressed.
+    Streamed responses are compressed chunk by chunk, without Content-Length.
+    """
+    if (response.direct_passthrough or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers
+            or not representations.compressible(response.mimetype)):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = representations.negotiate_encoding(
+        flask.request.headers.get('Accept-Encoding'))
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        response.response = representations.compress_stream(
+            response.response, encoding, config.COMPRESSION_LEVEL)
+        response.headers.pop('Content-Length', None)
+    else:
+        body = response.get_data()
+        if len(body) < config.COMPRESSION_MIN_SIZE:
+            return response
+        response.set_data(
+            representations.compress(body, encoding,
+                                     config.COMPRESSION_LEVEL))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def record_metrics(response):
+    """Add the request to request_metrics, by route pattern.
+
+    Registered before compress_response, so it runs after it, and counts the
+    compressed size of responses. Sizes of streamed responses are unknown.
+    """
+    rule = flask.request.url_rule
+    request_metrics.finish_request(
+        rule.rule if rule else 'unmatched', flask.request.method,
+        response.status_code,
+        None if response.is_streamed else response.content_length)
+    return response
+
+
+@auth.login_required
+def metrics_view():
+    """GET /metrics handler. Returns the request metrics and the connection
+    pool statistics, in the Prometheus text format.
+
+    Requires authentication of an user in config.ADMIN_USERS (e.g., with
+    the basic_auth of a Prometheus scrape configuration).
+    """
+    if flask.g.user[0] not in config.ADMIN_USERS:
+        return flask.jsonify(
+            message="Only admin users may access this route."), 403
+    gauges = {
+        'pool_' + key: ('Connection pool statistic (see /stats/pool).', value)
+        for key, value in postgresql_pool.stats().items()
+        if isinstance(value, (int, float))
+    }
+    return flask.Response(request_metrics.render(gauges),
+                          content_type=metrics.CONTENT_TYPE)
+
+
+class UserToken(flask_restful.Resource):
+    """Resource class for issuing signed bearer tokens to API users.
+
+    This resource class accepts POST requests, which require user
+    authentication parameters (username and password in the Authorization
+    header). The returned token may be used in the Authorization header of
+    subsequent requests (as "Bearer <token>"), until it expires or the user's
+    password is changed.
+    """
+    decorators = [basic_auth.login_required]
+
+    def post(self):
+        """POST requests' handler. Issues a new token for the API user."""
+        username = flask.g.user[0]
+        return {
+            'token': token_signer.issue(flask.g.user),
+            'token_type': 'Bearer',
+            'expires_in': token_signer.ttl,
+            'username': username,
+        }, 201
+
+
+class InterviewAllResource(flask_restful.Resource):
+    """Base resource class for paginated access to all interviews.
+
+    Subclasses define the selected columns in the 'projection' attribute (a
+    key of queries.PROJECTIONS).
+    Responses are paginated by id (keyset pagination), with the 'limit' and
+    'after_id' query parameters. The 'next_after_id' key of the response holds
+    the cursor for the next page, or None if there are no more rows.
+    With the 'stream=true' query parameter, all rows after 'after_id' are
+    streamed in NDJSON format (application/x-ndjson).
     """
     decorators = [auth.login_required]
+    projection = 'ids'
 
     def get(self):
+        args = pagination_parser.parse_args()
+        if args['stream']:
+            return stream_interviews(self.projection, args['after_id'],
+                                     args['limit'])
+        limit = min(args['limit'] or config.PAGE_SIZE, config.MAX_PAGE_SIZE)
         try:
-            conn = postgresql_pool.getconn()
-            data = {}
-            with conn.cursor() as cur:
-                cur.execute("""SELECT id, text, questions, answers, meta
-                        FROM interviews
-                        ORDER BY id;""")
-                data['row_count'] = cur.rowcount
-                data['column_names'] = [desc[0] for desc in cur.description]
-                data['rows'] = cur.fetchall()
-                cur.close()
-            postgresql_pool.putconn(conn)
+            with postgresql_pool.connection() as conn:
+                with conn.cursor() as cur:
+                    serialization.register_raw_json(cur)
+                    queries.execute(cur, 'all_' + self.projection, {
+                        'after_id': args['after_id'],
+                        'limit': limit
+                    })
+                    data = queries.page_response(
+                        [desc[0] for desc in cur.description],
+                        queries.fetchall(cur), limit, args['after_id'])
+                    cur.close()
         except (Exception, psycopg2.Error) as e:
             return {
                 "message": str(e),
@@ -440,113 +638,118 @@ class InterviewAll(flask_restful.Resource):
         return data
 
 
-class InterviewAllText(flask_restful.Resource):
-    """Resource class for access to all interviews' text.
+class InterviewAll(InterviewAllResource):
+    """Resource class for access to all data from the interviews.
 
     This resource class accepst GET requests. All requests to this resource
     require user authentication parameters (in the Authorization header).
-    The response data is JSON formatted.
+    The response data is JSON formatted, and paginated by id.
     """
-    decorators = [auth.login_required]
+    projection = 'all'
 
-    def get(self):
-        try:
-            conn = postgresql_pool.getconn()
-            with conn.cursor() as cur:
-                data = {}
-                cur.execute("""SELECT id, text FROM interviews
-                        ORDER BY id;""")
-                data['row_count'] = cur.rowcount
-                data['column_names'] = [desc[0] for desc in cur.description]
-                data['rows'] = cur.fetchall()
-                cur.close()
-            postgresql_pool.putconn(conn)
-        except (Exception, psycopg2.Error) as e:
-            return {
-                "message": str(e),
-            }, 500
-        return data
+
+class InterviewAllText(InterviewAllResource):
+    """Resource class for access to all interviews' text.
+
+    This resource class accepst GET requests. All requests to this resource
+    require user authentication parameters (in the Authorization header).
+    The response data is JSON formatted, and paginated by id.
+    """
+    projection = 'text'
 
 
-class InterviewAllQuestions(flask_restful.Resource):
+class InterviewAllQuestions(InterviewAllResource):
     """Resource class for access to all interviews' questions.
 
     This resource class accepst GET requests. All requests to this resource
     require user authentication parameters (in the Authorization header).
-    The response data is JSON formatted.
+    The response data is JSON formatted, and paginated by id.
     """
-    decorators = [auth.login_required]
+    projection = 'questions'
+
+
+class InterviewAllAnswers(InterviewAllResource):
+    """Resource class for access to all interviews' answers.
+
+    This resource class accepst GET requests. All requests to this resource
+    require user authentication parameters (in the Authorization header).
+    The response data is JSON formatted, and paginated by id.
+    """
+    projection = 'answers'
+
+
+class InterviewAllMeta(InterviewAllResource):
+    """Resource class for access to all interviews' metadata.
+
+    This resource class accepst GET requests. All requests to this resource
+    require user authentication parameters (in the Authorization header).
+    The response data is JSON formatted, and paginated by id.
+    """
+    projection = 'meta'
 
     def get(self):
-        try:
-            conn = postgresql_pool.getconn()
-            data = {}
-            with conn.cursor() as cur:
-                cur.execute("""SELECT id, questions FROM interviews
-                        ORDER BY id;""")
-                data['row_count'] = cur.rowcount
-                data['column_names'] = [desc[0] for desc in cur.description]
-                data['rows'] = cur.fetchall()
-                cur.close()
-            postgresql_pool.putconn(conn)
-        except (Exception, psycopg2.Error) as e:
-            return {
-                "message": str(e),
-            }, 500
+        data = super(InterviewAllMeta, self).get()
+        if isinstance(data, dict):
+            data.update(queries.meta_fields(lexicon_data))
         return data
 
 
-class InterviewAllAnswers(flask_restful.Resource):
-    """Resource class for access to all interviews' answers.
+class InterviewAllBow(flask_restful.Resource):
+    """Resource class for a columnar export of all interviews' bags-of-words.
 
     This resource class accepst GET requests. All requests to this resource
     require user authentication parameters (in the Authorization header).
-    The response data is JSON formatted.
+    The response is an uncompressed .npz file with the vocabularies and
+    sparse term-document matrices (in CSR format) of the 'bow' and
+    'bow_stemmed' metadata of each field (see bow_export.py). Exports are
+    cached, and regenerated only when the interviews table changes.
     """
     decorators = [auth.login_required]
 
     def get(self):
         try:
-            conn = postgresql_pool.getconn()
-            data = {}
-            with conn.cursor() as cur:
-                cur.execute("""SELECT id, answers FROM interviews
-                    ORDER BY id;""")
-                data['row_count'] = cur.rowcount
-                data['column_names'] = [desc[0] for desc in cur.description]
-                data['rows'] = cur.fetchall()
-                cur.close()
-            postgresql_pool.putconn(conn)
+            with postgresql_pool.connection() as conn:
+                with conn.cursor() as cur:
+                    queries.execute(cur, 'version_select')
+                    version = cur.fetchone()[0]
+                    cur.close()
+                path = bow_cache.get(version)
+                if path is None:
+                    with bow_cache.lock:
+                        path = bow_cache.get(version) or bow_cache.put(
+                            version,
+                            bow_export.build(bow_export.fetch_rows(conn)))
         except (Exception, psycopg2.Error) as e:
             return {
                 "message": str(e),
             }, 500
-        return data
+        return flask.send_file(path,
+                               mimetype='application/octet-stream',
+                               as_attachment=True,
+                               download_name='bow_%d.npz' % version,
+                               conditional=True)
 
 
-class InterviewAllMeta(flask_restful.Resource):
-    """Resource class for access to all interviews' metadata.
+class InterviewAnyResource(flask_restful.Resource):
+    """Base resource class for access to a list of interviews.
 
-    This resource class accepst GET requests. All requests to this resource
-    require user authentication parameters (in the Authorization header).
-    The response data is JSON formatted.
+    Subclasses define the selected columns in the 'projection' attribute (a
+    key of queries.PROJECTIONS).
     """
     decorators = [auth.login_required]
+    projection = 'ids'
 
-    def get(self):
+    def get(self, ids):
         try:
-            conn = postgresql_pool.getconn()
-            data = {}
-            with conn.cursor() as cur:
-                cur.execute("""SELECT id, meta FROM interviews
-                    ORDER BY id;""")
-                data['row_count'] = cur.rowcount
-                data['column_names'] = [desc[0] for desc in cur.description]
-                data['rows'] = cur.fetchall()
-                data['stemmer'] = 'RSLP Stemmer'
-                data['stopwords'] = nltk.corpus.stopwords.words('portuguese')
-                cur.close()
-            postgresql_pool.putconn(conn)
+            with postgresql_pool.connection() as conn:
+                with conn.cursor() as cur:
+                    serialization.register_raw_json(cur)
+                    queries.execute(cur, 'any_' + self.projection,
+                                    {"id_list": ids})
+                    data = queries.any_response(
+                        ids, [desc[0] for desc in cur.description],
+                        queries.fetchall(cur))
+                    cur.close()
         except (Exception, psycopg2.Error) as e:
             return {
                 "message": str(e),
@@ -554,7 +757,7 @@ class InterviewAllMeta(flask_restful.Resource):
         return data
 
 
-class InterviewAny(flask_restful.Resource):
+class InterviewAny(InterviewAnyResource):
     """Resource class for access to all data of a list of interviews.
 
     This resource class accepst GET requests. All requests to this resource
@@ -562,33 +765,10 @@ class InterviewAny(flask_restful.Resource):
     The response data is JSON formatted.
     The list of interviews should be a list of integers.
     """
-    decorators = [auth.login_required]
+    projection = 'all'
 
-    def get(self, ids):
-        try:
-            conn = postgresql_pool.getconn()
-            data = {}
-            with conn.cursor() as cur:
-                cur.execute(
-                    """SELECT id, text, questions, answers, meta
-                        FROM interviews
-                        WHERE id IN %(id_list)s
-                        ORDER BY id;""", {"id_list": tuple(ids)})
-                data['search_ids_count'] = len(ids)
-                data['search_ids'] = ids
-                data['row_count'] = cur.rowcount
-                data['column_names'] = [desc[0] for desc in cur.description]
-                data['rows'] = cur.fetchall()
-                cur.close()
-            postgresql_pool.putconn(conn)
-        except (Exception, psycopg2.Error) as e:
-            return {
-                "message": str(e),
-            }, 500
-        return data
 
-
-class InterviewAnyText(flask_restful.Resource):
+class InterviewAnyText(InterviewAnyResource):
     """Resource class for access to the text of a list of interviews.
 
     This resource class accepst GET requests. All requests to this resource
@@ -596,32 +776,10 @@ class InterviewAnyText(flask_restful.Resource):
     The response data is JSON formatted.
     The list of interviews should be a list of integers.
     """
-    decorators = [auth.login_required]
-
-    def get(self, ids):
-        try:
-            conn = postgresql_pool.getconn()
-            data = {}
-            with conn.cursor() as cur:
-                cur.execute(
-                    """SELECT id, text FROM interviews
-                    WHERE id IN %(id_list)s
-                    ORDER BY id;""", {"id_list": tuple(ids)})
-                data['search_ids_count'] = len(ids)
-                data['search_ids'] = ids
-                data['row_count'] = cur.rowcount
-                data['column_names'] = [desc[0] for desc in cur.description]
-                data['rows'] = cur.fetchall()
-                cur.close()
-            postgresql_pool.putconn(conn)
-        except (Exception, psycopg2.Error) as e:
-            return {
-                "message": str(e),
-            }, 500
-        return data
+    projection = 'text'
 
 
-class InterviewAnyQuestions(flask_restful.Resource):
+class InterviewAnyQuestions(InterviewAnyResource):
     """Resource class for access to the questions of a list of interviews.
 
     This resource class accepst GET requests. All requests to this resource
@@ -629,32 +787,10 @@ class InterviewAnyQuestions(flask_restful.Resource):
     The response data is JSON formatted.
     The list of interviews should be a list of integers.
     """
-    decorators = [auth.login_required]
+    projection = 'questions'
 
-    def get(self, ids):
-        try:
-            conn = postgresql_pool.getconn()
-            data = {}
-            with conn.cursor() as cur:
-                cur.execute(
-                    """SELECT id, questions FROM interviews
-                    WHERE id IN %(id_list)s
-                    ORDER BY id;""", {"id_list": tuple(ids)})
-                data['search_ids_count'] = len(ids)
-                data['search_ids'] = ids
-                data['row_count'] = cur.rowcount
-                data['column_names'] = [desc[0] for desc in cur.description]
-                data['rows'] = cur.fetchall()
-                cur.close()
-            postgresql_pool.putconn(conn)
-        except (Exception, psycopg2.Error) as e:
-            return {
-                "message": str(e),
-            }, 500
-        return data
 
-
-class InterviewAnyAnswers(flask_restful.Resource):
+class InterviewAnyAnswers(InterviewAnyResource):
     """Resource class for access to the answers of a list of interviews.
 
     This resource class accepst GET requests. All requests to this resource
@@ -662,32 +798,10 @@ class InterviewAnyAnswers(flask_restful.Resource):
     The response data is JSON formatted.
     The list of interviews should be a list of integers.
     """
-    decorators = [auth.login_required]
-
-    def get(self, ids):
-        try:
-            conn = postgresql_pool.getconn()
-            data = {}
-            with conn.cursor() as cur:
-                cur.execute(
-                    """SELECT id, answers FROM interviews
-                    WHERE id IN %(id_list)s
-                    ORDER BY id;""", {"id_list": tuple(ids)})
-                data['search_ids_count'] = len(ids)
-                data['search_ids'] = ids
-                data['row_count'] = cur.rowcount
-                data['column_names'] = [desc[0] for desc in cur.description]
-                data['rows'] = cur.fetchall()
-                cur.close()
-            postgresql_pool.putconn(conn)
-        except (Exception, psycopg2.Error) as e:
-            return {
-                "message": str(e),
-            }, 500
-        return data
+    projection = 'answers'
 
 
-class InterviewAnyMeta(flask_restful.Resource):
+class InterviewAnyMeta(InterviewAnyResource):
     """Resource class for access to the metadata of a list of interviews.
 
     This resource class accepst GET requests. All requests to this resource
@@ -695,26 +809,66 @@ class InterviewAnyMeta(flask_restful.Resource):
     The response data is JSON formatted.
     The list of interviews should be a list of integers.
     """
-    decorators = [auth.login_required]
+    projection = 'meta'
 
     def get(self, ids):
+        data = super(InterviewAnyMeta, self).get(ids)
+        if isinstance(data, dict):
+            data.update(queries.meta_fields(lexicon_data))
+        return data
+
+
+class InterviewSearchResource(flask_restful.Resource):
+    """Base resource class for access to interview data, searching by a string.
+
+    Subclasses define the selected columns in the 'projection' attribute (a
+    key of queries.PROJECTIONS), and the default searched field in the 'field'
+    attribute (a key of queries.SEARCH_FIELDS), which may be overridden by the
+    'field' query parameter.
+    Results are ranked with ts_rank_cd (with config.SEARCH_RANK_WEIGHTS), and
+    only the top 'limit' rows (after 'offset', with a rank of at least
+    'min_rank') are joined with the selected columns. The 'next_offset' key
+    of the response holds the offset of the next page, or None if there are
+    no more rows. With 'ids_only=true', only ids and ranks are returned.
+    Results are kept in the search_cache, keyed on the normalized search
+    string, the selected columns and the query parameters. Cached results are
+    invalidated whenever the interviews table changes.
+    """
+    decorators = [auth.login_required]
+    projection = 'ids'
+    field = 'text'
+
+    def get(self, search_string):
+        args = search_parser.parse_args()
+        field = args['field'] or self.field
+        limit = min(args['limit'] or config.SEARCH_PAGE_SIZE,
+                    config.MAX_PAGE_SIZE)
+        projection = 'ids' if args['ids_only'] else self.projection
+        key = queries.search_key(search_string, projection, field, limit,
+                                 args['offset'], args['min_rank'])
         try:
-            conn = postgresql_pool.getconn()
-            data = {}
-            with conn.cursor() as cur:
-                cur.execute(
-                    """SELECT id, meta FROM interviews
-                    WHERE id IN %(id_list)s
-                    ORDER BY id;""", {"id_list": tuple(ids)})
-                data['search_ids_count'] = len(ids)
-                data['search_ids'] = ids
-                data['row_count'] = cur.rowcount
-                data['column_names'] = [desc[0] for desc in cur.description]
-                data['rows'] = cur.fetchall()
-                data['stemmer'] = 'RSLP Stemmer'
-                data['stopwords'] = nltk.corpus.stopwords.words('portuguese')
-                cur.close()
-            postgresql_pool.putconn(conn)
+            with postgresql_pool.connection() as conn:
+                with conn.cursor() as cur:
+                    serialization.register_raw_json(cur)
+                    queries.execute(cur, 'version_select')
+                    version = cur.fetchone()[0]
+                    data = result_cache.get(key, version)
+                    if data is None:
+                        queries.execute(
+                            cur, 'search_%s_%s' % (projection, field), {
+                                "search_string": search_string,
+                                "weights": config.SEARCH_RANK_WEIGHTS,
+                                "min_rank": args['min_rank'],
+                                "limit": limit,
+                                "offset": args['offset'],
+                            })
+                        data = queries.search_response(
+                            [desc[0] for desc in cur.description],
+                            queries.fetchall(cur), field, limit,
+                            args['offset'], args['min_rank'])
+                        result_cache.put(key, version, data)
+                    data['search_string'] = search_string
+                    cur.close()
         except (Exception, psycopg2.Error) as e:
             return {
                 "message": str(e),
@@ -722,128 +876,84 @@ class InterviewAnyMeta(flask_restful.Resource):
         return data
 
 
-class InterviewSearch(flask_restful.Resource):
+class InterviewSearch(InterviewSearchResource):
     """Resource class for access to interview data, searching by a string.
 
     This resource class accepst GET requests. All requests to this resource
     require user authentication parameters (in the Authorization header).
     The response data is JSON formatted.
     """
-    decorators = [auth.login_required]
-
-    def get(self, search_string):
-        try:
-            conn = postgresql_pool.getconn()
-            data = {}
-            with conn.cursor() as cur:
-                cur.execute(
-                    """SELECT id, text, questions, answers, meta,
-                            ts_rank_cd(tstext,
-                                       websearch_to_tsquery('portuguese',
-                                                            %(search_string)s),
-                                        1|4|32)
-                                as rank
-                        FROM interviews
-                        WHERE tstext @@
-                            websearch_to_tsquery('portuguese',
-                                                 %(search_string)s)
-                        ORDER BY rank DESC;""",
-                    {"search_string": search_string})
-                data['search_string'] = search_string
-                data['row_count'] = cur.rowcount
-                data['column_names'] = [desc[0] for desc in cur.description]
-                data['rows'] = cur.fetchall()
-                cur.close()
-            postgresql_pool.putconn(conn)
-        except (Exception, psycopg2.Error) as e:
-            return {
-                "message": str(e),
-            }, 500
-        return data
+    projection = 'all'
 
 
-class InterviewSearchText(flask_restful.Resource):
+class InterviewSearchText(InterviewSearchResource):
     """Resource class for access to interview text, searching by a string.
 
     This resource class accepst GET requests. All requests to this resource
     require user authentication parameters (in the Authorization header).
     The response data is JSON formatted.
     """
-    decorators = [auth.login_required]
-
-    def get(self, search_string):
-        try:
-            conn = postgresql_pool.getconn()
-            data = {}
-            with conn.cursor() as cur:
-                cur.execute(
-                    """SELECT id, text,
-                            ts_rank_cd(tstext,
-                                       websearch_to_tsquery('portuguese',
-                                                            %(search_string)s),
-                                        1|4|32)
-                                as rank
-                        FROM interviews
-                        WHERE tstext @@
-                            websearch_to_tsquery('portuguese',
-                                                 %(search_string)s)
-                        ORDER BY rank DESC;""",
-                    {"search_string": search_string})
-                data['search_string'] = search_string
-                data['row_count'] = cur.rowcount
-                data['column_names'] = [desc[0] for desc in cur.description]
-                data['rows'] = cur.fetchall()
-                cur.close()
-            postgresql_pool.putconn(conn)
-        except (Exception, psycopg2.Error) as e:
-            return {
-                "message": str(e),
-            }, 500
-        return data
+    projection = 'text'
 
 
-class InterviewSearchQuestions(flask_restful.Resource):
+class InterviewSearchQuestions(InterviewSearchResource):
     """Resource class for access to interview questions, searching by a string.
 
     This resource class accepst GET requests. All requests to this resource
     require user authentication parameters (in the Authorization header).
     The response data is JSON formatted.
     """
-    decorators = [auth.login_required]
+    projection = 'questions'
+    field = 'questions'
+
+
+class InterviewSearchAnswers(InterviewSearchResource):
+    """Resource class for access to interview answers, searching by a string.
+
+    This resource class accepst GET requests. All requests to this resource
+    require user authentication parameters (in the Authorization header).
+    The response data is JSON formatted.
+    """
+    projection = 'answers'
+    field = 'answers'
+
+
+class InterviewSearchMeta(InterviewSearchResource):
+    """Resource class for access to interview metadata, searching by a string.
+
+    This resource class accepst GET requests. All requests to this resource
+    require user authentication parameters (in the Authorization header).
+    The response data is JSON formatted.
+    """
+    projection = 'meta'
 
     def get(self, search_string):
-        try:
-            conn = postgresql_pool.getconn()
-            data = {}
-            with conn.cursor() as cur:
-                cur.execute(
-                    """SELECT id, questions,
-                            ts_rank_cd(tstext,
-                                       websearch_to_tsquery('portuguese',
-                                                            %(search_string)s),
-                                        1|4|32)
-                                as rank
-                        FROM interviews
-                        WHERE tstext @@
-                            websearch_to_tsquery('portuguese',
-                                                 %(search_string)s)
-                        ORDER BY rank DESC;""",
-                    {"search_string": search_string})
-                data['search_string'] = search_string
-                data['row_count'] = cur.rowcount
-                data['column_names'] = [desc[0] for desc in cur.description]
-                data['rows'] = cur.fetchall()
-                cur.close()
-            postgresql_pool.putconn(conn)
-        except (Exception, psycopg2.Error) as e:
-            return {
-                "message": str(e),
-            }, 500
+        data = super(InterviewSearchMeta, self).get(search_string)
+        if isinstance(data, dict):
+            data.update(queries.meta_fields(lexicon_data))
         return data
 
 
-class InterviewSearchAnswers(flask_restful.Resource):
-    """Resource class for access to interview answers, searching by a string.
+class MetaLexicon(flask_restful.Resource):
+    """Resource class for access to the lexical resources of the metadata.
+
+    This resource class accepst GET requests. All requests to this resource
+    require user authentication parameters (in the Authorization header).
+    The response data is JSON formatted, with the stopword list and stemmer
+    used in the interviews' metadata. Responses have an ETag, and requests
+    with a matching If-None-Match header receive an empty 304 response.
+    """
+    decorators = [auth.login_required]
+
+    def get(self):
+        headers = lexicon_data.headers(config.LEXICON_MAX_AGE)
+        if lexicon_data.matches(flask.request.headers.get('If-None-Match')):
+            return flask.Response(status=304, headers=headers)
+        return lexicon_data.response_data(), 200, headers
+
+
+class PoolStats(flask_restful.Resource):
+    """Resource class for access to the connection pool wait times and usage.
 
     This resource class accepst GET requests. All requests to this resource
     require user authentication parameters (in the Authorization header).
@@ -851,39 +961,12 @@ class InterviewSearchAnswers(flask_restful.Resource):
     """
     decorators = [auth.login_required]
 
-    def get(self, search_string):
-        try:
-            conn = postgresql_pool.getconn()
-            data = {}
-            with conn.cursor() as cur:
-                cur.execute(
-                    """SELECT id, answers,
-                            ts_rank_cd(tstext,
-                                       websearch_to_tsquery('portuguese',
-                                                            %(search_string)s),
-                                        1|4|32)
-                                as rank
-                        FROM interviews
-                        WHERE tstext @@
-                            websearch_to_tsquery('portuguese',
-                                                 %(search_string)s)
-                        ORDER BY rank DESC;""",
-                    {"search_string": search_string})
-                data['search_string'] = search_string
-                data['row_count'] = cur.rowcount
-                data['column_names'] = [desc[0] for desc in cur.description]
-                data['rows'] = cur.fetchall()
-                cur.close()
-            postgresql_pool.putconn(conn)
-        except (Exception, psycopg2.Error) as e:
-            return {
-                "message": str(e),
-            }, 500
-        return data
+    def get(self):
+        return postgresql_pool.stats()
 
 
-class InterviewSearchMeta(flask_restful.Resource):
-    """Resource class for access to interview metadata, searching by a string.
+class SearchCacheStats(flask_restful.Resource):
+    """Resource class for access to the search result cache counters.
 
     This resource class accepst GET requests. All requests to this resource
     require user authentication parameters (in the Authorization header).
@@ -891,48 +974,48 @@ class InterviewSearchMeta(flask_restful.Resource):
     """
     decorators = [auth.login_required]
 
-    def get(self, search_string):
-        try:
-            conn = postgresql_pool.getconn()
-            data = {}
-            with conn.cursor() as cur:
-                cur.execute(
-                    """SELECT id, meta,
-                            ts_rank_cd(tstext,
-                                       websearch_to_tsquery('portuguese',
-                                                            %(search_string)s),
-                                        1|4|32)
-                                as rank
-                        FROM interviews
-                        WHERE tstext @@
-                            websearch_to_tsquery('portuguese',
-                                                 %(search_string)s)
-                        ORDER BY rank DESC;""",
-                    {"search_string": search_string})
-                data['search_string'] = search_string
-                data['row_count'] = cur.rowcount
-                data['column_names'] = [desc[0] for desc in cur.description]
-                data['rows'] = cur.fetchall()
-                data['stemmer'] = 'RSLP Stemmer'
-                data['stopwords'] = nltk.corpus.stopwords.words('portuguese')
-                cur.close()
-            postgresql_pool.putconn(conn)
-        except (Exception, psycopg2.Error) as e:
-            return {
-                "message": str(e),
-            }, 500
-        return data
+    def get(self):
+        return result_cache.stats()
+
+
+class SlowQueries(flask_restful.Resource):
+    """Resource class for access to the top offenders of the slow-query log.
+
+    This resource class accepts GET requests, with optional 'limit' and
+    'order' (total_ms, max_ms or count) query parameters. All requests to
+    this resource require authentication of an user in config.ADMIN_USERS.
+    The response data is JSON formatted, with the statements, parameters,
+    durations and last EXPLAIN plans of the slowest queries.
+    """
+    decorators = [auth.login_required]
+
+    def get(self):
+        if flask.g.user[0] not in config.ADMIN_USERS:
+            return {"message": "Only admin users may access this route."}, 403
+        if slow_query_log is None:
+            return {"message": "The slow-query log is disabled."}, 404
+        args = slow_queries_parser.parse_args()
+        return slow_query_log.top(args['limit'], args['order'])
 
 
 # Main script #2
 if __name__ == "__main__":
+    # Adding representations, metrics and response compression
+    for media_type in representations.ENCODERS:
+        api.representation(media_type)(representation_output(media_type))
+    app.before_request(metrics.start_request)
+    app.after_request(record_metrics)
+    app.after_request(compress_response)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
     # Adding resources to api
     api.add_resource(Users, '/users')
+    api.add_resource(UserToken, '/users/token')
     api.add_resource(InterviewAll, '/interviews/all')
     api.add_resource(InterviewAllText, '/interviews/all/text')
     api.add_resource(InterviewAllQuestions, '/interviews/all/questions')
     api.add_resource(InterviewAllAnswers, '/interviews/all/answers')
     api.add_resource(InterviewAllMeta, '/interviews/all/meta')
+    api.add_resource(InterviewAllBow, '/interviews/all/meta/bow')
     api.add_resource(InterviewAny, '/interviews/<int_list:ids>')
     api.add_resource(InterviewAnyText, '/interviews/<int_list:ids>/text')
     api.add_resource(InterviewAnyQuestions,
@@ -948,5 +1031,9 @@ if __name__ == "__main__":
                      '/interviews/<string:search_string>/answers')
     api.add_resource(InterviewSearchMeta,
                      '/interviews/<string:search_string>/meta')
+    api.add_resource(MetaLexicon, '/meta/lexicon')
+    api.add_resource(SearchCacheStats, '/cache/search')
+    api.add_resource(PoolStats, '/stats/pool')
+    api.add_resource(SlowQueries, '/admin/slow-queries')
     # TODO: configure ssl_context for secure (https) connections
-    app.run(debug=args.debug)
+    app.run(debug=args.debug, threaded=True)
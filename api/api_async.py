@@ -0,0 +1,924 @@
+"""Asyncio application for connection to GEO database. Use -h for more help.
+
+This application serves the same routes as the Flask application (api.py),
+with the same SQL statements and response shapes (from queries.py), on an
+ASGI stack (Starlette and uvicorn) with an asynchronous connection pool
+(aiopg). Slow full-text searches do not block other requests, and a single
+process may keep many concurrent requests in flight.
+"""
+import argparse
+import asyncio
+import base64
+import binascii
+import contextlib
+import functools
+import json
+import re
+import time
+
+import aiopg
+import nltk
+import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+import starlette.applications
+import starlette.convertors
+import starlette.datastructures
+import starlette.middleware
+import starlette.responses
+import starlette.routing
+import uvicorn
+
+import bow_export
+import credentials
+import lexicon
+import metrics
+import queries
+import representations
+import search_cache
+import serialization
+import settings
+import slow_queries
+from settings import config
+
+
+def generate_argparser():
+    """Return ArgumentParser object for database connection."""
+    parser = argparse.ArgumentParser(
+        description='Asyncio application for connection to GEO database.',
+        epilog='Report bugs to <https://github.com/andremsouza/ic-geo>')
+    settings.add_connection_arguments(parser)
+    settings.add_pool_arguments(parser)
+    parser.add_argument('--listen',
+                        action='store',
+                        default='127.0.0.1',
+                        type=str,
+                        required=False,
+                        help='address to listen on (default=127.0.0.1)',
+                        metavar='ADDRESS',
+                        dest='listen')
+    parser.add_argument('--listen-port',
+                        action='store',
+                        default=5000,
+                        type=int,
+                        required=False,
+                        help='port to listen on (default=5000)',
+                        metavar='LISTEN-PORT',
+                        dest='listen_port')
+    return parser
+
+
+class IntListConvertor(starlette.convertors.Convertor):
+    """Custom convertor for parsing of a list of integers in the request URL.
+
+    Equivalent to the IntListConverter of api.py, for Starlette routes.
+
+    Example:
+        str('1, 2, 3 ,4,5 , 6, 11, 20, ') -> list([1, 2, 3, 4, 5, 11, 20])
+    """
+
+    # Defining regular expressions for pattern matching
+    regex = r'\s*\d+\s*(?:,\s*\d+\s*)*,?\s*'
+
+    def convert(self, value):
+        """Convert string matched by regex to a list of ints."""
+        return [
+            int(i.strip()) for i in value.split(',')
+            if re.match(r'\d+', i.strip())
+        ]
+
+    def to_string(self, value):
+        """Convert a list of ints to a standardized string representation."""
+        return ','.join(str(i) for i in value)
+
+
+starlette.convertors.register_url_convertor('int_list', IntListConvertor())
+
+
+def json_response(data, status_code=200, headers=None):
+    """Return a JSON response, as in flask_restful's representation."""
+    return starlette.responses.Response(json.dumps(data),
+                                        status_code=status_code,
+                                        headers=headers,
+                                        media_type='application/json')
+
+
+def data_response(request, data, status_code=200, headers=None):
+    """Return a response in the representation negotiated by the Accept
+    header of a request (JSON, MessagePack or NDJSON), as in api.py."""
+    media_type = representations.negotiate_type(
+        request.headers.get('accept'))
+    with metrics.phase('serialize'):
+        body = representations.ENCODERS[media_type](data)
+    return starlette.responses.Response(
+        body,
+        status_code=status_code,
+        headers=headers,
+        media_type=media_type)
+
+
+class MetricsMiddleware(object):
+    """ASGI middleware adding requests to a metrics.Metrics object
+    ('request_metrics'), as record_metrics of api.py.
+
+    Requests are labeled with the path of their route ('paths' maps route
+    endpoints to paths). Response bytes are counted as sent (i.e.,
+    compressed), including streamed responses.
+    """
+    def __init__(self, app, request_metrics, paths):
+        self.app = app
+        self.request_metrics = request_metrics
+        self.paths = paths
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        metrics.start_request()
+        response = {'status': None, 'size': 0}
+
+        async def send_counted(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+            elif message['type'] == 'http.response.body':
+                response['size'] += len(message.get('body', b''))
+                if not message.get('more_body', False):
+                    self.request_metrics.finish_request(
+                        self.paths.get(scope.get('endpoint'), 'unmatched'),
+                        scope['method'], response['status'],
+                        response['size'])
+            await send(message)
+
+        await self.app(scope, receive, send_counted)
+
+
+class CompressionMiddleware(object):
+    """ASGI middleware compressing responses with the coding negotiated by
+    the Accept-Encoding header (brotli or gzip), as in api.py.
+
+    Responses smaller than config.COMPRESSION_MIN_SIZE bytes or of binary
+    media types are not compressed. Streamed responses (with more than one
+    body message) are compressed message by message, without Content-Length.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        request_headers = starlette.datastructures.Headers(scope=scope)
+        encoding = representations.negotiate_encoding(
+            request_headers.get('accept-encoding'))
+        state = {'start': None, 'stream': None}
+
+        async def send_compressed(message):
+            if message['type'] == 'http.response.start':
+                headers = starlette.datastructures.MutableHeaders(
+                    scope=message)
+                if (message['status'] in (204, 304)
+                        or 'content-encoding' in headers
+                        or not representations.compressible(
+                            headers.get('content-type'))):
+                    return await send(message)
+                headers.add_vary_header('Accept-Encoding')
+                if encoding is None:
+                    return await send(message)
+                state['start'] = message  # delayed until the first body
+                return
+            if message['type'] != 'http.response.body' or (
+                    state['start'] is None and state['stream'] is None):
+                return await send(message)
+            start, state['start'] = state['start'], None
+            body = message.get('body', b'')
+            more_body = message.get('more_body', False)
+            if start is not None and not more_body:
+                # Single body message
+                headers = starlette.datastructures.MutableHeaders(
+                    scope=start)
+                if len(body) >= config.COMPRESSION_MIN_SIZE:
+                    body = representations.compress(
+                        body, encoding, config.COMPRESSION_LEVEL)
+                    headers['Content-Encoding'] = encoding
+                    headers['Content-Length'] = str(len(body))
+                await send(start)
+                return await send({
+                    'type': 'http.response.body',
+                    'body': body,
+                    'more_body': False
+                })
+            if start is not None:
+                # First message of a streamed body
+                headers = starlette.datastructures.MutableHeaders(
+                    scope=start)
+                del headers['Content-Length']
+                headers['Content-Encoding'] = encoding
+                await send(start)
+                state['stream'] = representations.Compressor(
+                    encoding, config.COMPRESSION_LEVEL)
+            body = state['stream'].process(body)
+            if not more_body:
+                body += state['stream'].finish()
+            await send({
+                'type': 'http.response.body',
+                'body': body,
+                'more_body': more_body
+            })
+
+        await self.app(scope, receive, send_compressed)
+
+
+def error_response(e):
+    """Return the JSON error response for an exception of a database query."""
+    if isinstance(e, psycopg2.errors.InsufficientPrivilege):
+        return json_response(
+            {"message": "Insufficient privileges for this operation."}, 401)
+    if isinstance(e, psycopg2.errors.UniqueViolation):
+        return json_response(
+            {"message": "Unique Violation. This user already exists."}, 409)
+    if isinstance(e, psycopg2.OperationalError):
+        return json_response(
+            {"message": "Unable to connect to database. " + str(e)}, 500)
+    return json_response({"message": str(e)}, 500)
+
+
+def get_argument(request, name, type, default=None, help=None):
+    """Return a query parameter of a request, converted by 'type'.
+
+    Raises ValueError with a flask_restful style message on invalid values.
+    """
+    value = request.query_params.get(name)
+    if value is None:
+        return default
+    try:
+        return type(value)
+    except (TypeError, ValueError):
+        raise ValueError({name: help or 'invalid value'})
+
+
+def positive(value):
+    """Return value as an int, if it is a positive integer (1+)."""
+    value = int(value)
+    if value < 1:
+        raise ValueError(value)
+    return value
+
+
+def natural(value):
+    """Return value as an int, if it is a natural number (0+)."""
+    value = int(value)
+    if value < 0:
+        raise ValueError(value)
+    return value
+
+
+def boolean(value):
+    """Return value as a bool, from 'true'/'false', '1'/'0' or 'on'/'off'."""
+    value = value.lower()
+    if value in ('true', '1', 'on'):
+        return True
+    if value in ('false', '0', 'off'):
+        return False
+    raise ValueError(value)
+
+
+def search_field(value):
+    """Return value, if it is a key of queries.SEARCH_FIELDS."""
+    if value not in queries.SEARCH_FIELDS:
+        raise ValueError(value)
+    return value
+
+
+def slow_query_order(value):
+    """Return value, if it is a sort key of SlowQueryLog.top()."""
+    if value not in ('total_ms', 'max_ms', 'count'):
+        raise ValueError(value)
+    return value
+
+
+def basic_credentials(request):
+    """Return the (username, password) of Basic authorization, or Nones."""
+    scheme, _, value = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'basic':
+        return None, None
+    try:
+        username, _, password = base64.b64decode(
+            value.strip()).decode('utf-8').partition(':')
+    except (binascii.Error, UnicodeDecodeError):
+        return None, None
+    return username, password
+
+
+async def authenticate(request, basic_only=False):
+    """Return the user row (username, password) of the request's
+    Authorization header, or None.
+
+    Basic credentials are checked against the credential cache, and then
+    against the api_users table. Password verification (pbkdf2_sha256) runs
+    in the default executor, so it does not block the event loop.
+    Bearer tokens are accepted, unless basic_only is true, and checked against
+    the api_users table, so tokens of deleted users, or issued before a
+    password change, are rejected.
+    """
+    state = request.app.state
+    scheme, _, value = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() == 'bearer' and not basic_only:
+        payload = state.token_signer.verify(value.strip())
+        if payload is None:
+            return None
+        username, fingerprint = payload
+        async with acquire(state.pool) as conn:
+            async with conn.cursor() as cur:
+                await execute(cur, 'user_select', {"username": username})
+                user = await cur.fetchone()
+        return user if state.token_signer.matches(fingerprint, user) else None
+    username, password = basic_credentials(request)
+    if username is None:
+        return None
+    user = state.credential_cache.get(username, password)
+    if user:
+        return user
+    async with acquire(state.pool) as conn:
+        async with conn.cursor() as cur:
+            await execute(cur, 'user_select', {"username": username})
+            user = await cur.fetchone()
+    if not user:
+        return None
+    verified = await asyncio.get_running_loop().run_in_executor(
+        None, config.pwd_context.verify, password, user[1])
+    if not verified:
+        return None
+    state.credential_cache.add(username, password, user)
+    return user
+
+
+def login_required(basic_only=False):
+    """Return a decorator for endpoints that require user authentication.
+
+    The authenticated user row is stored in request.state.user, and its
+    username in request.state.username.
+    """
+    def decorator(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(request):
+            try:
+                with metrics.phase('auth'):
+                    user = await authenticate(request, basic_only)
+            except (Exception, psycopg2.Error) as e:
+                return error_response(e)
+            if user is None:
+                return starlette.responses.Response(
+                    'Unauthorized Access',
+                    status_code=401,
+                    headers={
+                        'WWW-Authenticate':
+                        'Basic realm="Authentication Required"'
+                    })
+            request.state.user = user
+            request.state.username = user[0]
+            return await endpoint(request)
+
+        return wrapper
+
+    return decorator
+
+
+@contextlib.asynccontextmanager
+async def acquire(pool):
+    """Context manager for a pool connection, timing the 'pool_wait' phase
+    of the request."""
+    with metrics.phase('pool_wait'):
+        conn = await pool.acquire()
+    try:
+        yield conn
+    finally:
+        await pool.release(conn)
+
+
+async def execute(cur, name, parameters=None):
+    """Execute a statement from the queries.STATEMENTS registry, by name, as
+    queries.execute() does for psycopg2 connections.
+
+    The statement is prepared on its first use in the cursor's pooled
+    connection (tracked in a 'prepared' set of the aiopg connection), and
+    executed with EXECUTE afterwards. The execution time is added to the
+    'query' phase, and observed by queries.slow_query_log, if set (also for
+    statements that fail).
+    """
+    statement = queries.STATEMENTS[name]
+    conn = cur.connection
+    prepared = getattr(conn, 'prepared', None)
+    if prepared is None:
+        prepared = conn.prepared = set()
+    with metrics.phase('query'):
+        if name not in prepared:
+            await cur.execute(statement.prepare)
+            prepared.add(name)
+        start = time.perf_counter()
+        error = None
+        try:
+            await cur.execute(statement.execute, parameters)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            if queries.slow_query_log is not None:
+                queries.slow_query_log.observe(statement.sql, parameters,
+                                               time.perf_counter() - start,
+                                               name, error)
+
+
+async def fetchall(cur):
+    """Return all rows of a cursor, timing the 'fetch' phase and counting
+    the rows of the request."""
+    with metrics.phase('fetch'):
+        rows = await cur.fetchall()
+    metrics.add_rows(len(rows))
+    return rows
+
+
+async def fetch(pool, name, parameters=None, raw_json=False):
+    """Execute a statement in a pool connection, by name (see execute()).
+    Return column names and rows.
+
+    With 'raw_json', json/jsonb values are fetched as serialization.RawJSON.
+    """
+    async with acquire(pool) as conn:
+        async with conn.cursor() as cur:
+            if raw_json:
+                serialization.register_raw_json(cur.raw)
+            await execute(cur, name, parameters)
+            rows = await fetchall(cur)
+            return [desc[0] for desc in cur.description], rows
+
+
+async def users_post(request):
+    """POST /users handler. Creates a new API user."""
+    db_username, db_password = basic_credentials(request)
+    body = await request.json()
+    new_username = body.get('new_username')
+    new_password = body.get('new_password')
+    if None in [db_username, db_password, new_username, new_password]:
+        return json_response(
+            {
+                "message":
+                "Required parameters:\n" +
+                "json:[new_username, new_password]\n" +
+                "authorization:[username, password]\n",
+            }, 400)
+    try:
+        password = await asyncio.get_running_loop().run_in_executor(
+            None, config.pwd_context.hash, new_password)
+        async with aiopg.connect(
+                connection_dsn(request, db_username, db_password)) as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(queries.USER_INSERT, {
+                    'username': new_username,
+                    'password': password
+                })
+    except (Exception, psycopg2.Error) as e:
+        return error_response(e)
+    return json_response(
+        {
+            'message': 'API user created successfully.',
+            'username': new_username
+        }, 201)
+
+
+@login_required(basic_only=True)
+async def users_put(request):
+    """PUT /users handler. Changes an API user's password."""
+    username = request.state.username
+    body = await request.json()
+    new_password = body.get('new_password')
+    if new_password is None:
+        return json_response(
+            {
+                "message":
+                "Required parameters:\n" + "json:[new_password]\n" +
+                "authorization:[username, password]",
+            }, 400)
+    try:
+        password = await asyncio.get_running_loop().run_in_executor(
+            None, config.pwd_context.hash, new_password)
+        async with request.app.state.pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(queries.USER_UPDATE, {
+                    'username': username,
+                    'new_password': password,
+                })
+        request.app.state.credential_cache.invalidate(username)
+    except (Exception, psycopg2.Error) as e:
+        return error_response(e)
+    return json_response(
+        {
+            'message': 'Password changed successfully.',
+            'username': username,
+        }, 200)
+
+
+async def users_delete(request):
+    """DELETE /users handler. Deletes an API user."""
+    db_username, db_password = basic_credentials(request)
+    body = await request.json()
+    username = body.get('username')
+    if None in [db_username, db_password, username]:
+        return json_response(
+            {
+                "message":
+                "Required parameters:\n" + "json:[username]\n" +
+                "authorization:[username, password]",
+            }, 400)
+    try:
+        async with aiopg.connect(
+                connection_dsn(request, db_username, db_password)) as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(queries.USER_DELETE, {
+                    'username': username,
+                })
+        request.app.state.credential_cache.invalidate(username)
+    except (Exception, psycopg2.Error) as e:
+        return error_response(e)
+    return json_response({'username': username}, 200)
+
+
+def connection_dsn(request, username, password):
+    """Return a connection string for the database, as another user."""
+    return psycopg2.extensions.make_dsn(request.app.state.dsn,
+                                        user=username,
+                                        password=password)
+
+
+@login_required(basic_only=True)
+async def user_token(request):
+    """POST /users/token handler. Issues a new token for the API user."""
+    username = request.state.username
+    return json_response(
+        {
+            'token': request.app.state.token_signer.issue(request.state.user),
+            'token_type': 'Bearer',
+            'expires_in': request.app.state.token_signer.ttl,
+            'username': username,
+        }, 201)
+
+
+def interview_all(projection):
+    """Return the endpoint for paginated access to all interviews.
+
+    Equivalent to the InterviewAllResource classes of api.py. In streaming
+    mode, rows are read in keyset-paginated batches of
+    config.STREAM_ITERSIZE rows, as aiopg does not support named cursors.
+    """
+    columns = queries.PROJECTIONS[projection]
+    name = 'all_' + projection
+
+    @login_required()
+    async def endpoint(request):
+        try:
+            limit = get_argument(request, 'limit', positive, None,
+                                 'maximum number of rows (positive integer)')
+            after_id = get_argument(request, 'after_id', natural, 0,
+                                    'id of the last row of the previous page')
+            stream = get_argument(request, 'stream', boolean, False,
+                                  'stream rows as NDJSON (true or false)')
+        except ValueError as e:
+            return json_response({'message': e.args[0]}, 400)
+        pool = request.app.state.pool
+        if stream:
+
+            async def generate(after_id=after_id, remaining=limit):
+                while remaining is None or remaining > 0:
+                    size = config.STREAM_ITERSIZE
+                    if remaining is not None:
+                        size = min(size, remaining)
+                        remaining -= size
+                    _, rows = await fetch(pool,
+                                          name, {
+                                              'after_id': after_id,
+                                              'limit': size
+                                          },
+                                          raw_json=True)
+                    for row in rows:
+                        yield serialization.dumps(dict(zip(columns,
+                                                           row))) + b'\n'
+                    if len(rows) < size:
+                        break
+                    after_id = rows[-1][0]
+
+            return starlette.responses.StreamingResponse(
+                generate(), media_type='application/x-ndjson')
+        limit = min(limit or config.PAGE_SIZE, config.MAX_PAGE_SIZE)
+        try:
+            column_names, rows = await fetch(pool,
+                                             name, {
+                                                 'after_id': after_id,
+                                                 'limit': limit
+                                             },
+                                             raw_json=True)
+        except (Exception, psycopg2.Error) as e:
+            return error_response(e)
+        data = queries.page_response(column_names, rows, limit, after_id)
+        if projection == 'meta':
+            data.update(queries.meta_fields(request.app.state.lexicon))
+        return data_response(request, data)
+
+    return endpoint
+
+
+def interview_any(projection):
+    """Return the endpoint for access to a list of interviews.
+
+    Equivalent to the InterviewAnyResource classes of api.py.
+    """
+    name = 'any_' + projection
+
+    @login_required()
+    async def endpoint(request):
+        ids = request.path_params['ids']
+        try:
+            column_names, rows = await fetch(request.app.state.pool,
+                                             name, {"id_list": ids},
+                                             raw_json=True)
+        except (Exception, psycopg2.Error) as e:
+            return error_response(e)
+        data = queries.any_response(ids, column_names, rows)
+        if projection == 'meta':
+            data.update(queries.meta_fields(request.app.state.lexicon))
+        return data_response(request, data)
+
+    return endpoint
+
+
+def interview_search(projection, default_field='text'):
+    """Return the endpoint for access to interviews, searching by a string.
+
+    Equivalent to the InterviewSearchResource classes of api.py, sharing the
+    same search cache behavior.
+    """
+    @login_required()
+    async def endpoint(request):
+        search_string = request.path_params['search_string']
+        try:
+            limit = get_argument(request, 'limit', positive, None,
+                                 'maximum number of rows (positive integer)')
+            offset = get_argument(request, 'offset', natural, 0,
+                                  'number of ranked rows to skip')
+            min_rank = get_argument(request, 'min_rank', float, 0.0,
+                                    'minimum rank of the returned rows')
+            ids_only = get_argument(
+                request, 'ids_only', boolean, False,
+                'return only ids and ranks (true or false)')
+            field = get_argument(
+                request, 'field', search_field, default_field,
+                'searched field: ' + ', '.join(queries.SEARCH_FIELDS))
+        except ValueError as e:
+            return json_response({'message': e.args[0]}, 400)
+        limit = min(limit or config.SEARCH_PAGE_SIZE, config.MAX_PAGE_SIZE)
+        selected = 'ids' if ids_only else projection
+        key = queries.search_key(search_string, selected, field, limit,
+                                 offset, min_rank)
+        state = request.app.state
+        try:
+            async with acquire(state.pool) as conn:
+                async with conn.cursor() as cur:
+                    serialization.register_raw_json(cur.raw)
+                    await execute(cur, 'version_select')
+                    version = (await cur.fetchone())[0]
+                    data = state.result_cache.get(key, version)
+                    if data is None:
+                        await execute(
+                            cur, 'search_%s_%s' % (selected, field), {
+                                "search_string": search_string,
+                                "weights": config.SEARCH_RANK_WEIGHTS,
+                                "min_rank": min_rank,
+                                "limit": limit,
+                                "offset": offset,
+                            })
+                        data = queries.search_response(
+                            [desc[0] for desc in cur.description], await
+                            fetchall(cur), field, limit, offset, min_rank)
+                        state.result_cache.put(key, version, data)
+        except (Exception, psycopg2.Error) as e:
+            return error_response(e)
+        data['search_string'] = search_string
+        if projection == 'meta':
+            data.update(queries.meta_fields(request.app.state.lexicon))
+        return data_response(request, data)
+
+    return endpoint
+
+
+@login_required()
+async def interview_bow(request):
+    """GET /interviews/all/meta/bow handler. Returns the .npz export of the
+    interviews' bags-of-words, as InterviewAllBow of api.py.
+
+    Rows are fetched in keyset batches, and the export is built in the
+    default executor, only when the interviews table changed.
+    """
+    state = request.app.state
+    try:
+        _, rows = await fetch(state.pool, 'version_select')
+        version = rows[0][0]
+        path = state.bow_cache.get(version)
+        if path is None:
+            async with state.bow_lock:
+                path = state.bow_cache.get(version)
+                if path is None:
+                    rows = []
+                    after_id = -1
+                    while True:
+                        _, batch = await fetch(state.pool, 'bow_select', {
+                            'after_id': after_id,
+                            'limit': config.MAX_PAGE_SIZE
+                        })
+                        rows.extend(batch)
+                        if len(batch) < config.MAX_PAGE_SIZE:
+                            break
+                        after_id = batch[-1][0]
+                    path = await asyncio.get_running_loop().run_in_executor(
+                        None, lambda: state.bow_cache.put(
+                            version, bow_export.build(rows)))
+    except (Exception, psycopg2.Error) as e:
+        return error_response(e)
+    return starlette.responses.FileResponse(
+        path,
+        media_type='application/octet-stream',
+        filename='bow_%d.npz' % version)
+
+
+@login_required()
+async def search_cache_stats(request):
+    """GET /cache/search handler. Returns the search cache counters."""
+    return json_response(request.app.state.result_cache.stats())
+
+
+@login_required()
+async def admin_slow_queries(request):
+    """GET /admin/slow-queries handler. Returns the top offenders of the
+    slow-query log to users in config.ADMIN_USERS, as SlowQueries of api.py.
+    """
+    if request.state.username not in config.ADMIN_USERS:
+        return json_response(
+            {"message": "Only admin users may access this route."}, 403)
+    slow_query_log = request.app.state.slow_query_log
+    if slow_query_log is None:
+        return json_response({"message": "The slow-query log is disabled."},
+                             404)
+    try:
+        limit = get_argument(request, 'limit', positive, 20,
+                             'maximum number of queries (positive integer)')
+        order = get_argument(request, 'order', slow_query_order, 'total_ms',
+                             'sort key (total_ms, max_ms or count)')
+    except ValueError as e:
+        return json_response({'message': e.args[0]}, 400)
+    return json_response(slow_query_log.top(limit, order))
+
+
+@login_required()
+async def metrics_endpoint(request):
+    """GET /metrics handler. Returns the request metrics and the connection
+    pool occupancy, in the Prometheus text format, to users in
+    config.ADMIN_USERS, as metrics_view of api.py."""
+    if request.state.username not in config.ADMIN_USERS:
+        return json_response(
+            {"message": "Only admin users may access this route."}, 403)
+    pool = request.app.state.pool
+    gauges = {
+        'pool_size': ('Open connections of the pool.', pool.size),
+        'pool_free': ('Free connections of the pool.', pool.freesize),
+        'pool_max_connections': ('Maximum connections of the pool.',
+                                 pool.maxsize),
+    }
+    return starlette.responses.Response(
+        request.app.state.metrics.render(gauges),
+        headers={'Content-Type': metrics.CONTENT_TYPE})
+
+
+@login_required()
+async def meta_lexicon(request):
+    """GET /meta/lexicon handler. Returns the stopwords and stemmer of the
+    metadata, with an ETag, or an empty 304 response if it matches."""
+    lexicon_data = request.app.state.lexicon
+    headers = lexicon_data.headers(config.LEXICON_MAX_AGE)
+    if lexicon_data.matches(request.headers.get('If-None-Match')):
+        return starlette.responses.Response(status_code=304, headers=headers)
+    return json_response(lexicon_data.response_data(), headers=headers)
+
+
+def generate_routes():
+    """Return the list of routes, in the same paths of api.py.
+
+    Static paths are listed first, then the int_list paths, so lists of ids
+    are not matched as search strings.
+    """
+    routes = [
+        starlette.routing.Route('/users', users_post, methods=['POST']),
+        starlette.routing.Route('/users', users_put, methods=['PUT']),
+        starlette.routing.Route('/users', users_delete, methods=['DELETE']),
+        starlette.routing.Route('/users/token', user_token, methods=['POST']),
+        starlette.routing.Route('/meta/lexicon', meta_lexicon),
+        starlette.routing.Route('/cache/search', search_cache_stats),
+        starlette.routing.Route('/metrics', metrics_endpoint),
+        starlette.routing.Route('/admin/slow-queries', admin_slow_queries),
+        starlette.routing.Route('/interviews/all', interview_all('all')),
+    ]
+    for projection in ('text', 'questions', 'answers', 'meta'):
+        routes.append(
+            starlette.routing.Route('/interviews/all/' + projection,
+                                    interview_all(projection)))
+    routes.append(
+        starlette.routing.Route('/interviews/all/meta/bow', interview_bow))
+    routes.append(
+        starlette.routing.Route('/interviews/{ids:int_list}',
+                                interview_any('all')))
+    for projection in ('text', 'questions', 'answers', 'meta'):
+        routes.append(
+            starlette.routing.Route('/interviews/{ids:int_list}/' + projection,
+                                    interview_any(projection)))
+    routes.append(
+        starlette.routing.Route('/interviews/{search_string}',
+                                interview_search('all')))
+    for projection, field in (('text', 'text'), ('questions', 'questions'),
+                              ('answers', 'answers'), ('meta', 'text')):
+        routes.append(
+            starlette.routing.Route(
+                '/interviews/{search_string}/' + projection,
+                interview_search(projection, field)))
+    return routes
+
+
+def generate_app(args):
+    """Return the Starlette application, connected with the given arguments.
+
+    The aiopg connection pool is created on startup, and closed on shutdown.
+    """
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        print("Establishing connection pool to database...")
+        app.state.pool = await aiopg.create_pool(
+            app.state.dsn,
+            minsize=args.min_connections,
+            maxsize=args.max_connections)
+        print("Connection pool created successfully")
+        yield
+        app.state.pool.close()
+        await app.state.pool.wait_closed()
+        if app.state.slow_query_log is not None:
+            await asyncio.get_running_loop().run_in_executor(
+                None, app.state.slow_query_log.close,
+                config.SLOW_QUERY_EXPLAIN_TIMEOUT)
+
+    routes = generate_routes()
+    request_metrics = metrics.Metrics()
+    app = starlette.applications.Starlette(
+        routes=routes,
+        middleware=[
+            starlette.middleware.Middleware(
+                MetricsMiddleware,
+                request_metrics=request_metrics,
+                paths={route.endpoint: route.path
+                       for route in routes}),
+            starlette.middleware.Middleware(CompressionMiddleware),
+        ],
+        lifespan=lifespan)
+    app.state.metrics = request_metrics
+    app.state.dsn = psycopg2.extensions.make_dsn(dbname=args.dbname,
+                                                 user=args.username,
+                                                 password=args.password,
+                                                 host=args.hostname,
+                                                 port=args.port)
+    app.state.credential_cache = credentials.CredentialCache(
+        config.CREDENTIAL_CACHE_TTL, config.CREDENTIAL_CACHE_SIZE)
+    app.state.token_signer = credentials.TokenSigner(config.TOKEN_SECRET_KEY,
+                                                     config.TOKEN_TTL)
+    app.state.result_cache = search_cache.SearchCache(
+        config.SEARCH_CACHE_MAX_BYTES)
+    app.state.lexicon = lexicon.Lexicon()
+    app.state.bow_cache = bow_export.ExportCache(config.BOW_EXPORT_DIR)
+    app.state.bow_lock = asyncio.Lock()
+    app.state.slow_query_log = None
+    if config.SLOW_QUERY_MS is not None:
+        app.state.slow_query_log = slow_queries.SlowQueryLog(
+            config.SLOW_QUERY_MS,
+            connect=functools.partial(psycopg2.connect, app.state.dsn)
+            if config.SLOW_QUERY_EXPLAIN else None,
+            path=config.SLOW_QUERY_LOG,
+            explain_timeout=config.SLOW_QUERY_EXPLAIN_TIMEOUT)
+        queries.slow_query_log = app.state.slow_query_log
+
+    return app
+
+
+# Main script
+if __name__ == "__main__":
+    # Parse command line arguments
+    parser = generate_argparser()
+    args = parser.parse_args()
+
+    # Setting up nltk resources
+    print("Downloading resources from NLTK...")
+    nltk.download('stopwords')
+
+    # Initializing and running app
+    print("Initializing asyncio application...")
+    app = generate_app(args)
+    uvicorn.run(app, host=args.listen, port=args.listen_port)
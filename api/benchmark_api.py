@@ -0,0 +1,671 @@
+"""Load-testing and latency benchmark of the GEO API. Use -h for more help.
+
+Drives the routes of a running API server (api.py or api_async.py) at a
+given concurrency, and reports, for each route, the throughput and the
+p50/p95/p99 latencies and mean bytes of its responses. Results are saved as
+JSON (with -o), and may be compared with the results of a previous run (with
+-b).
+
+Optionally, the database is seeded with synthetic interviews (with -s), and
+a benchmark API user is created, both removed after the run (unless --keep is
+given). Interviews are generated by a corpus model of database/synthetic.py
+(learned from the database, or read from --model), and loaded with
+database/loader.py, skipping existing ids; only the interviews and athletes
+actually inserted are removed. The PUT /users route is run as a throwaway API
+user, as changing the password of an user invalidates its cached
+credentials and tokens. Seeding and the users routes require database
+credentials with INSERT and DELETE permissions (e.g., of the api_admin role),
+and seeding requires the requirements of the database scripts.
+
+Routes:
+    all       /interviews/all[/<projection>], paginated and streamed
+    any       /interviews/<ids>[/<projection>]
+    search    /interviews/<search_string>[/<projection>]
+    users     POST /users/token, PUT /users, POST and DELETE /users
+    meta      /meta/lexicon, /interviews/all/meta/bow, /cache/search
+"""
+import argparse
+import base64
+import collections
+import datetime
+import http.client
+import itertools
+import json
+import math
+import os
+import queue
+import random
+import secrets
+import sys
+import threading
+import time
+import urllib.parse
+
+import psycopg2
+
+import queries
+import settings
+from settings import config
+
+# Directory of the database scripts (loader.py and synthetic.py)
+DATABASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            os.pardir, 'database')
+
+# Terms of benchmark search strings
+SEARCH_TERMS = (
+    'jogo', 'time', 'campeonato', 'treino', 'vitória', 'derrota', 'gol',
+    'partida', 'equipe', 'técnico', 'torcida', 'estádio', 'temporada',
+    'adversário', 'resultado', 'pontos', 'classificação', 'final', 'semana',
+    'momento', 'trabalho', 'grupo', 'elenco', 'lesão', 'recuperação',
+    'defesa', 'ataque', 'bola', 'campo', 'jogador', 'atleta', 'seleção',
+    'copa', 'medalha', 'olimpíada', 'prova', 'recorde', 'tempo', 'corrida',
+    'nadar', 'piscina', 'quadra', 'set', 'saque', 'rede', 'cesta',
+    'arremesso', 'pênalti', 'falta', 'árbitro', 'cartão', 'minuto',
+    'carreira', 'família', 'sonho', 'objetivo', 'confiança', 'pressão',
+    'experiência', 'futuro')
+
+ROUTE_GROUPS = ('all', 'any', 'search', 'users', 'meta')
+
+Request = collections.namedtuple('Request',
+                                 ['route', 'method', 'path', 'body', 'auth'])
+
+
+def generate_argparser():
+    """Return ArgumentParser object for the benchmark."""
+    parser = argparse.ArgumentParser(
+        description='Load-testing and latency benchmark of the GEO API.',
+        epilog='Report bugs to <https://github.com/andremsouza/ic-geo>')
+    parser.add_argument('--url',
+                        action='store',
+                        default='http://127.0.0.1:5000',
+                        type=str,
+                        required=False,
+                        help='base URL of the API server ' +
+                        '(default=http://127.0.0.1:5000)',
+                        metavar='URL',
+                        dest='url')
+    parser.add_argument('-r',
+                        '--routes',
+                        action='store',
+                        default=','.join(ROUTE_GROUPS),
+                        type=str,
+                        required=False,
+                        help='comma-separated route groups: ' +
+                        ', '.join(ROUTE_GROUPS) + ' (default=all groups)',
+                        metavar='ROUTES',
+                        dest='routes')
+    parser.add_argument('-c',
+                        '--concurrency',
+                        action='store',
+                        default=8,
+                        type=int,
+                        required=False,
+                        help='number of concurrent clients (default=8)',
+                        metavar='CONCURRENCY',
+                        dest='concurrency')
+    parser.add_argument('-n',
+                        '--requests',
+                        action='store',
+                        default=50,
+                        type=int,
+                        required=False,
+                        help='number of requests per route (default=50)',
+                        metavar='REQUESTS',
+                        dest='requests')
+    parser.add_argument('-w',
+                        '--warmup',
+                        action='store',
+                        default=2,
+                        type=int,
+                        required=False,
+                        help='unrecorded requests per route, before the ' +
+                        'run (default=2)',
+                        metavar='WARMUP',
+                        dest='warmup')
+    parser.add_argument('-s',
+                        '--seed',
+                        action='store',
+                        default=0,
+                        type=int,
+                        required=False,
+                        help='number of synthetic interviews to insert ' +
+                        'before the run (default=0)',
+                        metavar='N',
+                        dest='seed')
+    parser.add_argument('--first-id',
+                        action='store',
+                        default=1000000,
+                        type=int,
+                        required=False,
+                        help='first id of synthetic interviews ' +
+                        '(default=1000000)',
+                        metavar='ID',
+                        dest='first_id')
+    parser.add_argument('--model',
+                        action='store',
+                        default=None,
+                        type=str,
+                        required=False,
+                        help='JSON file of the corpus model of synthetic ' +
+                        'interviews (see database/synthetic.py). It is ' +
+                        'learned from the database, and saved to MODEL, ' +
+                        'if it does not exist (default=none)',
+                        metavar='MODEL',
+                        dest='model')
+    parser.add_argument('--keep',
+                        action='store_true',
+                        help='keep synthetic interviews and the benchmark ' +
+                        'user after the run')
+    parser.add_argument('--random-seed',
+                        action='store',
+                        default=0,
+                        type=int,
+                        required=False,
+                        help='seed of the random generator (default=0)',
+                        metavar='SEED',
+                        dest='random_seed')
+    parser.add_argument('--ids',
+                        action='store',
+                        default=10,
+                        type=int,
+                        required=False,
+                        help='number of ids of "any" requests (default=10)',
+                        metavar='IDS',
+                        dest='ids')
+    parser.add_argument('--limit',
+                        action='store',
+                        default=config.PAGE_SIZE,
+                        type=int,
+                        required=False,
+                        help='page size of "all" and "search" requests ' +
+                        '(default=config.PAGE_SIZE)',
+                        metavar='LIMIT',
+                        dest='limit')
+    parser.add_argument('--auth',
+                        action='store',
+                        default='basic',
+                        type=str,
+                        choices=['basic', 'token'],
+                        required=False,
+                        help='authentication of interview requests: basic ' +
+                        'or token (default=basic)',
+                        metavar='AUTH',
+                        dest='auth')
+    parser.add_argument('--accept-encoding',
+                        action='store',
+                        default=None,
+                        type=str,
+                        required=False,
+                        help='Accept-Encoding header of requests (e.g., ' +
+                        '"gzip, br") (default=none)',
+                        metavar='ENCODINGS',
+                        dest='accept_encoding')
+    parser.add_argument('--api-user',
+                        action='store',
+                        default=None,
+                        type=str,
+                        required=False,
+                        help='API user name (default=a benchmark user, ' +
+                        'created with --seed)',
+                        metavar='API-USER',
+                        dest='api_user')
+    parser.add_argument('--api-password',
+                        action='store',
+                        default=None,
+                        type=str,
+                        required=False,
+                        help='API user password',
+                        metavar='API-PASSWORD',
+                        dest='api_password')
+    parser.add_argument('-o',
+                        '--output',
+                        action='store',
+                        default=None,
+                        type=str,
+                        required=False,
+                        help='JSON file of results (default=none)',
+                        metavar='OUTPUT',
+                        dest='output')
+    parser.add_argument('-b',
+                        '--baseline',
+                        action='store',
+                        default=None,
+                        type=str,
+                        required=False,
+                        help='JSON file of results of a previous run, to ' +
+                        'compare with (default=none)',
+                        metavar='BASELINE',
+                        dest='baseline')
+    settings.add_connection_arguments(parser)
+
+    return parser
+
+
+def import_database_modules():
+    """Return the loader and synthetic modules of the database scripts.
+
+    DATABASE_DIR is inserted first in sys.path, as its lexicon module has
+    the name of the lexicon module of the API (not used by the benchmark).
+    """
+    if DATABASE_DIR not in sys.path:
+        sys.path.insert(0, DATABASE_DIR)
+    import loader
+    import synthetic
+    return loader, synthetic
+
+
+def corpus_model(conn, path=None):
+    """Return the synthetic.CorpusModel of a JSON file, or learned from the
+    interviews of the database (and saved to 'path', if given)."""
+    _, synthetic = import_database_modules()
+    if path and os.path.exists(path):
+        return synthetic.CorpusModel.load(path)
+    model = synthetic.CorpusModel.learn(synthetic.fetch_rows(conn))
+    conn.rollback()
+    if path:
+        model.save(path)
+    return model
+
+
+def seed(conn, model, first_id, count, random_seed=0):
+    """Load 'count' interviews generated by a corpus model, with ids from
+    'first_id', with the loader.
+
+    Existing interviews and athletes are kept. Returns the dict of the ids
+    actually inserted in the interviews and athletes tables, for unseed().
+    """
+    loader, _ = import_database_modules()
+    ids = range(first_id, first_id + count)
+    existing = {}
+    with conn.cursor() as cur:
+        for table in ('interviews', 'athletes'):
+            cur.execute(
+                'SELECT id FROM ' + table +
+                ' WHERE id >= %(first)s AND id < %(last)s;', {
+                    'first': ids.start,
+                    'last': ids.stop
+                })
+            existing[table] = {row[0] for row in cur.fetchall()}
+    loader.load(conn,
+                model.generate(count, first_id, random_seed),
+                format='binary',
+                skip_existing=True)
+    conn.commit()
+    return {
+        table: [i for i in ids if i not in existing[table]]
+        for table in ('interviews', 'athletes')
+    }
+
+
+def unseed(conn, inserted):
+    """Delete the interviews and athletes inserted by seed()."""
+    with conn.cursor() as cur:
+        for table in ('interviews', 'athletes'):
+            cur.execute('DELETE FROM ' + table + ' WHERE id = ANY(%(ids)s);',
+                        {'ids': inserted[table]})
+    conn.commit()
+
+
+def create_api_user(conn, username, password):
+    """Insert (or replace) an API user, hashed with config.pwd_context."""
+    with conn.cursor() as cur:
+        cur.execute(queries.USER_DELETE, {'username': username})
+        cur.execute(queries.USER_INSERT, {
+            'username': username,
+            'password': config.pwd_context.hash(password)
+        })
+    conn.commit()
+
+
+def delete_api_user(conn, username):
+    """Delete an API user."""
+    with conn.cursor() as cur:
+        cur.execute(queries.USER_DELETE, {'username': username})
+    conn.commit()
+
+
+def basic_auth(username, password):
+    """Return the value of a Basic Authorization header."""
+    return 'Basic ' + base64.b64encode(
+        (username + ':' + password).encode('utf-8')).decode('ascii')
+
+
+class Client(object):
+    """HTTP client of a benchmark thread, with a keep-alive connection."""
+    def __init__(self, url, accept_encoding=None):
+        parts = urllib.parse.urlsplit(url)
+        self.https = parts.scheme == 'https'
+        self.netloc = parts.netloc
+        self.prefix = parts.path.rstrip('/')
+        self.accept_encoding = accept_encoding
+        self.conn = None
+
+    def request(self, request):
+        """Send a request, and return its (status, body, seconds).
+
+        The response body is read in full, as sent on the wire (i.e.,
+        compressed, with --accept-encoding).
+        """
+        headers = {'Authorization': request.auth}
+        if self.accept_encoding:
+            headers['Accept-Encoding'] = self.accept_encoding
+        body = None
+        if request.body is not None:
+            body = json.dumps(request.body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        if self.conn is None:
+            factory = (http.client.HTTPSConnection
+                       if self.https else http.client.HTTPConnection)
+            self.conn = factory(self.netloc, timeout=300)
+        start = time.perf_counter()
+        try:
+            self.conn.request(request.method, self.prefix + request.path,
+                              body, headers)
+            response = self.conn.getresponse()
+            body = response.read()
+        except (http.client.HTTPException, OSError):
+            self.conn.close()
+            self.conn = None
+            return None, b'', time.perf_counter() - start
+        return response.status, body, time.perf_counter() - start
+
+
+def scenarios(groups, args, auth, db_auth, put_auth, ids, rng):
+    """Return the list of (route name, scenario) pairs of the route groups.
+
+    A scenario is a function of no arguments returning the list of requests
+    to send in sequence (e.g., creating and then deleting a user). PUT /users
+    requests are sent with 'put_auth', of a throwaway user, so the
+    credentials of the other requests are not invalidated.
+    """
+    result = []
+    projections = [('', 'all'), ('/text', 'text'),
+                   ('/questions', 'questions'), ('/answers', 'answers'),
+                   ('/meta', 'meta')]
+
+    def fixed(route, method, path, body=None, request_auth=auth):
+        return (route, lambda: [
+            Request(route, method, path, body, request_auth)
+        ])
+
+    if 'all' in groups:
+        for suffix, projection in projections:
+            result.append(
+                fixed('all_' + projection, 'GET', '/interviews/all' +
+                      suffix + '?limit=%d' % args.limit))
+        result.append(
+            fixed('all_ids_stream', 'GET', '/interviews/all?stream=true'))
+    if 'any' in groups:
+        for suffix, projection in projections:
+
+            def any_scenario(route='any_' + projection, suffix=suffix):
+                sample = rng.sample(ids, min(args.ids, len(ids)))
+                return [
+                    Request(route, 'GET', '/interviews/' +
+                            ','.join(str(i) for i in sample) + suffix, None,
+                            auth)
+                ]
+
+            result.append(('any_' + projection, any_scenario))
+    if 'search' in groups:
+        for suffix, projection in projections:
+
+            def search_scenario(route='search_' + projection, suffix=suffix):
+                words = ' '.join(rng.sample(SEARCH_TERMS, rng.randint(1, 3)))
+                return [
+                    Request(route, 'GET', '/interviews/' +
+                            urllib.parse.quote(words) + suffix +
+                            '?limit=%d' % args.limit, None, auth)
+                ]
+
+            result.append(('search_' + projection, search_scenario))
+    if 'users' in groups:
+        basic = basic_auth(args.api_user, args.api_password)
+        result.append(
+            fixed('users_token', 'POST', '/users/token', request_auth=basic))
+        result.append(
+            fixed('users_put',
+                  'PUT',
+                  '/users', {'new_password': args.put_password},
+                  request_auth=put_auth))
+        counter = itertools.count()
+        counter_lock = threading.Lock()
+
+        def users_scenario():
+            with counter_lock:
+                username = 'geo_benchmark_%d' % next(counter)
+            return [
+                Request('users_post', 'POST', '/users', {
+                    'new_username': username,
+                    'new_password': secrets.token_hex(8)
+                }, db_auth),
+                Request('users_delete', 'DELETE', '/users',
+                        {'username': username}, db_auth),
+            ]
+
+        result.append(('users_post_delete', users_scenario))
+    if 'meta' in groups:
+        result.append(fixed('meta_lexicon', 'GET', '/meta/lexicon'))
+        result.append(fixed('meta_bow', 'GET', '/interviews/all/meta/bow'))
+        result.append(fixed('cache_search', 'GET', '/cache/search'))
+    return result
+
+
+def authenticate(args):
+    """Return the Authorization header of the interview requests.
+
+    With --auth token, a new token is issued for the API user.
+    """
+    auth = basic_auth(args.api_user, args.api_password)
+    if args.auth != 'token':
+        return auth
+    status, body, _ = Client(args.url).request(
+        Request('users_token', 'POST', '/users/token', None, auth))
+    if status != 201:
+        raise SystemExit('Unable to get a token: %s %s' %
+                         (status, body.decode('utf-8', 'replace')))
+    return 'Bearer ' + json.loads(body)['token']
+
+
+def percentile(values, p):
+    """Return the p-th percentile of sorted values (nearest-rank method)."""
+    if not values:
+        return None
+    return values[max(math.ceil(p * len(values) / 100) - 1, 0)]
+
+
+def run(args, workload):
+    """Run the scenarios of the workload, with args.concurrency clients.
+
+    Returns the wall time (in seconds) and the list of samples, as
+    (route, status, bytes, seconds) tuples.
+    """
+    tasks = queue.Queue()
+    for scenario in workload:
+        tasks.put(scenario)
+    samples = []
+    samples_lock = threading.Lock()
+
+    def worker():
+        client = Client(args.url, args.accept_encoding)
+        while True:
+            try:
+                scenario = tasks.get_nowait()
+            except queue.Empty:
+                return
+            for request in scenario():
+                status, body, seconds = client.request(request)
+                with samples_lock:
+                    samples.append(
+                        (request.route, status, len(body), seconds))
+
+    threads = [
+        threading.Thread(target=worker, daemon=True)
+        for _ in range(args.concurrency)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, samples
+
+
+def summarize(samples, wall_time):
+    """Return the results of each route, from the samples of a run."""
+    by_route = collections.defaultdict(list)
+    for sample in samples:
+        by_route[sample[0]].append(sample)
+    routes = {}
+    for route, route_samples in sorted(by_route.items()):
+        latencies = sorted(s[3] * 1000 for s in route_samples)
+        sizes = [s[2] for s in route_samples]
+        statuses = collections.Counter(str(s[1]) for s in route_samples)
+        routes[route] = {
+            'requests': len(route_samples),
+            'errors': sum(1 for s in route_samples
+                          if s[1] is None or s[1] >= 400),
+            'statuses': dict(statuses),
+            'throughput': len(route_samples) / wall_time,
+            'latency_ms': {
+                'mean': sum(latencies) / len(latencies),
+                'p50': percentile(latencies, 50),
+                'p95': percentile(latencies, 95),
+                'p99': percentile(latencies, 99),
+                'max': latencies[-1],
+            },
+            'bytes': {
+                'mean': sum(sizes) / len(sizes),
+                'total': sum(sizes),
+            },
+        }
+    return routes
+
+
+def print_results(results, baseline=None):
+    """Print the results of a run, compared with a baseline if given."""
+    print('%-20s %6s %6s %9s %9s %9s %9s %11s' %
+          ('route', 'reqs', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms',
+           'bytes'))
+    for route, r in results['routes'].items():
+        print('%-20s %6d %6d %9.1f %9.2f %9.2f %9.2f %11.0f' %
+              (route, r['requests'], r['errors'], r['throughput'],
+               r['latency_ms']['p50'], r['latency_ms']['p95'],
+               r['latency_ms']['p99'], r['bytes']['mean']))
+        if baseline and route in baseline['routes']:
+            b = baseline['routes'][route]
+            print('%-20s %6s %6s %8.2fx %8.2fx %8.2fx %8.2fx %10.2fx' %
+                  ('  vs. baseline', '', '', r['throughput'] /
+                   b['throughput'], r['latency_ms']['p50'] /
+                   b['latency_ms']['p50'], r['latency_ms']['p95'] /
+                   b['latency_ms']['p95'], r['latency_ms']['p99'] /
+                   b['latency_ms']['p99'], r['bytes']['mean'] /
+                   max(b['bytes']['mean'], 1)))
+    print('Total: %d requests in %.2f s (%.1f req/s)' %
+          (results['requests'], results['wall_time'],
+           results['throughput']))
+
+
+if __name__ == "__main__":
+    # Get arguments
+    parser = generate_argparser()
+    args = parser.parse_args()
+    groups = [g.strip() for g in args.routes.split(',') if g.strip()]
+    for group in groups:
+        if group not in ROUTE_GROUPS:
+            parser.error('unknown route group: ' + group)
+    rng = random.Random(args.random_seed)
+    conn = psycopg2.connect(host=args.hostname,
+                            port=args.port,
+                            dbname=args.dbname,
+                            user=args.username,
+                            password=args.password)
+    db_auth = basic_auth(args.username, args.password)
+    created_user = None
+    if args.api_user is None:
+        if not args.seed:
+            parser.error('--api-user is required without --seed')
+        args.api_user = 'geo_benchmark'
+        args.api_password = secrets.token_hex(16)
+        created_user = args.api_user
+    # Throwaway user of PUT /users requests
+    args.put_user = 'geo_benchmark_put'
+    args.put_password = secrets.token_hex(16)
+    put_auth = basic_auth(args.put_user, args.put_password)
+    seeded = None
+
+    try:
+        # Seed database
+        if args.seed:
+            try:
+                model = corpus_model(conn, args.model)
+            except ValueError as e:
+                raise SystemExit(
+                    'Unable to learn the corpus model: %s (use --model)' % e)
+            print('Seeding %d synthetic interviews...' % args.seed)
+            seeded = seed(conn, model, args.first_id, args.seed,
+                          args.random_seed)
+            print('Inserted %d interviews (existing ids were skipped)' %
+                  len(seeded['interviews']))
+        if created_user:
+            create_api_user(conn, created_user, args.api_password)
+        if 'users' in groups:
+            create_api_user(conn, args.put_user, args.put_password)
+        with conn.cursor() as cur:
+            queries.execute(cur, 'all_ids', {'after_id': 0, 'limit': None})
+            ids = [row[0] for row in cur.fetchall()]
+        conn.rollback()
+        if not ids:
+            raise SystemExit('No interviews in the database (use --seed)')
+
+        # Warm up and run, authenticating again after the warm up (so the
+        # token of the run is fresh)
+        if args.warmup:
+            print('Warming up...')
+            routes = scenarios(groups, args, authenticate(args), db_auth,
+                               put_auth, ids, rng)
+            run(args, [s for _, s in routes for _ in range(args.warmup)])
+        routes = scenarios(groups, args, authenticate(args), db_auth,
+                           put_auth, ids, rng)
+        workload = [s for _, s in routes for _ in range(args.requests)]
+        rng.shuffle(workload)
+        print('Running %d scenarios with %d clients...' %
+              (len(workload), args.concurrency))
+        started = datetime.datetime.now(datetime.timezone.utc)
+        wall_time, samples = run(args, workload)
+    finally:
+        conn.rollback()
+        if 'users' in groups:
+            delete_api_user(conn, args.put_user)
+        if not args.keep:
+            if created_user:
+                delete_api_user(conn, created_user)
+            if seeded:
+                unseed(conn, seeded)
+        conn.close()
+
+    # Report
+    results = {
+        'started': started.isoformat(timespec='seconds'),
+        'url': args.url,
+        'route_groups': groups,
+        'concurrency': args.concurrency,
+        'requests_per_route': args.requests,
+        'seeded': len(seeded['interviews']) if seeded else 0,
+        'interviews': len(ids),
+        'auth': args.auth,
+        'accept_encoding': args.accept_encoding,
+        'wall_time': wall_time,
+        'requests': len(samples),
+        'throughput': len(samples) / wall_time,
+        'routes': summarize(samples, wall_time),
+    }
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print('Results saved to ' + args.output)
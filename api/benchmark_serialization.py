@@ -0,0 +1,168 @@
+"""Micro-benchmark of the JSON serialization of query results.
+
+Use "-h" for more help. Compares the previous path (json/jsonb values parsed
+by psycopg2, then encoded with json.dumps, as by flask_restful) with the
+serialization module (json/jsonb values fetched as raw text and embedded
+verbatim, with json.dumps and with orjson, if installed), for the all, any
+and search statements of each projection. Projections without json/jsonb
+columns (ids, text) show the overhead of the raw path where there is nothing
+to embed. Fetch and encoding times are measured separately, and the encoded
+responses are checked to be equivalent.
+"""
+import argparse
+import json
+import time
+
+import psycopg2
+
+import queries
+import serialization
+import settings
+from settings import config
+
+
+def generate_argparser():
+    """Return ArgumentParser object for the benchmark."""
+    parser = argparse.ArgumentParser(
+        description='Micro-benchmark of the JSON serialization of GEO API ' +
+        'query results.',
+        epilog='Report bugs to <https://github.com/andremsouza/ic-geo>')
+    parser.add_argument('-P',
+                        '--projections',
+                        action='store',
+                        nargs='+',
+                        default=['ids', 'text', 'meta', 'all'],
+                        type=str,
+                        choices=sorted(queries.PROJECTIONS),
+                        required=False,
+                        help='selected columns of each run ' +
+                        '(default="ids text meta all")',
+                        metavar='PROJECTION',
+                        dest='projections')
+    parser.add_argument('-n',
+                        '--limit',
+                        action='store',
+                        default=config.PAGE_SIZE,
+                        type=int,
+                        required=False,
+                        help='number of rows of each statement ' +
+                        '(default=config.PAGE_SIZE)',
+                        metavar='LIMIT',
+                        dest='limit')
+    parser.add_argument('-s',
+                        '--search',
+                        action='store',
+                        default='terra',
+                        type=str,
+                        required=False,
+                        help='search string of the search statement ' +
+                        '(default="terra")',
+                        metavar='SEARCH',
+                        dest='search_string')
+    parser.add_argument('-r',
+                        '--repeat',
+                        action='store',
+                        default=5,
+                        type=int,
+                        required=False,
+                        help='number of repetitions, reporting the best ' +
+                        '(default=5)',
+                        metavar='REPEAT',
+                        dest='repeat')
+    settings.add_connection_arguments(parser)
+
+    return parser
+
+
+def statements(conn, projection, limit, search_string):
+    """Return (kind, statement name, parameters, response function) for the
+    all, any and search statements of a projection."""
+    with conn.cursor() as cur:
+        queries.execute(cur, 'all_ids', {'after_id': 0, 'limit': limit})
+        ids = [row[0] for row in cur.fetchall()]
+    return [
+        ('all', 'all_' + projection, {
+            'after_id': 0,
+            'limit': limit
+        }, lambda names, rows: queries.page_response(names, rows, limit, 0)),
+        ('any', 'any_' + projection, {
+            'id_list': ids
+        }, lambda names, rows: queries.any_response(ids, names, rows)),
+        ('search', 'search_%s_text' % projection, {
+            'search_string': search_string,
+            'weights': config.SEARCH_RANK_WEIGHTS,
+            'min_rank': 0.0,
+            'limit': limit,
+            'offset': 0
+        }, lambda names, rows: queries.search_response(
+            names, rows, 'text', limit, 0, 0.0)),
+    ]
+
+
+def run(conn, name, parameters, response, encode, raw_json, repeat):
+    """Return the best fetch and encoding times (in seconds) of a statement,
+    and its encoded response."""
+    best_fetch, best_encode = float('inf'), float('inf')
+    for _ in range(repeat):
+        with conn.cursor() as cur:
+            if raw_json:
+                serialization.register_raw_json(cur)
+            start = time.perf_counter()
+            queries.execute(cur, name, parameters)
+            data = response([desc[0] for desc in cur.description],
+                            cur.fetchall())
+            fetched = time.perf_counter()
+            body = encode(data)
+            encoded = time.perf_counter()
+        best_fetch = min(best_fetch, fetched - start)
+        best_encode = min(best_encode, encoded - fetched)
+    return best_fetch, best_encode, body
+
+
+if __name__ == "__main__":
+    # Get arguments and connect to database
+    parser = generate_argparser()
+    args = parser.parse_args()
+    conn = psycopg2.connect(connection_factory=queries.PreparedConnection,
+                            host=args.hostname,
+                            port=args.port,
+                            dbname=args.dbname,
+                            user=args.username,
+                            password=args.password)
+    conn.autocommit = True
+    # Delete sensitive data
+    del args.password
+
+    paths = [
+        ('json.dumps', lambda data: json.dumps(data).encode('utf-8'), False),
+        ('raw+stdlib', serialization.dumps_stdlib, True),
+    ]
+    if serialization.orjson is not None:
+        paths.append(('raw+orjson', serialization.dumps_orjson, True))
+    else:
+        print('orjson is not installed, skipping raw+orjson')
+
+    print('%-10s %-8s %-12s %10s %10s %10s %8s %12s' %
+          ('projection', 'kind', 'path', 'fetch ms', 'encode ms', 'total ms',
+           'speedup', 'bytes'))
+    try:
+        for projection in args.projections:
+            for kind, name, parameters, response in statements(
+                    conn, projection, args.limit, args.search_string):
+                baseline, expected = None, None
+                for path, encode, raw_json in paths:
+                    fetch_time, encode_time, body = run(
+                        conn, name, parameters, response, encode, raw_json,
+                        args.repeat)
+                    total = fetch_time + encode_time
+                    if baseline is None:
+                        baseline, expected = total, json.loads(body)
+                    elif json.loads(body) != expected:
+                        raise AssertionError('%s response of %s_%s differs' %
+                                             (path, kind, projection))
+                    print('%-10s %-8s %-12s %10.2f %10.2f %10.2f %7.2fx %12d' %
+                          (projection, kind, path, fetch_time * 1000,
+                           encode_time * 1000, total * 1000, baseline / total,
+                           len(body)))
+    finally:
+        conn.close()
@@ -0,0 +1,180 @@
+"""Columnar export of the interviews' bags-of-words, as sparse matrices.
+
+The 'bow' and 'bow_stemmed' metadata of each field (text, questions and
+answers) are exported as term-document matrices in CSR format, with one row
+per interview (in the order of 'ids') and one column per term of the
+vocabulary of their kind (shared by all fields). The arrays are:
+
+    ids                           int32, interview ids
+    vocabulary_<kind>             uint8, UTF-8 terms of the vocabulary of
+                                  'bow' or 'bow_stemmed', sorted and joined
+    vocabulary_<kind>_offsets     int64, offsets of the terms in the above
+    <field>_<kind>_indptr         int64, CSR row pointers
+    <field>_<kind>_indices        int32, CSR column indices (sorted by row)
+    <field>_<kind>_data           int32, CSR counts
+    <field>_<kind>_shape          int64, (rows, columns)
+
+saved in an uncompressed .npz file, or as .npy files in a directory, which
+numpy.load() memory-maps with mmap_mode='r'. E.g., with scipy:
+
+    npz = numpy.load('bow.npz')
+    text = scipy.sparse.csr_matrix(
+        (npz['text_bow_data'], npz['text_bow_indices'],
+         npz['text_bow_indptr']), shape=npz['text_bow_shape'])
+    terms = bow_export.decode_vocabulary(npz, 'bow')
+"""
+import array
+import contextlib
+import glob
+import os
+import re
+import tempfile
+import threading
+
+import numpy
+
+import queries
+
+
+def fetch_rows(conn, batch_size=1000):
+    """Yield rows of the bow_select statement, in keyset batches.
+
+    The connection must be a queries.PreparedConnection.
+    """
+    after_id = -1
+    while True:
+        with conn.cursor() as cur:
+            queries.execute(cur, 'bow_select', {
+                'after_id': after_id,
+                'limit': batch_size
+            })
+            rows = cur.fetchall()
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        after_id = rows[-1][0]
+
+
+def decode_vocabulary(arrays, kind):
+    """Return the list of terms of a vocabulary of export arrays (or of a
+    loaded .npz file)."""
+    data = arrays['vocabulary_' + kind].tobytes()
+    offsets = arrays['vocabulary_%s_offsets' % kind]
+    return [
+        data[start:end].decode('utf-8')
+        for start, end in zip(offsets[:-1], offsets[1:])
+    ]
+
+
+def build(rows):
+    """Return the dict of export arrays of rows of the bow_select statement.
+
+    Rows are tuples of (id, dict of counts for each of queries.BOW_COLUMNS),
+    in a single pass. Columns without bag-of-words metadata (NULL, e.g., of
+    interviews not processed by update_metadata.py yet) are exported as empty
+    rows, so the rows of all matrices still match 'ids'.
+    """
+    ids = array.array('i')
+    terms = {kind: {} for _, kind in queries.BOW_COLUMNS}
+    matrices = {
+        column: ([0], array.array('i'), array.array('i'))
+        for column in queries.BOW_COLUMNS
+    }
+    for row in rows:
+        ids.append(row[0])
+        for column, bow in zip(queries.BOW_COLUMNS, row[1:]):
+            indptr, indices, data = matrices[column]
+            vocabulary = terms[column[1]]
+            for term, count in (bow or {}).items():
+                indices.append(vocabulary.setdefault(term, len(vocabulary)))
+                data.append(count)
+            indptr.append(len(indices))
+
+    # Sort vocabularies, and re-number columns in sorted order
+    arrays = {'ids': numpy.asarray(ids, dtype=numpy.int32)}
+    renumber = {}
+    for kind, vocabulary in terms.items():
+        words = sorted(vocabulary)
+        renumber[kind] = numpy.empty(len(words), dtype=numpy.int32)
+        renumber[kind][[vocabulary[w] for w in words]] = numpy.arange(
+            len(words), dtype=numpy.int32)
+        encoded = [w.encode('utf-8') for w in words]
+        offsets = numpy.zeros(len(words) + 1, dtype=numpy.int64)
+        numpy.cumsum([len(w) for w in encoded], out=offsets[1:])
+        arrays['vocabulary_' + kind] = numpy.frombuffer(b''.join(encoded),
+                                                        dtype=numpy.uint8)
+        arrays['vocabulary_%s_offsets' % kind] = offsets
+    for (field, kind), (indptr, indices, data) in matrices.items():
+        prefix = '%s_%s_' % (field, kind)
+        indptr = numpy.asarray(indptr, dtype=numpy.int64)
+        indices = renumber[kind][numpy.asarray(indices, dtype=numpy.int32)]
+        # Sort column indices within each row
+        row_ids = numpy.repeat(numpy.arange(len(ids)), numpy.diff(indptr))
+        order = numpy.lexsort((indices, row_ids))
+        arrays[prefix + 'indptr'] = indptr
+        arrays[prefix + 'indices'] = indices[order]
+        arrays[prefix + 'data'] = numpy.asarray(data, dtype=numpy.int32)[order]
+        arrays[prefix + 'shape'] = numpy.array(
+            [len(ids), len(terms[kind])], dtype=numpy.int64)
+    return arrays
+
+
+def write(arrays, path, format='npz'):
+    """Write export arrays to an uncompressed .npz file, or to a directory of
+    .npy files (format='npy')."""
+    if format == 'npy':
+        os.makedirs(path, exist_ok=True)
+        for name, value in arrays.items():
+            numpy.save(os.path.join(path, name + '.npy'), value)
+        return
+    with open(path, 'wb') as f:
+        numpy.savez(f, **arrays)
+
+
+class ExportCache(object):
+    """Cache of .npz exports, keyed by the version of the interviews table.
+
+    Exports are regenerated only when the interviews table changes (see the
+    table_versions table), and exports of older versions are removed. Files
+    are kept in 'directory' (a directory in the system's temporary directory
+    if None). The 'lock' serializes builds of the same export.
+    """
+    def __init__(self, directory=None):
+        self.directory = directory or os.path.join(tempfile.gettempdir(),
+                                                   'geo_bow_export')
+        os.makedirs(self.directory, exist_ok=True)
+        self.lock = threading.Lock()
+
+    def path(self, version):
+        """Return the path of the export of a table version."""
+        return os.path.join(self.directory, 'bow_%d.npz' % version)
+
+    def get(self, version):
+        """Return the path of the export of a table version, or None."""
+        path = self.path(version)
+        return path if os.path.exists(path) else None
+
+    def put(self, version, arrays):
+        """Write the export of a table version, and return its path.
+
+        The file is written to a unique temporary file and renamed, so
+        partial exports are never served, and concurrent writers do not
+        overwrite each other's files. Exports of older versions are removed.
+        """
+        path = self.path(version)
+        with tempfile.NamedTemporaryFile(dir=self.directory,
+                                         prefix='bow_%d.' % version,
+                                         suffix='.tmp',
+                                         delete=False) as f:
+            try:
+                numpy.savez(f, **arrays)
+            except BaseException:
+                os.remove(f.name)
+                raise
+        os.replace(f.name, path)
+        for old in glob.glob(os.path.join(self.directory, 'bow_*.npz')):
+            match = re.match(r'bow_(\d+)\.npz$', os.path.basename(old))
+            if match and int(match.group(1)) < version:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(old)
+        return path
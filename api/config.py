@@ -8,3 +8,25 @@ DBNAME = 'geo'
 USERNAME = 'api'
 PASSWORD = 'api'
 pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_ITERSIZE = 100
+CREDENTIAL_CACHE_TTL = 300
+CREDENTIAL_CACHE_SIZE = 1024
+TOKEN_SECRET_KEY = None
+TOKEN_TTL = 900
+SEARCH_CACHE_MAX_BYTES = 64 * 1024 * 1024
+SEARCH_PAGE_SIZE = 20
+SEARCH_RANK_WEIGHTS = [0.1, 0.2, 0.4, 1.0]  # weights for D, C, B, A
+POOL_TIMEOUT = 30  # seconds waiting for a free connection
+POOL_MAX_IDLE = 60  # seconds idle before a health check
+POOL_MAX_AGE = 3600  # seconds before a connection is recycled
+LEXICON_MAX_AGE = 86400  # seconds clients may cache /meta/lexicon
+BOW_EXPORT_DIR = None  # directory of bag-of-words exports (None for temp)
+COMPRESSION_MIN_SIZE = 1024  # bytes below which responses are not compressed
+COMPRESSION_LEVEL = 6  # gzip level (brotli quality is level - 1)
+SLOW_QUERY_MS = 500  # milliseconds before a query is logged (None to disable)
+SLOW_QUERY_EXPLAIN = False  # log EXPLAIN (ANALYZE, BUFFERS) of slow queries
+SLOW_QUERY_EXPLAIN_TIMEOUT = 30  # statement timeout of EXPLAIN, in seconds
+SLOW_QUERY_LOG = None  # rotating log file, e.g. 'slow_queries.log' (stderr)
+ADMIN_USERS = []  # API users allowed to access /metrics and /admin routes
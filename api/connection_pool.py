@@ -0,0 +1,167 @@
+"""Thread-safe PostgreSQL connection pool for the GEO API."""
+import contextlib
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+
+
+class ConnectionPool(object):
+    """Thread-safe pool of database connections, with guaranteed return.
+
+    Wraps a psycopg2.pool.ThreadedConnectionPool. Connections are borrowed
+    with the connection() context manager, which always returns them to the
+    pool: open transactions are rolled back, broken connections are closed,
+    and connections older than 'max_age' seconds are recycled. Connections
+    idle for more than 'max_idle' seconds are validated with a simple query
+    before being handed out.
+    When all connections are in use, callers wait up to 'timeout' seconds for
+    a free connection, instead of failing immediately. Wait times and
+    occupancy are reported by stats(), and each wait (including the checkout
+    of a healthy connection) is passed to 'on_wait', if given.
+    """
+    def __init__(self,
+                 minconn,
+                 maxconn,
+                 timeout=30,
+                 max_idle=60,
+                 max_age=3600,
+                 on_wait=None,
+                 **kwargs):
+        self.maxconn = maxconn
+        self.on_wait = on_wait
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_age = max_age
+        self._pool = psycopg2.pool.ThreadedConnectionPool(
+            minconn, maxconn, **kwargs)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._created = {}  # id(conn) -> creation time
+        self._returned = {}  # id(conn) -> last return time
+        self._in_use = 0
+        self._max_in_use = 0
+        self._acquisitions = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._timeouts = 0
+        self._health_checks = 0
+        self._discarded = 0
+
+    def _discard(self, conn):
+        """Close a connection and remove it from the pool."""
+        with self._lock:
+            self._created.pop(id(conn), None)
+            self._returned.pop(id(conn), None)
+            self._discarded += 1
+        self._pool.putconn(conn, close=True)
+
+    def _is_healthy(self, conn):
+        """Return whether a connection from the pool may be handed out."""
+        if conn.closed:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            created = self._created.setdefault(id(conn), now)
+            returned = self._returned.get(id(conn), now)
+        if now - created > self.max_age:
+            return False
+        if now - returned > self.max_idle:
+            with self._lock:
+                self._health_checks += 1
+            try:
+                with conn.cursor() as cur:
+                    cur.execute('SELECT 1;')
+                conn.rollback()
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                return False
+        return True
+
+    def _checkout(self):
+        """Return a healthy connection from the pool."""
+        for _ in range(self.maxconn + 1):
+            conn = self._pool.getconn()
+            if self._is_healthy(conn):
+                return conn
+            self._discard(conn)
+        raise psycopg2.pool.PoolError('unable to get a healthy connection')
+
+    def _checkin(self, conn):
+        """Return a connection to the pool, rolling back open transactions."""
+        if not conn.closed and (conn.info.transaction_status !=
+                                psycopg2.extensions.TRANSACTION_STATUS_IDLE):
+            try:
+                conn.rollback()
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                pass
+        if conn.closed or (conn.info.transaction_status !=
+                           psycopg2.extensions.TRANSACTION_STATUS_IDLE):
+            self._discard(conn)
+            return
+        with self._lock:
+            self._returned[id(conn)] = time.monotonic()
+        self._pool.putconn(conn)
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Context manager for a pool connection.
+
+        The connection is always returned to the pool on exit, even if an
+        exception was raised. Transactions must be committed explicitly, as
+        open transactions are rolled back on exit.
+        Raises psycopg2.pool.PoolError if no connection is available within
+        the timeout.
+        """
+        start = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._timeouts += 1
+            raise psycopg2.pool.PoolError(
+                'timed out waiting for a database connection')
+        wait = time.monotonic() - start
+        try:
+            conn = self._checkout()
+        except BaseException:
+            self._slots.release()
+            raise
+        if self.on_wait is not None:
+            self.on_wait(time.monotonic() - start)
+        with self._lock:
+            self._acquisitions += 1
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+            self._in_use += 1
+            self._max_in_use = max(self._max_in_use, self._in_use)
+        try:
+            yield conn
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            try:
+                self._checkin(conn)
+            finally:
+                self._slots.release()
+
+    def stats(self):
+        """Return a dict with the pool wait times and occupancy."""
+        with self._lock:
+            return {
+                'max_connections': self.maxconn,
+                'in_use': self._in_use,
+                'max_in_use': self._max_in_use,
+                'open': len(self._created),
+                'acquisitions': self._acquisitions,
+                'wait_seconds_total': self._wait_total,
+                'wait_seconds_max': self._wait_max,
+                'wait_seconds_avg': (self._wait_total / self._acquisitions
+                                     if self._acquisitions else None),
+                'timeouts': self._timeouts,
+                'health_checks': self._health_checks,
+                'discarded': self._discarded,
+            }
+
+    def closeall(self):
+        """Close all connections of the pool."""
+        self._pool.closeall()
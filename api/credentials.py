@@ -0,0 +1,130 @@
+"""Verified credential cache and signed bearer tokens for the GEO API."""
+import collections
+import hashlib
+import hmac
+import os
+import threading
+import time
+
+import itsdangerous
+
+
+class CredentialCache(object):
+    """Bounded in-process cache of verified API credentials, with a TTL.
+
+    Verifying a password with the pwd_context (pbkdf2_sha256) is deliberately
+    slow, and requires a query on the api_users table. This cache stores the
+    user row of credentials that were already verified, for 'ttl' seconds.
+    Entries are keyed on an HMAC-SHA256 digest of the username and password,
+    salted with a random per-process key, so no password is kept in memory.
+    When the cache is full, the least recently used entry is evicted.
+    """
+    def __init__(self, ttl=300, maxsize=1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._salt = os.urandom(32)
+        self._entries = collections.OrderedDict()  # key -> (user, expiration)
+        self._keys = collections.defaultdict(set)  # username -> set of keys
+        self._lock = threading.Lock()
+
+    def _digest(self, username, password):
+        """Return the salted digest of an username and password pair."""
+        username = username.encode('utf-8')
+        message = b'%d:%s%s' % (len(username), username,
+                                password.encode('utf-8'))
+        return hmac.new(self._salt, message, hashlib.sha256).digest()
+
+    def _discard(self, key):
+        """Remove an entry from the cache. Must be called with the lock."""
+        user, _ = self._entries.pop(key)
+        self._keys[user[0]].discard(key)
+        if not self._keys[user[0]]:
+            del self._keys[user[0]]
+
+    def get(self, username, password):
+        """Return the cached user row for the credentials, or None."""
+        key = self._digest(username, password)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] < time.monotonic():
+                self._discard(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def add(self, username, password, user):
+        """Store the user row of verified credentials in the cache."""
+        key = self._digest(username, password)
+        with self._lock:
+            if key in self._entries:
+                self._discard(key)
+            while len(self._entries) >= self.maxsize:
+                self._discard(next(iter(self._entries)))
+            self._entries[key] = (user, time.monotonic() + self.ttl)
+            self._keys[user[0]].add(key)
+
+    def invalidate(self, username):
+        """Remove all cached credentials of an user."""
+        with self._lock:
+            for key in list(self._keys.get(username, ())):
+                self._discard(key)
+
+
+class TokenSigner(object):
+    """Issuer and verifier of signed, short-lived bearer tokens.
+
+    Tokens are signed with itsdangerous, and expire after 'ttl' seconds.
+    Each token carries a fingerprint of the user's password hash, as stored
+    in the api_users table, which the servers check against the stored hash
+    when the token is used (see matches()). So changing the password of an
+    user, or deleting it, revokes all of its tokens in every server process
+    sharing the secret_key, also after a restart.
+    If no secret_key is given, a random key is generated, and tokens are
+    only valid for the current process.
+    """
+    def __init__(self, secret_key=None, ttl=900):
+        self.ttl = ttl
+        self._key = secret_key or os.urandom(32)
+        if isinstance(self._key, str):
+            self._key = self._key.encode('utf-8')
+        self._serializer = itsdangerous.URLSafeTimedSerializer(
+            self._key, salt='geo-api-token')
+
+    def fingerprint(self, password_hash):
+        """Return the fingerprint of a stored password hash (str).
+
+        The fingerprint is keyed with the secret key, as the payload of the
+        tokens is signed, but not encrypted.
+        """
+        return hmac.new(self._key, password_hash.encode('utf-8'),
+                        hashlib.sha256).hexdigest()[:32]
+
+    def issue(self, user):
+        """Return a new signed token for an user row (username, password)."""
+        return self._serializer.dumps({
+            'u': user[0],
+            'f': self.fingerprint(user[1])
+        })
+
+    def verify(self, token):
+        """Return the (username, fingerprint) of a valid token, or None.
+
+        The fingerprint must still be checked against the stored password
+        hash of the user, with matches().
+        """
+        try:
+            payload = self._serializer.loads(token, max_age=self.ttl)
+        except itsdangerous.BadData:
+            return None
+        if not isinstance(payload.get('u'), str) or not isinstance(
+                payload.get('f'), str):
+            return None
+        return payload['u'], payload['f']
+
+    def matches(self, fingerprint, user):
+        """Return whether a token fingerprint matches an user row, as read
+        from the api_users table (None if the user does not exist)."""
+        return user is not None and hmac.compare_digest(
+            fingerprint, self.fingerprint(user[1]))
@@ -0,0 +1,64 @@
+"""Script to export the interviews' bags-of-words as sparse matrices.
+
+Use "-h" for more help. Writes the same export as the
+/interviews/all/meta/bow route (see bow_export.py), to an uncompressed .npz
+file or to a directory of .npy files.
+"""
+import argparse
+
+import psycopg2
+
+import bow_export
+import queries
+import settings
+from settings import config
+
+
+def generate_argparser():
+    """Return ArgumentParser object for the export."""
+    parser = argparse.ArgumentParser(
+        description='Python script to export the bags-of-words of GEO ' +
+        'database interviews as sparse matrices.',
+        epilog='Report bugs to <https://github.com/andremsouza/ic-geo>')
+    parser.add_argument('output',
+                        type=str,
+                        help='output .npz file, or directory for .npy files',
+                        metavar='OUTPUT')
+    parser.add_argument('-f',
+                        '--format',
+                        action='store',
+                        default='npz',
+                        type=str,
+                        choices=['npz', 'npy'],
+                        required=False,
+                        help='output format. May be either "npz" (single ' +
+                        'file) or "npy" (directory) (default="npz")',
+                        metavar='FORMAT',
+                        dest='format')
+    settings.add_connection_arguments(parser)
+
+    return parser
+
+
+if __name__ == "__main__":
+    # Get arguments and connect to database
+    parser = generate_argparser()
+    args = parser.parse_args()
+    conn = psycopg2.connect(connection_factory=queries.PreparedConnection,
+                            host=args.hostname,
+                            port=args.port,
+                            dbname=args.dbname,
+                            user=args.username,
+                            password=args.password)
+    # Delete sensitive data
+    del args.password
+
+    # Build and write the export
+    try:
+        arrays = bow_export.build(bow_export.fetch_rows(conn))
+    finally:
+        conn.close()
+    bow_export.write(arrays, args.output, args.format)
+    print('Exported %d interviews (%d terms, %d stems) to %s' %
+          (len(arrays['ids']), len(arrays['vocabulary_bow_offsets']) - 1,
+           len(arrays['vocabulary_bow_stemmed_offsets']) - 1, args.output))
@@ -0,0 +1,52 @@
+"""Lexical resources used in the interviews' metadata, for the GEO API.
+
+The stopword list and the stemmer identity are loaded once, when the server
+starts, and served by the /meta/lexicon route with an ETag, instead of being
+included in every meta response.
+"""
+import hashlib
+import json
+
+import nltk.corpus
+
+
+class Lexicon(object):
+    """Immutable stopword list and stemmer identity of the metadata.
+
+    The stopwords are kept in corpus order ('stopwords') and as a frozenset
+    ('stopword_set'). The 'etag' is a hash of the response data, which only
+    changes if the resources change.
+    """
+    __slots__ = ('language', 'stemmer', 'stopwords', 'stopword_set', 'etag')
+
+    def __init__(self, language='portuguese', stemmer='RSLP Stemmer'):
+        self.language = language
+        self.stemmer = stemmer
+        self.stopwords = tuple(nltk.corpus.stopwords.words(language))
+        self.stopword_set = frozenset(self.stopwords)
+        self.etag = hashlib.sha256(
+            json.dumps(self.response_data(), sort_keys=True,
+                       ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    def response_data(self):
+        """Return the response data of the /meta/lexicon route."""
+        return {
+            'language': self.language,
+            'stemmer': self.stemmer,
+            'stopwords': list(self.stopwords),
+        }
+
+    def matches(self, if_none_match):
+        """Return whether an If-None-Match header value matches the ETag."""
+        if not if_none_match:
+            return False
+        tags = {t.strip() for t in if_none_match.split(',')}
+        etag = '"%s"' % self.etag
+        return bool(tags & {'*', etag, 'W/' + etag})
+
+    def headers(self, max_age):
+        """Return the caching headers of the /meta/lexicon route."""
+        return {
+            'ETag': '"%s"' % self.etag,
+            'Cache-Control': 'private, max-age=%d' % max_age,
+        }
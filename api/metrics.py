@@ -0,0 +1,240 @@
+"""Request instrumentation of the GEO API servers, in Prometheus format.
+
+Each request has a RequestTimer, kept in a context variable (so it follows
+the request's thread in api.py, and its task in api_async.py), which adds up
+the time spent in the phases of the request:
+
+    auth        authentication (including its credential lookup)
+    pool_wait   waiting for a pool connection
+    query       executing SQL statements
+    fetch       fetching rows from the server
+    serialize   encoding the response data
+
+Phases of a request may nest (e.g., the pool wait of a credential lookup is
+also part of auth). When the request finishes, its duration, phases, rows
+and response bytes are added to per-route histograms and counters of a
+Metrics object, exposed by the /metrics route in the Prometheus text format.
+The bodies of streamed responses are produced after the request finishes, so
+only their bytes (in api_async.py) are counted.
+"""
+import asyncio
+import bisect
+import contextlib
+import contextvars
+import functools
+import threading
+import time
+
+PHASES = ('auth', 'pool_wait', 'query', 'fetch', 'serialize')
+
+# Upper bounds of histogram buckets, in seconds and bytes
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                    0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304,
+                16777216)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_current = contextvars.ContextVar('geo_request_timer', default=None)
+
+
+class RequestTimer(object):
+    """Phase times (in seconds) and row count of a request."""
+    __slots__ = ('start', 'phases', 'rows')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = {}
+        self.rows = 0
+
+    def add(self, phase, seconds):
+        """Add time to a phase."""
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+
+def start_request():
+    """Start the RequestTimer of the current request."""
+    _current.set(RequestTimer())
+
+
+def record(phase, seconds):
+    """Add time to a phase of the current request, if any."""
+    timer = _current.get()
+    if timer is not None:
+        timer.add(phase, seconds)
+
+
+def add_rows(count):
+    """Add to the number of rows returned by the current request, if any."""
+    timer = _current.get()
+    if timer is not None:
+        timer.rows += count
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Context manager adding its time to a phase of the current request."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def timed(name):
+    """Return a decorator adding the time of calls of a function (or
+    coroutine function) to a phase of the current request."""
+    def decorator(function):
+        if asyncio.iscoroutinefunction(function):
+
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with phase(name):
+                    return await function(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with phase(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class Histogram(object):
+    """Cumulative histogram, as a Prometheus histogram (not thread-safe)."""
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        """Yield (le, cumulative count) pairs, ending with +Inf."""
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield repr(float(bound)), total
+        yield '+Inf', self.count
+
+
+def _labels(*pairs):
+    """Return the label set of a sample, from (name, value) pairs."""
+    return '{' + ','.join('%s="%s"' % (name, str(value).replace(
+        '\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                          for name, value in pairs) + '}'
+
+
+def _histogram_lines(name, help, histograms):
+    """Yield the lines of histograms, keyed by tuples of label pairs."""
+    yield '# HELP %s %s' % (name, help)
+    yield '# TYPE %s histogram' % name
+    for labels, histogram in sorted(histograms.items()):
+        for le, count in histogram.samples():
+            yield '%s_bucket%s %d' % (name, _labels(*labels, ('le', le)),
+                                      count)
+        yield '%s_sum%s %r' % (name, _labels(*labels), histogram.sum)
+        yield '%s_count%s %d' % (name, _labels(*labels), histogram.count)
+
+
+class Metrics(object):
+    """Per-route request metrics, rendered in the Prometheus text format.
+
+    Thread-safe. Routes should be route patterns (e.g., "/interviews/<ids>"),
+    not request paths, to keep the number of series bounded.
+    """
+    def __init__(self, prefix='geo'):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._requests = {}  # (route, method, status) -> count
+        self._durations = {}  # route -> Histogram
+        self._phases = {}  # (route, phase) -> Histogram
+        self._rows = {}  # route -> count
+        self._bytes = {}  # route -> Histogram
+
+    def finish_request(self, route, method, status, size=None):
+        """Add the current request to the metrics of its route, and clear
+        its RequestTimer. 'size' is the number of response bytes, if known.
+        """
+        timer = _current.get()
+        if timer is None:
+            return
+        _current.set(None)
+        duration = time.perf_counter() - timer.start
+        with self._lock:
+            key = (route, method, status)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            if route not in self._durations:
+                self._durations[route] = Histogram(DURATION_BUCKETS)
+            self._durations[route].observe(duration)
+            for name, seconds in timer.phases.items():
+                histogram = self._phases.get((route, name))
+                if histogram is None:
+                    histogram = self._phases[(route, name)] = Histogram(
+                        DURATION_BUCKETS)
+                histogram.observe(seconds)
+            self._rows[route] = self._rows.get(route, 0) + timer.rows
+            if size is not None:
+                if route not in self._bytes:
+                    self._bytes[route] = Histogram(SIZE_BUCKETS)
+                self._bytes[route].observe(size)
+
+    def render(self, gauges=None):
+        """Return the metrics in the Prometheus text format (str).
+
+        'gauges' maps additional gauge names (without prefix) to (help,
+        value) pairs, e.g. the statistics of the connection pool.
+        """
+        p = self.prefix
+        with self._lock:
+            requests = dict(self._requests)
+            rows = dict(self._rows)
+            durations = {(('route', r), ): h
+                         for r, h in self._durations.items()}
+            phases = {(('route', r), ('phase', ph)): h
+                      for (r, ph), h in self._phases.items()}
+            sizes = {(('route', r), ): h for r, h in self._bytes.items()}
+            lines = [
+                '# HELP %s_requests_total Requests by route, method and '
+                'status.' % p,
+                '# TYPE %s_requests_total counter' % p,
+            ]
+            for (route, method, status), count in sorted(requests.items()):
+                lines.append('%s_requests_total%s %d' %
+                             (p, _labels(('route', route), ('method', method),
+                                         ('status', status)), count))
+            lines += _histogram_lines(
+                '%s_request_duration_seconds' % p,
+                'Request duration by route.', durations)
+            lines += _histogram_lines(
+                '%s_request_phase_seconds' % p,
+                'Time spent in each phase of requests, by route.', phases)
+            lines += [
+                '# HELP %s_response_rows_total Rows returned by route.' % p,
+                '# TYPE %s_response_rows_total counter' % p,
+            ]
+            for route, count in sorted(rows.items()):
+                lines.append('%s_response_rows_total%s %d' %
+                             (p, _labels(('route', route)), count))
+            lines += _histogram_lines(
+                '%s_response_bytes' % p, 'Response body size by route.',
+                sizes)
+        for name, (help, value) in sorted((gauges or {}).items()):
+            lines += [
+                '# HELP %s_%s %s' % (p, name, help),
+                '# TYPE %s_%s gauge' % (p, name),
+                '%s_%s %r' % (p, name, value),
+            ]
+        return '\n'.join(lines) + '\n'
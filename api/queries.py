@@ -0,0 +1,289 @@
+"""SQL statements and response shapes shared by the GEO API servers.
+
+Both the Flask application (api.py) and the asyncio application
+(api_async.py) build their queries and responses with this module, so both
+servers return the same data for the same routes.
+All statements are kept in the STATEMENTS registry, and may be executed as
+server-side prepared statements with execute().
+"""
+import collections
+import re
+import time
+
+import psycopg2.extensions
+
+import metrics
+import search_cache
+
+# Selected columns of the interviews table, for each projection
+PROJECTIONS = {
+    'all': ('id', 'text', 'questions', 'answers', 'meta'),
+    'text': ('id', 'text'),
+    'questions': ('id', 'questions'),
+    'answers': ('id', 'answers'),
+    'meta': ('id', 'meta'),
+    'ids': ('id', ),
+}
+
+# Searchable fields, and their tsvector expressions. Each expression has a GIN
+# index in the interviews table. The 'weighted' field searches questions and
+# answers in a single index scan, with weights A and B, respectively.
+SEARCH_FIELDS = {
+    'text': "tstext",
+    'questions': "tsquestions",
+    'answers': "tsanswers",
+    'weighted': "(setweight(tsquestions, 'A') || setweight(tsanswers, 'B'))",
+}
+
+USER_SELECT = """SELECT username, password FROM api_users
+    WHERE username = %(username)s;"""
+
+USER_INSERT = """INSERT INTO api_users VALUES(%(username)s, %(password)s);"""
+
+USER_UPDATE = """UPDATE api_users SET password = %(new_password)s
+    WHERE username = %(username)s;"""
+
+USER_DELETE = """DELETE FROM api_users WHERE username = %(username)s;"""
+
+VERSION_SELECT = """SELECT version FROM table_versions
+    WHERE table_name = 'interviews';"""
+
+
+# Bag-of-words columns of the meta column, as (field, kind) pairs
+BOW_COLUMNS = tuple((field, kind)
+                    for field in ('text', 'questions', 'answers')
+                    for kind in ('bow', 'bow_stemmed'))
+
+# The meta column as a JSON object. Rows inserted by previous versions of the
+# interview_insert procedure (with to_jsonb(text)) hold a JSON string scalar
+# with the encoded object instead.
+META_OBJECT = """CASE WHEN jsonb_typeof(meta) = 'string'
+    THEN (meta #>> '{}')::jsonb ELSE meta END"""
+
+BOW_SELECT = """SELECT id, """ + ', '.join(
+    "meta_object #> '{%s,%s}'" % column for column in BOW_COLUMNS) + """
+    FROM interviews,
+        LATERAL (SELECT """ + META_OBJECT + """ AS meta_object) m
+    WHERE id > %(after_id)s
+    ORDER BY id
+    LIMIT %(limit)s;"""
+
+
+def all_query(projection):
+    """Return the query for a page of all interviews, ordered by id.
+
+    Parameters: after_id (keyset cursor) and limit (NULL for no limit).
+    """
+    return """SELECT """ + ', '.join(PROJECTIONS[projection]) + """
+        FROM interviews
+        WHERE id > %(after_id)s
+        ORDER BY id
+        LIMIT %(limit)s;"""
+
+
+def any_query(projection):
+    """Return the query for a list of interviews, ordered by id.
+
+    Parameters: id_list (list of ids).
+    """
+    return """SELECT """ + ', '.join(PROJECTIONS[projection]) + """
+        FROM interviews
+        WHERE id = ANY(%(id_list)s)
+        ORDER BY id;"""
+
+
+def search_query(projection, field):
+    """Return the query for the top ranked interviews, searching a field.
+
+    Matching ids are ranked first, and only the top rows are joined with the
+    selected columns. Parameters: search_string, weights (for ts_rank_cd),
+    min_rank, limit and offset.
+    """
+    return """WITH hits AS (
+            SELECT id,
+                ts_rank_cd(%(weights)s::float4[],
+                           """ + SEARCH_FIELDS[field] + """,
+                           query, 1|4|32) as rank
+            FROM interviews,
+                websearch_to_tsquery('portuguese', %(search_string)s) query
+            WHERE """ + SEARCH_FIELDS[field] + """ @@ query)
+        SELECT """ + ', '.join(PROJECTIONS[projection]) + """, rank
+        FROM (SELECT id, rank FROM hits
+                WHERE rank >= %(min_rank)s
+                ORDER BY rank DESC, id
+                LIMIT %(limit)s OFFSET %(offset)s) top
+            JOIN interviews USING (id)
+        ORDER BY rank DESC, id;"""
+
+
+Statement = collections.namedtuple('Statement',
+                                   ['name', 'sql', 'parameters', 'prepare',
+                                    'execute'])
+
+
+def generate_statement(name, sql):
+    """Return a Statement, with its PREPARE and EXECUTE forms.
+
+    The SQL must use named parameters (%(name)s), which are numbered in order
+    of their first occurrence for the PREPARE statement. The EXECUTE form
+    takes the same named parameters, so both forms accept the same dict.
+    """
+    parameters = []
+    for parameter in re.findall(r'%\((\w+)\)s', sql):
+        if parameter not in parameters:
+            parameters.append(parameter)
+    prepare = re.sub(r'%\((\w+)\)s',
+                     lambda m: '$%d' % (parameters.index(m.group(1)) + 1),
+                     sql)
+    prepared_name = 'geo_' + name
+    return Statement(
+        name, sql, tuple(parameters),
+        'PREPARE ' + prepared_name + ' AS ' + prepare,
+        'EXECUTE ' + prepared_name +
+        ('(' + ', '.join('%%(%s)s' % p for p in parameters) + ')'
+         if parameters else '') + ';')
+
+
+def generate_statements():
+    """Return the registry of all statements of the API, keyed by name.
+
+    Interview statements are named after their kind and projection (e.g.,
+    'all_text', 'any_meta'), and search statements also after the searched
+    field (e.g., 'search_answers_weighted').
+    """
+    statements = {
+        'user_select': USER_SELECT,
+        'version_select': VERSION_SELECT,
+        'bow_select': BOW_SELECT,
+    }
+    for projection in PROJECTIONS:
+        statements['all_' + projection] = all_query(projection)
+        statements['any_' + projection] = any_query(projection)
+        for field in SEARCH_FIELDS:
+            statements['search_%s_%s' % (projection, field)] = search_query(
+                projection, field)
+    return {
+        name: generate_statement(name, sql)
+        for name, sql in statements.items()
+    }
+
+
+# slow_queries.SlowQueryLog observing the statements run by execute(), set
+# by the servers if a slow-query threshold is configured
+slow_query_log = None
+
+
+class PreparedConnection(psycopg2.extensions.connection):
+    """Connection class that keeps track of its prepared statements.
+
+    Used as the connection_factory of pool connections, so each connection
+    prepares each statement only once, on its first execution.
+    """
+    def __init__(self, *args, **kwargs):
+        super(PreparedConnection, self).__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+def execute(cur, name, parameters=None):
+    """Execute a statement from the STATEMENTS registry, by name.
+
+    If the cursor's connection is a PreparedConnection, the statement is
+    prepared on its first use in that connection, and executed with EXECUTE
+    afterwards. Otherwise, the SQL of the statement is executed directly.
+    The execution time is added to the 'query' phase of the request, and
+    observed by the slow_query_log, if set, also for statements that fail
+    (e.g., by a statement timeout).
+    """
+    statement = STATEMENTS[name]
+    prepared = getattr(cur.connection, 'prepared', None)
+    with metrics.phase('query'):
+        if prepared is None:
+            sql = statement.sql
+        else:
+            if name not in prepared:
+                cur.execute(statement.prepare)
+                prepared.add(name)
+            sql = statement.execute
+        start = time.perf_counter()
+        error = None
+        try:
+            cur.execute(sql, parameters)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            if slow_query_log is not None:
+                slow_query_log.observe(statement.sql, parameters,
+                                       time.perf_counter() - start, name,
+                                       error)
+
+
+def fetchall(cur):
+    """Return all rows of a cursor, counted in the request's metrics."""
+    with metrics.phase('fetch'):
+        rows = cur.fetchall()
+    metrics.add_rows(len(rows))
+    return rows
+
+
+def search_key(search_string, projection, field, limit, offset, min_rank):
+    """Return the search cache key for a search and its parameters."""
+    return (search_cache.normalize_search_string(search_string), projection,
+            field, limit, offset, min_rank)
+
+
+def page_response(column_names, rows, limit, after_id):
+    """Return the response data for a page of all interviews."""
+    return {
+        'row_count': len(rows),
+        'column_names': column_names,
+        'rows': rows,
+        'limit': limit,
+        'after_id': after_id,
+        'next_after_id': rows[-1][0] if len(rows) == limit else None,
+    }
+
+
+def any_response(ids, column_names, rows):
+    """Return the response data for a list of interviews."""
+    return {
+        'search_ids_count': len(ids),
+        'search_ids': ids,
+        'row_count': len(rows),
+        'column_names': column_names,
+        'rows': rows,
+    }
+
+
+def search_response(column_names, rows, field, limit, offset, min_rank):
+    """Return the response data for a page of ranked interviews.
+
+    The search_string key is not included, as this data may be cached for
+    equivalent search strings.
+    """
+    return {
+        'row_count': len(rows),
+        'column_names': column_names,
+        'rows': rows,
+        'field': field,
+        'limit': limit,
+        'offset': offset,
+        'min_rank': min_rank,
+        'next_offset': offset + limit if len(rows) == limit else None,
+    }
+
+
+STATEMENTS = generate_statements()
+
+
+def meta_fields(lexicon):
+    """Return the additional response data for the meta projections.
+
+    The stopwords are served by the /meta/lexicon route, and only the
+    lexicon's ETag is included.
+    """
+    return {
+        'stemmer': lexicon.stemmer,
+        'lexicon': '/meta/lexicon',
+        'lexicon_etag': lexicon.etag,
+    }
@@ -0,0 +1,156 @@
+"""Response representations and compression for the GEO API servers.
+
+Response data may be represented as JSON (default), MessagePack or NDJSON
+(one JSON object per row of the response), negotiated with the Accept
+header. Responses are compressed with brotli or gzip, negotiated with the
+Accept-Encoding header. MessagePack and brotli are optional, and are only
+offered if the msgpack and brotli packages are installed.
+"""
+import gzip
+import zlib
+
+try:
+    import brotli
+except ImportError:  # brotli is optional
+    brotli = None
+try:
+    import msgpack
+except ImportError:  # msgpack is optional
+    msgpack = None
+
+import serialization
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+NDJSON = 'application/x-ndjson'
+
+# Alternative names of media types
+ALIASES = {'application/x-msgpack': MSGPACK}
+
+# Media types worth compressing, besides text/*
+COMPRESSIBLE = {JSON, MSGPACK, NDJSON}
+
+
+def encode_json(data):
+    """Return the JSON representation of response data."""
+    return serialization.dumps(data)
+
+
+def encode_msgpack(data):
+    """Return the MessagePack representation of response data."""
+    return msgpack.packb(serialization.parse_raw_json(data),
+                         use_bin_type=True)
+
+
+def encode_ndjson(data):
+    """Return the NDJSON representation of response data.
+
+    Responses with rows (and column_names) have a line for each row, mapping
+    column names to values, as in streamed responses. Other responses have a
+    single line.
+    """
+    if isinstance(data, dict) and 'rows' in data and 'column_names' in data:
+        lines = (dict(zip(data['column_names'], row)) for row in data['rows'])
+    else:
+        lines = (data, )
+    return b''.join(serialization.dumps(line) + b'\n' for line in lines)
+
+
+ENCODERS = {JSON: encode_json, NDJSON: encode_ndjson}
+if msgpack is not None:
+    ENCODERS[MSGPACK] = encode_msgpack
+
+
+def parse_header(value):
+    """Return the (token, quality) pairs of an Accept-like header value,
+    sorted by decreasing quality (stable for equal qualities)."""
+    items = []
+    for part in (value or '').split(','):
+        token, _, params = part.strip().partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, q = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    quality = float(q)
+                except ValueError:
+                    quality = 0.0
+        if token:
+            items.append((token.strip().lower(), quality))
+    return sorted(items, key=lambda item: -item[1])
+
+
+def negotiate_type(accept, default=JSON):
+    """Return the best media type of ENCODERS for an Accept header value.
+
+    Returns 'default' if the header is missing or matches no media type.
+    """
+    for token, quality in parse_header(accept):
+        if quality <= 0:
+            continue
+        token = ALIASES.get(token, token)
+        if token in ENCODERS:
+            return token
+        if token in ('*/*', 'application/*'):
+            return default
+    return default
+
+
+def negotiate_encoding(accept_encoding):
+    """Return the best content coding ('br' or 'gzip') for an
+    Accept-Encoding header value, or None."""
+    available = ['br', 'gzip'] if brotli is not None else ['gzip']
+    qualities = dict(parse_header(accept_encoding))
+    best, best_quality = None, 0.0
+    for coding in available:
+        quality = qualities.get(coding, qualities.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+def compressible(media_type):
+    """Return whether responses of a media type should be compressed."""
+    media_type = (media_type or '').split(';')[0].strip().lower()
+    return media_type in COMPRESSIBLE or media_type.startswith('text/')
+
+
+def compress(body, encoding, level=6):
+    """Return a body compressed with a content coding ('br' or 'gzip').
+
+    'level' is the gzip compression level (1-9); brotli uses quality
+    level - 1 (0-11 scale), which is faster than its default at similar
+    ratios for JSON.
+    """
+    if encoding == 'br':
+        return brotli.compress(body, quality=max(level - 1, 0))
+    return gzip.compress(body, compresslevel=level)
+
+
+class Compressor(object):
+    """Incremental compressor for a content coding ('br' or 'gzip')."""
+    def __init__(self, encoding, level=6):
+        if encoding == 'br':
+            compressor = brotli.Compressor(quality=max(level - 1, 0))
+            self.process, self.finish = compressor.process, compressor.finish
+        else:
+            compressor = zlib.compressobj(level, zlib.DEFLATED,
+                                          16 + zlib.MAX_WBITS)
+            self.process, self.finish = compressor.compress, compressor.flush
+
+
+def compress_stream(chunks, encoding, level=6):
+    """Yield a stream of chunks (bytes or str) compressed with a content
+    coding. The source iterator is closed when the stream is closed."""
+    compressor = Compressor(encoding, level)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            output = compressor.process(chunk)
+            if output:
+                yield output
+        yield compressor.finish()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
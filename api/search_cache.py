@@ -0,0 +1,115 @@
+"""Search result cache for the GEO API, invalidated by table versions."""
+import collections
+import threading
+
+import serialization
+
+
+def normalize_search_string(search_string):
+    """Return the normalized form of a search string, for cache keys.
+
+    Search strings are case-insensitive for websearch_to_tsquery, and
+    sequences of whitespace characters are equivalent to a single space.
+    """
+    return ' '.join(search_string.lower().split())
+
+
+def estimate_size(value):
+    """Return an estimate of the size of the JSON encoding of value, in
+    bytes, from the lengths of its strings and raw JSON values.
+
+    Cheaper than encoding the value, and close enough for the byte bound of
+    the cache (strings are counted in characters, without escapes).
+    """
+    if isinstance(value, str):
+        return len(value) + 2
+    if isinstance(value, serialization.RawJSON):
+        return len(value.text)
+    if isinstance(value, dict):
+        return 2 + sum(
+            len(str(key)) + 4 + estimate_size(item)
+            for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return 2 + sum(estimate_size(item) + 1 for item in value)
+    return 8
+
+
+class SearchCache(object):
+    """LRU cache for search results, bounded by their size in bytes.
+
+    Each entry is stored along with the version of the interviews table
+    (from the table_versions table), which is incremented by a trigger
+    whenever rows are inserted, updated or deleted. When a lookup or insertion
+    is made with a newer version, all entries are discarded; lookups with an
+    older version (from requests that read the table before the update) miss,
+    and insertions with an older version are ignored.
+    The size of an entry is estimated from its values (see estimate_size),
+    without encoding it.
+    Hit, miss and eviction counters are kept for sizing of the cache.
+    """
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = collections.OrderedDict()  # key -> (data, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _check_version(self, version):
+        """Discard all entries if version is newer, and return whether the
+        entries are of the given version. Must be called with lock."""
+        if self.version is None or version > self.version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._bytes = 0
+            self.version = version
+        return version == self.version
+
+    def get(self, key, version):
+        """Return a copy of the cached data for key and version, or None."""
+        with self._lock:
+            entry = None
+            if self._check_version(version):
+                entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(entry[0])
+
+    def put(self, key, version, data):
+        """Store data for key and version, evicting the oldest entries."""
+        size = estimate_size(data)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if not self._check_version(version):
+                return
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            while self._bytes + size > self.max_bytes:
+                self._bytes -= self._entries.popitem(last=False)[1][1]
+                self.evictions += 1
+            self._entries[key] = (dict(data), size)
+            self._bytes += size
+
+    def stats(self):
+        """Return a dict with the cache counters and occupancy."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else None,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'version': self.version,
+            }
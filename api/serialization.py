@@ -0,0 +1,126 @@
+"""JSON serialization of query results for the GEO API servers.
+
+psycopg2 parses json and jsonb values (e.g., the meta column) into Python
+objects, which the servers immediately encode back to JSON. With
+register_raw_json(), these values are fetched as RawJSON instead, holding the
+JSON text sent by the server, and dumps() embeds them verbatim in responses.
+dumps() uses orjson if installed (version 3.9 or newer), or json.dumps()
+otherwise, splicing the raw values into its output. Responses without raw
+values (e.g., of the ids and text projections) are encoded by json.dumps()
+alone, at the speed of its C encoder.
+"""
+import json
+import secrets
+
+import psycopg2.extensions
+
+try:
+    import orjson
+    if not hasattr(orjson, 'Fragment'):  # orjson < 3.9
+        orjson = None
+except ImportError:  # orjson is optional
+    orjson = None
+
+# OIDs of the json and jsonb types
+JSON_OIDS = (114, 3802)
+
+
+class RawJSON(object):
+    """JSON text of a json/jsonb value, embedded verbatim by dumps()."""
+    __slots__ = ('text', )
+
+    def __init__(self, text):
+        self.text = text
+
+    def __repr__(self):
+        return 'RawJSON(%r)' % self.text
+
+    def __str__(self):
+        return self.text
+
+    def __eq__(self, other):
+        return isinstance(other, RawJSON) and self.text == other.text
+
+    def __hash__(self):
+        return hash(self.text)
+
+    def __reduce__(self):
+        return (RawJSON, (self.text, ))
+
+    def loads(self):
+        """Return the parsed JSON value."""
+        return json.loads(self.text)
+
+
+def cast_raw_json(value, cur):
+    """psycopg2 typecaster of json/jsonb values to RawJSON."""
+    return RawJSON(value) if value is not None else None
+
+
+RAW_JSON = psycopg2.extensions.new_type(JSON_OIDS, 'RAW_JSON', cast_raw_json)
+
+
+def register_raw_json(scope):
+    """Fetch json/jsonb values as RawJSON in a psycopg2 connection or cursor.
+
+    Registering in cursors only affects their own queries, so other queries
+    of the same connection (e.g., the bag-of-words export, which reads the
+    parsed meta column) are unaffected.
+    """
+    psycopg2.extensions.register_type(RAW_JSON, scope)
+
+
+def parse_raw_json(obj):
+    """Return a copy of response data with RawJSON values parsed, for
+    encoders that cannot embed JSON text (e.g., MessagePack)."""
+    if isinstance(obj, RawJSON):
+        return obj.loads()
+    if isinstance(obj, dict):
+        return {key: parse_raw_json(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [parse_raw_json(value) for value in obj]
+    return obj
+
+
+def _orjson_default(obj):
+    if isinstance(obj, RawJSON):
+        return orjson.Fragment(obj.text)
+    raise TypeError('Object of type %s is not JSON serializable' %
+                    type(obj).__name__)
+
+
+def dumps_stdlib(data):
+    """Return the JSON encoding of response data (bytes), with json.dumps().
+
+    RawJSON values are encoded as placeholder strings, with a random token,
+    which are then replaced by their text.
+    """
+    raw = []
+    token = None
+
+    def placeholder(obj):
+        nonlocal token
+        if not isinstance(obj, RawJSON):
+            raise TypeError('Object of type %s is not JSON serializable' %
+                            type(obj).__name__)
+        if token is None:
+            token = 'raw-json-%s-' % secrets.token_hex(8)
+        raw.append(obj.text)
+        return '%s%d' % (token, len(raw) - 1)
+
+    text = json.dumps(data, default=placeholder)
+    if raw:
+        parts = text.split('"' + token)
+        for i in range(1, len(parts)):
+            index, rest = parts[i].split('"', 1)
+            parts[i] = raw[int(index)] + rest
+        text = ''.join(parts)
+    return text.encode('utf-8')
+
+
+def dumps_orjson(data):
+    """Return the JSON encoding of response data (bytes), with orjson."""
+    return orjson.dumps(data, default=_orjson_default)
+
+
+dumps = dumps_orjson if orjson is not None else dumps_stdlib
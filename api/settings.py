@@ -0,0 +1,171 @@
+"""Configuration and command line arguments shared by the GEO API programs.
+
+The attributes of config.py are used if it exists, and any attribute it does
+not provide is taken from DEFAULTS, so the servers (api.py, api_async.py)
+and the command line tools of this directory share a single set of defaults.
+"""
+import argparse
+import getpass
+
+# Default values of the attributes of config.py
+DEFAULTS = {
+    'MIN_CONNECTIONS': -1,
+    'MAX_CONNECTIONS': -1,
+    'HOSTNAME': '',
+    'PORT': -1,
+    'DBNAME': '',
+    'USERNAME': '',
+    'PASSWORD': '',
+    'PAGE_SIZE': 100,
+    'MAX_PAGE_SIZE': 1000,
+    'STREAM_ITERSIZE': 100,
+    'CREDENTIAL_CACHE_TTL': 300,
+    'CREDENTIAL_CACHE_SIZE': 1024,
+    'TOKEN_SECRET_KEY': None,
+    'TOKEN_TTL': 900,
+    'SEARCH_CACHE_MAX_BYTES': 64 * 1024 * 1024,
+    'SEARCH_PAGE_SIZE': 20,
+    'SEARCH_RANK_WEIGHTS': [0.1, 0.2, 0.4, 1.0],
+    'POOL_TIMEOUT': 30,
+    'POOL_MAX_IDLE': 60,
+    'POOL_MAX_AGE': 3600,
+    'LEXICON_MAX_AGE': 86400,
+    'BOW_EXPORT_DIR': None,
+    'COMPRESSION_MIN_SIZE': 1024,
+    'COMPRESSION_LEVEL': 6,
+    'SLOW_QUERY_MS': None,
+    'SLOW_QUERY_EXPLAIN': False,
+    'SLOW_QUERY_EXPLAIN_TIMEOUT': 30,
+    'SLOW_QUERY_LOG': None,
+    'ADMIN_USERS': [],
+}
+
+try:
+    import config  # Try to import attributes from config.py
+except Exception as e:  # If no config.py, define Object with empty attributes
+    print('Warning: No config.py found. ' +
+          'Using empty values for non-provided connection attributes. ' +
+          str(e))
+
+    class Object(object):
+        """Dummy class for config attributes."""
+        pass
+
+    config = Object()
+
+for name, value in DEFAULTS.items():
+    if not hasattr(config, name):
+        setattr(config, name, value)
+if not hasattr(config, 'pwd_context'):
+    import passlib.context  # for default pwd_context
+    config.pwd_context = passlib.context.CryptContext(
+        schemes=["pbkdf2_sha256"], deprecated="auto")
+
+
+class PasswordPromptAction(argparse.Action):
+    """Custom class for argparse.Action for password prompt with getpass."""
+    def __init__(self,
+                 option_strings,
+                 dest=None,
+                 nargs=0,
+                 default=None,
+                 required=False,
+                 type=None,
+                 metavar=None,
+                 help=None):
+        super(PasswordPromptAction,
+              self).__init__(option_strings=option_strings,
+                             dest=dest,
+                             nargs=nargs,
+                             default=default,
+                             required=required,
+                             metavar=metavar,
+                             type=type,
+                             help=help)
+
+    def __call__(self, parser, args, values, option_string=None):
+        password = getpass.getpass()
+        setattr(args, self.dest, password)
+
+
+def add_connection_arguments(parser):
+    """Add the database connection arguments to an ArgumentParser.
+
+    Arguments: -H/--host, -p/--port, -d/--dbname, -u/--username and
+    --password, with defaults from config.
+    """
+    parser.add_argument('-H',
+                        '--host',
+                        action='store',
+                        default=config.HOSTNAME,
+                        type=str,
+                        required=False,
+                        help='database server host or socket directory ' +
+                        '(default=config.HOSTNAME)',
+                        metavar='HOSTNAME',
+                        dest='hostname')
+    parser.add_argument('-p',
+                        '--port',
+                        action='store',
+                        default=config.PORT,
+                        type=int,
+                        required=False,
+                        help='database server port ' + '(default=config.PORT)',
+                        metavar='PORT',
+                        dest='port')
+    parser.add_argument('-d',
+                        '--dbname',
+                        action='store',
+                        default=config.DBNAME,
+                        type=str,
+                        required=False,
+                        help='database name to connect to ' +
+                        '(default=config.DBNAME)',
+                        metavar='DBNAME',
+                        dest='dbname')
+    parser.add_argument('-u',
+                        '--username',
+                        action='store',
+                        default=config.USERNAME,
+                        type=str,
+                        required=False,
+                        help='database user name ' +
+                        '(default=config.USERNAME)',
+                        metavar='USERNAME',
+                        dest='username')
+    parser.add_argument('--password',
+                        action=PasswordPromptAction,
+                        default=config.PASSWORD,
+                        type=str,
+                        required=False,
+                        help='password prompt ' + '(default=config.PASSWORD)',
+                        metavar='',
+                        dest='password')
+    return parser
+
+
+def add_pool_arguments(parser):
+    """Add the connection pool arguments of the servers to an ArgumentParser.
+
+    Arguments: --min-connections and --max-connections, with defaults from
+    config.
+    """
+    parser.add_argument('--min-connections',
+                        action='store',
+                        default=config.MIN_CONNECTIONS,
+                        type=int,
+                        required=False,
+                        help='minimum number of connections in pool' +
+                        '(default=config.MIN_CONNECTIONS)',
+                        metavar='MIN-CONNECTIONS',
+                        dest='min_connections')
+    parser.add_argument('--max-connections',
+                        action='store',
+                        default=config.MAX_CONNECTIONS,
+                        type=int,
+                        required=False,
+                        help='maximum number of connections in pool' +
+                        '(default=config.MAX_CONNECTIONS)',
+                        metavar='MAX-CONNECTIONS',
+                        dest='max_connections')
+    return parser
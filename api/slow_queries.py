@@ -0,0 +1,231 @@
+"""Slow-query log of the GEO API servers.
+
+Statements slower than a threshold are logged with their parameters and
+duration, also if they fail (e.g., cancelled by a statement timeout), and
+aggregated by statement and parameters, so the top offenders
+(e.g., search strings with very common stems or long OR chains) may be
+listed by the /admin/slow-queries route.
+
+Optionally, slow statements are run again under EXPLAIN (ANALYZE, BUFFERS)
+by a background thread, in a dedicated connection with a statement timeout,
+and their plans are logged too. Failed statements are only explained
+without ANALYZE, as running them again would likely fail again. Each
+statement and parameters is explained at most once per explain interval, and
+statements are dropped (not queued) when the thread is busy, so pathological
+queries do not pile up on the server.
+
+Log records are JSON lines, written to a rotating local file (or to stderr,
+if no file is given).
+"""
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+import queries
+
+# Statement names, by SQL, for statements executed by their SQL
+STATEMENT_NAMES = {
+    statement.sql: name
+    for name, statement in queries.STATEMENTS.items()
+}
+
+
+def _json(value):
+    """Return the JSON encoding of a log record or of parameters (str)."""
+    return json.dumps(value, sort_keys=True, default=str)
+
+
+class SlowQueryLog(object):
+    """Log and aggregate of statements slower than threshold_ms.
+
+    'connect' is a function returning a new psycopg2 connection, used to
+    explain slow statements; if None, statements are not explained. Up to
+    max_entries statements and parameters are aggregated, evicting the one
+    with the smallest total duration. Thread-safe.
+    """
+    def __init__(self,
+                 threshold_ms=500,
+                 connect=None,
+                 path=None,
+                 explain_timeout=30,
+                 explain_interval=300,
+                 max_entries=1000,
+                 max_bytes=10 * 1024 * 1024,
+                 backup_count=5):
+        self.threshold = threshold_ms / 1000
+        self.connect = connect
+        self.explain_timeout = explain_timeout
+        self.explain_interval = explain_interval
+        self.max_entries = max_entries
+        self.count = 0
+        self.explained = 0
+        self.dropped = 0
+        self._entries = {}  # (name, parameters JSON) -> dict
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=16)
+        self._thread = None
+        self.logger = logging.Logger('geo.slow_queries', logging.INFO)
+        if path is None:
+            handler = logging.StreamHandler()
+        else:
+            handler = logging.handlers.RotatingFileHandler(
+                path, maxBytes=max_bytes, backupCount=backup_count)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        self.logger.addHandler(handler)
+
+    def _log(self, **record):
+        self.logger.info(_json(dict(record, time=time.time())))
+
+    def observe(self, sql, parameters, seconds, name=None, error=None):
+        """Record an executed statement, if slower than the threshold.
+
+        'name' is the statement's name in queries.STATEMENTS, which is looked
+        up by its SQL if not given. 'error' is the exception raised by the
+        statement, if it failed.
+        """
+        if seconds < self.threshold:
+            return
+        if name is None:
+            name = STATEMENT_NAMES.get(sql, 'unnamed')
+        key = (name, _json(parameters))
+        now = time.time()
+        explain = False
+        with self._lock:
+            self.count += 1
+            entry = self._entries.get(key)
+            if entry is None:
+                if len(self._entries) >= self.max_entries:
+                    del self._entries[min(
+                        self._entries,
+                        key=lambda k: self._entries[k]['total_ms'])]
+                entry = self._entries[key] = {
+                    'statement': name,
+                    'parameters': parameters,
+                    'count': 0,
+                    'errors': 0,
+                    'last_error': None,
+                    'total_ms': 0.0,
+                    'max_ms': 0.0,
+                    'last_seen': None,
+                    'explained_at': None,
+                    'plan': None,
+                }
+            duration_ms = seconds * 1000
+            entry['count'] += 1
+            entry['total_ms'] += duration_ms
+            entry['max_ms'] = max(entry['max_ms'], duration_ms)
+            entry['last_seen'] = now
+            if error is not None:
+                error = '%s: %s' % (type(error).__name__, str(error).strip())
+                entry['errors'] += 1
+                entry['last_error'] = error
+            if (self.connect is not None
+                    and (entry['explained_at'] is None or now -
+                         entry['explained_at'] >= self.explain_interval)):
+                entry['explained_at'] = now
+                explain = True
+        self._log(event='slow_query',
+                  statement=name,
+                  duration_ms=round(duration_ms, 3),
+                  parameters=parameters,
+                  error=error)
+        if explain:
+            self._explain_later(key, sql, parameters, error is None)
+
+    def _explain_later(self, key, sql, parameters, analyze):
+        """Queue a statement for the explain thread, starting it if needed."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name='slow-query-explain',
+                                                daemon=True)
+                self._thread.start()
+        try:
+            self._queue.put_nowait((key, sql, parameters, analyze))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+                self._entries.get(key, {})['explained_at'] = None
+
+    def _run(self):
+        """Explain queued statements, until None is queued."""
+        conn = None
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            key, sql, parameters, analyze = item
+            try:
+                if conn is None or conn.closed:
+                    conn = self.connect()
+                    conn.autocommit = True
+                    with conn.cursor() as cur:
+                        cur.execute('SET statement_timeout = %s',
+                                    (int(self.explain_timeout * 1000), ))
+                plan = self.explain(conn, sql, parameters, analyze)
+            except Exception as e:
+                plan = None
+                self._log(event='explain_error',
+                          statement=key[0],
+                          parameters=parameters,
+                          error=str(e))
+                if conn is not None and not conn.closed:
+                    conn.close()
+                conn = None
+            if plan is not None:
+                with self._lock:
+                    self.explained += 1
+                    entry = self._entries.get(key)
+                    if entry is not None:
+                        entry['plan'] = plan
+                self._log(event='explain',
+                          analyze=analyze,
+                          statement=key[0],
+                          parameters=parameters,
+                          plan=plan)
+        if conn is not None:
+            conn.close()
+
+    @staticmethod
+    def explain(conn, sql, parameters, analyze=True):
+        """Return the EXPLAIN (ANALYZE, BUFFERS) plan of a statement (str).
+
+        The statement is run with its SQL, not as a prepared statement, so
+        the plan is a custom plan for the given parameters. If analyze is
+        false, the plan is only estimated with EXPLAIN, and the statement is
+        not run.
+        """
+        with conn.cursor() as cur:
+            cur.execute(('EXPLAIN (ANALYZE, BUFFERS) ' if analyze else
+                         'EXPLAIN ') + sql, parameters)
+            return '\n'.join(row[0] for row in cur.fetchall())
+
+    def top(self, limit=20, order='total_ms'):
+        """Return the top statements and parameters, by total_ms, max_ms or
+        count, and the log counters."""
+        with self._lock:
+            entries = sorted(self._entries.values(),
+                             key=lambda entry: entry[order],
+                             reverse=True)[:limit]
+            return {
+                'threshold_ms': self.threshold * 1000,
+                'slow_queries': self.count,
+                'explained': self.explained,
+                'dropped': self.dropped,
+                'order': order,
+                'entries': [dict(entry) for entry in entries],
+            }
+
+    def close(self, timeout=None):
+        """Stop the explain thread, waiting up to timeout seconds."""
+        with self._lock:
+            thread = self._thread
+        if thread is not None:
+            try:
+                self._queue.put(None, timeout=timeout)
+            except queue.Full:
+                return
+            thread.join(timeout)
@@ -0,0 +1,23 @@
+"""Tests of the columnar export of bags-of-words (bow_export.py)."""
+import bow_export
+import queries
+
+
+def test_build_row_without_bow():
+    """Rows without bag-of-words metadata are exported as empty rows."""
+    bow = {'jogo': 2, 'time': 1}
+    rows = [
+        (1, ) + (bow, ) * len(queries.BOW_COLUMNS),
+        (2, ) + (None, ) * len(queries.BOW_COLUMNS),
+        (3, ) + ({'gol': 3}, ) * len(queries.BOW_COLUMNS),
+    ]
+    arrays = bow_export.build(rows)
+    assert arrays['ids'].tolist() == [1, 2, 3]
+    vocabulary = bow_export.decode_vocabulary(arrays, 'bow')
+    assert vocabulary == ['gol', 'jogo', 'time']
+    for field, kind in queries.BOW_COLUMNS:
+        prefix = '%s_%s_' % (field, kind)
+        assert arrays[prefix + 'indptr'].tolist() == [0, 2, 2, 3]
+        assert arrays[prefix + 'indices'].tolist() == [1, 2, 0]
+        assert arrays[prefix + 'data'].tolist() == [2, 1, 3]
+        assert arrays[prefix + 'shape'].tolist() == [3, 3]
@@ -0,0 +1,126 @@
+"""Benchmark of the bag-of-words stage of metadata generation.
+
+Compares the previous implementation (list.count() for each distinct token)
+with metadata.generate_meta (single pass), with plain and cached stemming,
+on the interviews stored in the database, checking that all of them produce
+identical 'meta' dicts.
+"""
+import argparse
+import time
+
+import nltk.corpus
+import psycopg2
+
+import lexicon
+import metadata
+import stemming
+
+try:
+    import config  # Try to import attributes from config.py
+except Exception as e:  # If no config.py, define Object with empty attributes
+    print('Warning: No config.py found. ' +
+          'Using empty values for non-provided connection attributes. ' +
+          str(e))
+
+    class Object(object):
+        """Dummy class for config attributes."""
+        pass
+
+    config = Object()
+    config.HOSTNAME = ''
+    config.PORT = -1
+    config.DBNAME = ''
+    config.USERNAME = ''
+    config.PASSWORD = ''
+
+
+def legacy_meta(interview_split, stemmer):
+    """Return the meta dict of an interview, as in the previous version."""
+    tokens = {
+        field: set(interview_split[field]) -
+        set(nltk.corpus.stopwords.words('portuguese'))
+        for field in metadata.FIELDS
+    }
+    meta = {
+        field: {
+            'bow': {},
+            'bow_stemmed': {}
+        }
+        for field in metadata.FIELDS
+    }
+    for field in metadata.FIELDS:
+        for token in tokens[field]:
+            meta[field]['bow'][token] = interview_split[field].count(token)
+            meta[field]['bow_stemmed'][stemmer.stem(
+                token)] = meta[field]['bow_stemmed'].get(
+                    stemmer.stem(token), 0) + meta[field]['bow'][token]
+    return meta
+
+
+def generate_argparser():
+    """Return ArgumentParser object for the benchmark."""
+    parser = argparse.ArgumentParser(
+        description='Benchmark of bag-of-words generation for interviews.')
+    parser.add_argument('-n',
+                        '--limit',
+                        action='store',
+                        default=None,
+                        type=int,
+                        required=False,
+                        help='maximum number of interviews (default=all)',
+                        metavar='LIMIT',
+                        dest='limit')
+    return parser
+
+
+if __name__ == "__main__":
+    args = generate_argparser().parse_args()
+    nltk.download('punkt')
+    nltk.download('stopwords')
+    nltk.download('rslp')
+
+    # Load and tokenize interviews (not timed)
+    conn = psycopg2.connect(host=config.HOSTNAME,
+                            port=config.PORT,
+                            dbname=config.DBNAME,
+                            user=config.USERNAME,
+                            password=config.PASSWORD)
+    with conn.cursor() as cur:
+        cur.execute(
+            """SELECT text, questions, answers FROM interviews
+                ORDER BY id LIMIT %(limit)s;""", {'limit': args.limit})
+        interviews = [{
+            'text': text.split('\n'),
+            'bold': questions,
+            'nonbold': answers
+        } for text, questions, answers in cur]
+    conn.close()
+    splits = [metadata.split_interview(i) for i in interviews]
+    print('Interviews: %d, tokens: %d' %
+          (len(splits), sum(len(s['text']) for s in splits)))
+
+    stemmer = lexicon.stemmer()
+    stopwords = lexicon.stopwords()
+
+    start = time.perf_counter()
+    legacy = [legacy_meta(s, stemmer) for s in splits]
+    legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    current = [metadata.generate_meta(s, stopwords, stemmer) for s in splits]
+    current_time = time.perf_counter() - start
+
+    cached_stemmer = stemming.CachedStemmer(stemmer)
+    start = time.perf_counter()
+    cached = [
+        metadata.generate_meta(s, stopwords, cached_stemmer) for s in splits
+    ]
+    cached_time = time.perf_counter() - start
+
+    assert legacy == current == cached, 'meta dicts differ'
+    print('list.count():  %.3f s' % legacy_time)
+    print('single pass:   %.3f s (speedup: %.1fx)' %
+          (current_time, legacy_time / current_time))
+    print('cached stems:  %.3f s (speedup: %.1fx, hit ratio: %.3f)' %
+          (cached_time, legacy_time / cached_time,
+           cached_stemmer.hit_ratio()))
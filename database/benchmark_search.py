@@ -0,0 +1,414 @@
+"""Benchmark of full-text search methods on the interviews table.
+
+Use "-h" for more help. Runs a fixed workload of searches (single terms,
+phrases and websearch_to_tsquery operators) with each method:
+
+    ilike   text ILIKE patterns (sequential scan)
+    regex   text ~* word-boundary regular expressions (sequential scan)
+    gin     tstext @@ websearch_to_tsquery, with the GIN index of tstext
+    gist    the same, with a GiST index of tstext (built in a transaction
+            that also drops the GIN index, and is rolled back)
+    rank    the ranked search of the API: ts_rank_cd(weights, tstext, query,
+            1|4|32), top rows by rank, with the GIN index
+
+Each search is run with EXPLAIN (ANALYZE, BUFFERS), keeping the median
+execution time of the repetitions, and the planning time, buffers and scan
+node of the last one. With --sizes, the table is grown to each corpus size
+with synthetic interviews (see synthetic.py) and analyzed before the
+workload, and the synthetic interviews are deleted at the end (unless --keep
+is given). Results are printed as a comparison table, and may be saved as
+JSON.
+"""
+import argparse
+import collections
+import json
+import os
+import re
+import statistics
+
+import psycopg2
+
+import loader
+import synthetic
+from insert_interviews import PasswordPromptAction, config
+
+METHODS = ('ilike', 'regex', 'gin', 'gist', 'rank')
+
+# Weights of ts_rank_cd, as config.SEARCH_RANK_WEIGHTS of the API
+RANK_WEIGHTS = [0.1, 0.2, 0.4, 1.0]
+RANK_LIMIT = 20
+
+# A search of the workload: its websearch_to_tsquery string, and the
+# equivalent pattern conditions, as a disjunction of conjunctions of
+# (pattern, negated) pairs
+Query = collections.namedtuple('Query', ['name', 'websearch', 'patterns'])
+
+WORKLOAD = (
+    Query('term', 'treino', [[('treino', False)]]),
+    Query('rare term', 'olimpíada', [[('olimpíada', False)]]),
+    Query('two terms', 'vitória campeonato', [[('vitória', False),
+                                               ('campeonato', False)]]),
+    Query('phrase', '"seleção brasileira"',
+          [[('seleção brasileira', False)]]),
+    Query('or', 'medalha or pódio', [[('medalha', False)],
+                                     [('pódio', False)]]),
+    Query('negation', 'jogo -derrota', [[('jogo', False),
+                                        ('derrota', True)]]),
+)
+
+GIN_INDEX = 'interviews_idx_tstext'
+GIST_INDEX = 'interviews_idx_tstext_gist'
+
+
+def pattern_condition(query, operator, pattern):
+    """Return the SQL condition and parameters of a query's patterns.
+
+    'pattern' converts each pattern to the operand of 'operator'.
+    """
+    groups, parameters = [], []
+    for group in query.patterns:
+        conditions = []
+        for text, negated in group:
+            conditions.append('text %s%s %%s' %
+                              ('NOT ' if negated else '', operator))
+            parameters.append(pattern(text))
+        groups.append('(' + ' AND '.join(conditions) + ')')
+    return ' OR '.join(groups), parameters
+
+
+def ilike_pattern(text):
+    """Return the ILIKE pattern of a text, matching it anywhere."""
+    return '%' + re.sub(r'([%_\\])', r'\\\1', text) + '%'
+
+
+def regex_pattern(text):
+    """Return the regular expression of a text, matching whole words."""
+    return r'\m' + re.escape(text) + r'\M'
+
+
+def statement(method, query):
+    """Return the SQL statement and parameters of a query with a method."""
+    if method == 'ilike':
+        condition, parameters = pattern_condition(query, 'ILIKE',
+                                                  ilike_pattern)
+        return 'SELECT id FROM interviews WHERE ' + condition, parameters
+    if method == 'regex':
+        condition, parameters = pattern_condition(query, '~*', regex_pattern)
+        return 'SELECT id FROM interviews WHERE ' + condition, parameters
+    if method in ('gin', 'gist'):
+        return ("""SELECT id
+            FROM interviews,
+                websearch_to_tsquery('portuguese', %s) query
+            WHERE tstext @@ query""", [query.websearch])
+    if method == 'rank':
+        return ("""SELECT id,
+                ts_rank_cd(%s::float4[], tstext, query, 1|4|32) AS rank
+            FROM interviews,
+                websearch_to_tsquery('portuguese', %s) query
+            WHERE tstext @@ query
+            ORDER BY rank DESC, id
+            LIMIT %s""", [RANK_WEIGHTS, query.websearch, RANK_LIMIT])
+    raise ValueError('unknown method: ' + method)
+
+
+def scan_node(plan):
+    """Return a description of the first scan node of a plan."""
+    if 'Index Name' in plan:
+        return '%s (%s)' % (plan['Node Type'], plan['Index Name'])
+    if plan['Node Type'] == 'Seq Scan':
+        return plan['Node Type']
+    for child in plan.get('Plans', ()):
+        node = scan_node(child)
+        if node:
+            return node
+    return None
+
+
+def explain(cur, method, query, repeat):
+    """Return the EXPLAIN (ANALYZE, BUFFERS) results of a query."""
+    sql, parameters = statement(method, query)
+    times = []
+    for _ in range(repeat):
+        cur.execute('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + sql,
+                    parameters)
+        result = cur.fetchone()[0]
+        if isinstance(result, str):
+            result = json.loads(result)
+        times.append(result[0]['Execution Time'])
+    plan = result[0]['Plan']
+    return {
+        'rows': plan['Actual Rows'],
+        'execution_ms': statistics.median(times),
+        'planning_ms': result[0]['Planning Time'],
+        'shared_hit': plan.get('Shared Hit Blocks', 0),
+        'shared_read': plan.get('Shared Read Blocks', 0),
+        'scan': scan_node(plan),
+    }
+
+
+def run_workload(conn, methods, repeat):
+    """Return the results of the workload with each method, as a list of
+    dicts. GiST searches run in a rolled back transaction."""
+    results = []
+    index = {}
+    with conn.cursor() as cur:
+        for method in methods:
+            if method == 'gist':
+                continue
+            for query in WORKLOAD:
+                results.append(
+                    dict(method=method,
+                         query=query.name,
+                         **explain(cur, method, query, repeat)))
+        cur.execute('SELECT pg_relation_size(%s::regclass);', [GIN_INDEX])
+        index['gin_bytes'] = cur.fetchone()[0]
+    conn.commit()
+    if 'gist' in methods:
+        with conn.cursor() as cur:
+            cur.execute("SELECT clock_timestamp();")
+            start = cur.fetchone()[0]
+            cur.execute('CREATE INDEX ' + GIST_INDEX +
+                        ' ON interviews USING gist (tstext);')
+            cur.execute("SELECT clock_timestamp();")
+            index['gist_build_ms'] = (cur.fetchone()[0] -
+                                      start).total_seconds() * 1000
+            cur.execute('SELECT pg_relation_size(%s::regclass);',
+                        [GIST_INDEX])
+            index['gist_bytes'] = cur.fetchone()[0]
+            cur.execute('DROP INDEX ' + GIN_INDEX + ';')
+            for query in WORKLOAD:
+                results.append(
+                    dict(method='gist',
+                         query=query.name,
+                         **explain(cur, 'gist', query, repeat)))
+        conn.rollback()
+    return results, index
+
+
+def grow(conn, model, size, first_id, seed, batch_size):
+    """Load synthetic interviews until the table has 'size' rows. Returns
+    the number of rows of the table, and the next synthetic id."""
+    with conn.cursor() as cur:
+        cur.execute('SELECT COUNT(*) FROM interviews;')
+        count = cur.fetchone()[0]
+    if count < size:
+        loader.load(conn,
+                    model.generate(size - count, first_id, seed),
+                    format='binary',
+                    chunk_size=batch_size,
+                    analyze=False)
+        first_id += size - count
+        count = size
+    conn.commit()
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute('VACUUM ANALYZE interviews;')
+    conn.autocommit = autocommit
+    return count, first_id
+
+
+def print_table(results):
+    """Print the comparison table of the results of all corpus sizes.
+
+    Speedups are relative to the ilike method, for the same size and query.
+    """
+    baseline = {(r['size'], r['query']): r['execution_ms']
+                for r in results if r['method'] == 'ilike'}
+    print('%8s %-11s %-6s %8s %11s %9s %9s %9s %8s  %s' %
+          ('size', 'query', 'method', 'rows', 'exec ms', 'plan ms', 'hit',
+           'read', 'speedup', 'scan'))
+    for r in results:
+        speedup = baseline.get((r['size'], r['query']))
+        print('%8d %-11s %-6s %8d %11.3f %9.3f %9d %9d %8s  %s' %
+              (r['size'], r['query'], r['method'], r['rows'],
+               r['execution_ms'], r['planning_ms'], r['shared_hit'],
+               r['shared_read'], '%.1fx' % (speedup / r['execution_ms'])
+               if speedup and r['execution_ms'] else '-', r['scan']))
+
+
+def generate_argparser():
+    """Return ArgumentParser object for the benchmark."""
+    parser = argparse.ArgumentParser(
+        description='Benchmark of full-text search methods on the ' +
+        'interviews of GEO database.',
+        epilog='Report bugs to <https://github.com/andremsouza/ic-geo>')
+    parser.add_argument('-m',
+                        '--methods',
+                        action='store',
+                        default=','.join(METHODS),
+                        type=str,
+                        required=False,
+                        help='comma-separated methods: ' +
+                        ', '.join(METHODS) + ' (default=all methods)',
+                        metavar='METHODS',
+                        dest='methods')
+    parser.add_argument('-s',
+                        '--sizes',
+                        action='store',
+                        default=None,
+                        type=str,
+                        required=False,
+                        help='comma-separated corpus sizes, grown with ' +
+                        'synthetic interviews (default=current size)',
+                        metavar='SIZES',
+                        dest='sizes')
+    parser.add_argument('--model',
+                        action='store',
+                        default='corpus_model.json',
+                        type=str,
+                        required=False,
+                        help='JSON file of the synthetic corpus model, ' +
+                        'learned from the database if it does not exist ' +
+                        '(default="corpus_model.json")',
+                        metavar='MODEL',
+                        dest='model')
+    parser.add_argument('--seed',
+                        action='store',
+                        default=0,
+                        type=int,
+                        required=False,
+                        help='seed of synthetic interviews (default=0)',
+                        metavar='SEED',
+                        dest='seed')
+    parser.add_argument('--keep',
+                        action='store_true',
+                        help='keep synthetic interviews after the benchmark')
+    parser.add_argument('-r',
+                        '--repeat',
+                        action='store',
+                        default=5,
+                        type=int,
+                        required=False,
+                        help='number of repetitions of each search, ' +
+                        'reporting the median (default=5)',
+                        metavar='REPEAT',
+                        dest='repeat')
+    parser.add_argument('-o',
+                        '--output',
+                        action='store',
+                        default=None,
+                        type=str,
+                        required=False,
+                        help='JSON file of results (default=none)',
+                        metavar='OUTPUT',
+                        dest='output')
+    parser.add_argument('-H',
+                        '--host',
+                        action='store',
+                        default=config.HOSTNAME,
+                        type=str,
+                        required=False,
+                        help='database server host or socket directory ' +
+                        '(default=config.HOSTNAME)',
+                        metavar='HOSTNAME',
+                        dest='hostname')
+    parser.add_argument('-p',
+                        '--port',
+                        action='store',
+                        default=config.PORT,
+                        type=int,
+                        required=False,
+                        help='database server port ' + '(default=config.PORT)',
+                        metavar='PORT',
+                        dest='port')
+    parser.add_argument('-d',
+                        '--dbname',
+                        action='store',
+                        default=config.DBNAME,
+                        type=str,
+                        required=False,
+                        help='database name to connect to ' +
+                        '(default=config.DBNAME)',
+                        metavar='DBNAME',
+                        dest='dbname')
+    parser.add_argument('-u',
+                        '--username',
+                        action='store',
+                        default=config.USERNAME,
+                        type=str,
+                        required=False,
+                        help='database user name ' +
+                        '(default=config.USERNAME)',
+                        metavar='USERNAME',
+                        dest='username')
+    parser.add_argument('--password',
+                        action=PasswordPromptAction,
+                        default=config.PASSWORD,
+                        type=str,
+                        required=False,
+                        help='password prompt ' + '(default=config.PASSWORD)',
+                        metavar='',
+                        dest='password')
+
+    return parser
+
+
+if __name__ == "__main__":
+    # Get arguments and connect to database
+    parser = generate_argparser()
+    args = parser.parse_args()
+    methods = [m.strip() for m in args.methods.split(',') if m.strip()]
+    for method in methods:
+        if method not in METHODS:
+            parser.error('unknown method: ' + method)
+    conn = psycopg2.connect(host=args.hostname,
+                            port=args.port,
+                            dbname=args.dbname,
+                            user=args.username,
+                            password=args.password)
+    # Delete sensitive data
+    del args.password
+
+    with conn.cursor() as cur:
+        cur.execute(
+            """SELECT (SELECT COUNT(*) FROM interviews),
+                GREATEST((SELECT MAX(id) FROM interviews),
+                         (SELECT MAX(id) FROM athletes), 0);""")
+        count, max_id = cur.fetchone()
+    conn.rollback()
+    sizes = sorted(int(s) for s in args.sizes.split(',')) if args.sizes else [
+        count
+    ]
+    first_id = next_id = max_id + 1
+    model = None
+    if max(sizes) > count:
+        if os.path.exists(args.model):
+            model = synthetic.CorpusModel.load(args.model)
+        else:
+            print('Learning corpus model from the database...')
+            model = synthetic.CorpusModel.learn(synthetic.fetch_rows(conn))
+            conn.rollback()
+            model.save(args.model)
+
+    results, indexes = [], {}
+    try:
+        for size in sizes:
+            if size < count:
+                print('Skipping size %d, smaller than the table (%d rows)' %
+                      (size, count))
+                continue
+            count, next_id = grow(conn, model, size, next_id, args.seed, 1000)
+            print('Running workload with %d interviews...' % count)
+            size_results, indexes[count] = run_workload(
+                conn, methods, args.repeat)
+            results += [dict(size=count, **r) for r in size_results]
+    finally:
+        conn.rollback()
+        if next_id > first_id and not args.keep:
+            with conn.cursor() as cur:
+                for table in ('interviews', 'athletes'):
+                    cur.execute(
+                        'DELETE FROM ' + table + ' WHERE id >= %s;',
+                        [first_id])
+            conn.commit()
+        conn.close()
+
+    print_table(results)
+    for size, index in sorted(indexes.items()):
+        print('%d interviews: ' % size + ', '.join(
+            '%s=%s' % item for item in sorted(index.items())))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'results': results, 'indexes': indexes}, f, indent=2)
+        print('Results saved to ' + args.output)
@@ -3,3 +3,5 @@ PORT = 32768
 DBNAME = 'geo'
 USERNAME = 'api_admin'
 PASSWORD = 'api_admin'
+PIPELINE_WORKERS = None  # None for the number of CPUs
+PIPELINE_CHUNKSIZE = 1
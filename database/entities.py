@@ -0,0 +1,67 @@
+"""Named entity recognition of interviews, with spaCy.
+
+Only the pipeline components needed by the entity recognizer are enabled, and
+texts are processed in batches with nlp.pipe. Long texts are split at
+paragraph boundaries, and the character offsets of their entities are
+re-based to the full text.
+
+Example:
+    nlp = entities.load_model('pt_core_news_sm')
+    ents = entities.extract(nlp, [i['text'] for i in interviews])
+"""
+import spacy
+
+import metadata
+
+# Components used by the entity recognizer (tok2vec may be shared)
+NER_COMPONENTS = ('tok2vec', 'ner')
+
+
+def load_model(name='pt_core_news_sm'):
+    """Return a spaCy model with only the entity recognition components."""
+    nlp = spacy.load(name)
+    nlp.select_pipes(
+        enable=[c for c in NER_COMPONENTS if c in nlp.pipe_names])
+    return nlp
+
+
+def split_text(paragraphs, max_chars=100000):
+    """Yield (offset, text) parts of the text of a list of paragraphs.
+
+    The text is the paragraphs joined by newlines, and offset is the
+    position of each part in it. Parts have up to 'max_chars' characters,
+    and are split only at paragraph boundaries, so a longer paragraph is
+    kept whole.
+    """
+    offset = 0
+    part = []
+    size = -1
+    for paragraph in paragraphs:
+        if part and size + 1 + len(paragraph) > max_chars:
+            yield offset, '\n'.join(part)
+            offset += size + 1
+            part = []
+            size = -1
+        part.append(paragraph)
+        size += 1 + len(paragraph)
+    if part:
+        yield offset, '\n'.join(part)
+
+
+def extract(nlp, texts, batch_size=64, n_process=1, max_chars=100000):
+    """Return the named entities of each text, as lists of dicts.
+
+    'texts' are lists of paragraphs (e.g., the 'text' field of interviews).
+    Parts of all texts are processed with nlp.pipe, in batches of
+    'batch_size' parts, by 'n_process' processes. Character offsets are
+    relative to the paragraphs joined by newlines.
+    """
+    results = [[] for _ in texts]
+    parts = ((text, (idx, offset)) for idx, paragraphs in enumerate(texts)
+             for offset, text in split_text(paragraphs, max_chars))
+    for doc, (idx, offset) in nlp.pipe(parts,
+                                       as_tuples=True,
+                                       batch_size=batch_size,
+                                       n_process=n_process):
+        results[idx].extend(metadata.named_entities(doc, offset))
+    return results
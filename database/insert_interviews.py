@@ -6,6 +6,8 @@ import docx2json
 import getpass
 import psycopg2
 
+import normalization
+
 try:
     import config  # Try to import attributes from config.py
 except Exception as e:  # If no config.py, define Object with empty attributes
@@ -23,6 +25,8 @@ except Exception as e:  # If no config.py, define Object with empty attributes
     config.DBNAME = ''
     config.USERNAME = ''
     config.PASSWORD = ''
+    config.PIPELINE_WORKERS = None
+    config.PIPELINE_CHUNKSIZE = 1
 
 
 class PasswordPromptAction(argparse.Action):
@@ -141,11 +145,13 @@ if __name__ == "__main__":
     # Delete sensitive data
     del args.password
 
-    # Convert .docx to .json, if needed
+    # Convert .docx to .json, if needed, and normalize it
     if (args.filetype == 'docx'):
         doc = docx2json.convert(args.filepath)
     else:
-        doc = json.load(args.filepath)
+        with open(args.filepath) as f:
+            doc = f.read()
+    doc = json.dumps(normalization.normalize(json.loads(doc)))
 
     # Call stored procedure to insert interview
     with conn.cursor() as cur:
@@ -0,0 +1,274 @@
+"""Script to insert many interviews to GEO database. Use "-h" for more help.
+
+Inserts all interviews from a directory (with files named after the
+interview ids, e.g. "01 Name.docx") or from a manifest file (CSV lines with
+"id,path", or a JSON object mapping ids to paths), reusing a single database
+connection. Documents are converted and normalized in a process pool, and
+inserted in transactional batches. With a progress file, ids of committed
+batches are recorded, and skipped when the script is run again after a
+failure.
+"""
+import argparse
+import csv
+import functools
+import json
+import os
+import re
+import sys
+import time
+
+import docx2json
+import psycopg2
+
+import loader
+import normalization
+import pipeline
+from insert_interviews import PasswordPromptAction, config
+
+
+def generate_argparser():
+    """Return ArgumentParser object for batch insertion."""
+    parser = argparse.ArgumentParser(
+        description='Python script to import many new interviews to GEO ' +
+        'database from .docx files, in batches.',
+        epilog='Report bugs to <https://github.com/andremsouza/ic-geo>')
+    parser.add_argument('source',
+                        type=str,
+                        help='directory with files for insertion, named ' +
+                        'after the ids of the interviews, or manifest file ' +
+                        '(CSV with "id,path" lines, or JSON object).',
+                        metavar='SOURCE')
+    parser.add_argument('-t',
+                        '--type',
+                        action='store',
+                        default='docx',
+                        type=str,
+                        choices=['docx', 'json'],
+                        required=False,
+                        help='type of file for input. ' +
+                        'May be either "docx" or "json" ' + '(default="docx")',
+                        metavar='FILETYPE',
+                        dest='filetype')
+    parser.add_argument('-b',
+                        '--batch-size',
+                        action='store',
+                        default=10,
+                        type=int,
+                        required=False,
+                        help='number of interviews per transaction ' +
+                        '(default=10)',
+                        metavar='BATCH-SIZE',
+                        dest='batch_size')
+    parser.add_argument('-w',
+                        '--workers',
+                        action='store',
+                        default=config.PIPELINE_WORKERS,
+                        type=int,
+                        required=False,
+                        help='number of processes for document conversion ' +
+                        '(default=config.PIPELINE_WORKERS, or number of CPUs)',
+                        metavar='WORKERS',
+                        dest='workers')
+    parser.add_argument('-c',
+                        '--chunksize',
+                        action='store',
+                        default=config.PIPELINE_CHUNKSIZE,
+                        type=int,
+                        required=False,
+                        help='number of documents sent to a process at a ' +
+                        'time (default=config.PIPELINE_CHUNKSIZE)',
+                        metavar='CHUNKSIZE',
+                        dest='chunksize')
+    parser.add_argument('--progress-file',
+                        action='store',
+                        default=None,
+                        type=str,
+                        required=False,
+                        help='file for recording ids of committed ' +
+                        'interviews, which are skipped in later runs',
+                        metavar='PROGRESS-FILE',
+                        dest='progress_file')
+    parser.add_argument('-H',
+                        '--host',
+                        action='store',
+                        default=config.HOSTNAME,
+                        type=str,
+                        required=False,
+                        help='database server host or socket directory ' +
+                        '(default=config.HOSTNAME)',
+                        metavar='HOSTNAME',
+                        dest='hostname')
+    parser.add_argument('-p',
+                        '--port',
+                        action='store',
+                        default=config.PORT,
+                        type=int,
+                        required=False,
+                        help='database server port ' + '(default=config.PORT)',
+                        metavar='PORT',
+                        dest='port')
+    parser.add_argument('-d',
+                        '--dbname',
+                        action='store',
+                        default=config.DBNAME,
+                        type=str,
+                        required=False,
+                        help='database name to connect to ' +
+                        '(default=config.DBNAME)',
+                        metavar='DBNAME',
+                        dest='dbname')
+    parser.add_argument('-u',
+                        '--username',
+                        action='store',
+                        default=config.USERNAME,
+                        type=str,
+                        required=False,
+                        help='database user name ' +
+                        '(default=config.USERNAME)',
+                        metavar='USERNAME',
+                        dest='username')
+    parser.add_argument('--password',
+                        action=PasswordPromptAction,
+                        default=config.PASSWORD,
+                        type=str,
+                        required=False,
+                        help='password prompt ' + '(default=config.PASSWORD)',
+                        metavar='',
+                        dest='password')
+
+    return parser
+
+
+def list_documents(source, filetype):
+    """Return a list of (id, path) of the documents to insert, sorted by id.
+
+    If source is a directory, ids are taken from the leading digits of the
+    file names. Otherwise, source is read as a manifest file, and relative
+    paths are taken from the manifest's directory.
+    """
+    if os.path.isdir(source):
+        documents = []
+        for name in os.listdir(source):
+            match = re.match(r'\d+', name)
+            if match and name.lower().endswith('.' + filetype):
+                documents.append(
+                    (int(match.group()), os.path.join(source, name)))
+        return sorted(documents)
+    if source.lower().endswith('.json'):
+        with open(source) as f:
+            documents = [(int(k), v) for k, v in json.load(f).items()]
+    else:
+        with open(source, newline='') as f:
+            documents = [(int(row[0]), row[1].strip())
+                         for row in csv.reader(f) if row]
+    base = os.path.dirname(os.path.abspath(source))
+    return sorted((id, os.path.join(base, path)) for id, path in documents)
+
+
+def read_progress(progress_file):
+    """Return the set of ids recorded in a progress file."""
+    if not progress_file or not os.path.exists(progress_file):
+        return set()
+    with open(progress_file) as f:
+        return {int(line) for line in f if line.strip()}
+
+
+def read_document(path, filetype):
+    """Return the JSON string of a normalized document, converting it if
+    needed."""
+    if filetype == 'docx':
+        doc = docx2json.convert(path)
+    else:
+        with open(path) as f:
+            doc = f.read()
+    return json.dumps(normalization.normalize(json.loads(doc)))
+
+
+def batches(iterable, size):
+    """Yield lists of up to 'size' items from an iterable."""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def insert_batch(conn, batch):
+    """Insert a batch of (id, document) in a single transaction.
+
+    Missing athletes are inserted first, with a single COPY.
+    """
+    loader.copy_athletes(conn, [id for id, _ in batch], skip_existing=True)
+    with conn.cursor() as cur:
+        for id, doc in batch:
+            cur.execute('CALL interview_insert(%(id)s, %(doc)s);', {
+                'id': id,
+                'doc': doc
+            })
+        cur.close()
+    conn.commit()
+
+
+if __name__ == "__main__":
+    # Get arguments and list documents, skipping committed ones
+    parser = generate_argparser()
+    args = parser.parse_args()
+    done = read_progress(args.progress_file)
+    documents = [(id, path)
+                 for id, path in list_documents(args.source, args.filetype)
+                 if id not in done]
+    print('Interviews to insert: %d (%d skipped)' %
+          (len(documents), len(done)))
+
+    # Connect to database
+    conn = psycopg2.connect(host=args.hostname,
+                            port=args.port,
+                            dbname=args.dbname,
+                            user=args.username,
+                            password=args.password)
+    # Delete sensitive data
+    del args.password
+
+    # Convert documents in a process pool, and insert them in batches
+    sizes = {id: os.path.getsize(path) for id, path in documents}
+    start = time.monotonic()
+    inserted = 0
+    inserted_bytes = 0
+    progress = open(args.progress_file, 'a') if args.progress_file else None
+    try:
+        with pipeline.Pipeline(workers=args.workers,
+                               chunksize=args.chunksize,
+                               spacy_model=None) as p:
+            converted = p.imap(functools.partial(read_document,
+                                                 filetype=args.filetype),
+                               [path for _, path in documents])
+            docs = zip((id for id, _ in documents), converted)
+            for batch in batches(docs, args.batch_size):
+                try:
+                    insert_batch(conn, batch)
+                except (Exception, psycopg2.Error) as e:
+                    conn.rollback()
+                    print('Error inserting batch %s: %s' %
+                          ([id for id, _ in batch], e),
+                          file=sys.stderr)
+                    raise
+                inserted += len(batch)
+                inserted_bytes += sum(sizes[id] for id, _ in batch)
+                if progress:
+                    progress.write(''.join('%d\n' % id for id, _ in batch))
+                    progress.flush()
+                print('Inserted %d/%d interviews' % (inserted, len(documents)))
+    finally:
+        if progress:
+            progress.close()
+        conn.close()
+        # Print throughput summary
+        elapsed = time.monotonic() - start
+        print('Inserted %d interviews (%.2f MB) in %.2f s: ' %
+              (inserted, inserted_bytes / 1024 / 1024, elapsed) +
+              '%.2f docs/s, %.2f MB/s' %
+              (inserted / elapsed if elapsed else 0, inserted_bytes / 1024 /
+               1024 / elapsed if elapsed else 0))
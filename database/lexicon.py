@@ -0,0 +1,24 @@
+"""Lexical resources for metadata generation: stopwords and stemmer.
+
+Stopword sets are read from the NLTK corpus once per process and language,
+and shared as frozensets. STEMMER identifies the stemmer of the 'bow_stemmed'
+metadata, as served by the API.
+"""
+import functools
+
+import nltk.corpus
+import nltk.stem
+
+LANGUAGE = 'portuguese'
+STEMMER = 'RSLP Stemmer'
+
+
+@functools.lru_cache(maxsize=None)
+def stopwords(language=LANGUAGE):
+    """Return the frozenset of stopwords of a language, read once."""
+    return frozenset(nltk.corpus.stopwords.words(language))
+
+
+def stemmer():
+    """Return a new instance of the metadata stemmer (STEMMER)."""
+    return nltk.stem.rslp.RSLPStemmer()
@@ -0,0 +1,249 @@
+"""Bulk loader of interviews into GEO database, with COPY ... FROM STDIN.
+
+Rows are streamed to PostgreSQL through a file-like object that encodes them
+on demand, in CSV or binary COPY format, so the whole payload is never held
+in memory. Interview rows are tuples of (id, text, questions, answers, meta),
+where questions and answers are lists of strings, and meta is a dict (or a
+JSON string). The tsvector columns are filled by the table's triggers.
+
+Example:
+    with psycopg2.connect(...) as conn:
+        loader.load(conn, rows, format='binary', rebuild_indexes=True)
+"""
+import contextlib
+import csv
+import io
+import json
+import struct
+
+import psycopg2.sql
+
+INTERVIEW_COLUMNS = ('id', 'text', 'questions', 'answers', 'meta')
+
+# Binary COPY format constants
+_BINARY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+_BINARY_TRAILER = struct.pack('>h', -1)
+_TEXT_OID = 25
+_JSONB_VERSION = b'\x01'
+
+
+class IteratorFile(io.RawIOBase):
+    """Read-only file-like object over an iterator of bytes chunks.
+
+    Used as the source file of cursor.copy_expert(), which reads it in
+    fixed-size blocks, so chunks are only generated as they are consumed.
+    """
+    def __init__(self, iterator):
+        self._iterator = iter(iterator)
+        self._buffer = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer:
+            try:
+                self._buffer = next(self._iterator)
+            except StopIteration:
+                return 0
+        size = min(len(b), len(self._buffer))
+        b[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+def _meta_json(meta):
+    """Return the JSON string of a meta value (dict or JSON string)."""
+    return meta if isinstance(meta, str) else json.dumps(meta)
+
+
+def _array_literal(values):
+    """Return the PostgreSQL text representation of a text[] value."""
+    return '{' + ','.join(
+        '"' + v.replace('\\', '\\\\').replace('"', '\\"') + '"'
+        for v in values) + '}'
+
+
+def _csv_rows(rows, encode):
+    """Yield CSV encoded chunks for rows, each converted by 'encode'.
+
+    All non-numeric values are quoted, as unquoted empty strings are read as
+    NULL by COPY in CSV format.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer,
+                        lineterminator='\n',
+                        quoting=csv.QUOTE_NONNUMERIC)
+    for row in rows:
+        writer.writerow(encode(row))
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def _binary_field(data):
+    """Return a binary COPY field, prefixed with its length."""
+    return struct.pack('>i', len(data)) + data
+
+
+def _binary_text_array(values):
+    """Return the binary representation of a one-dimensional text[] value."""
+    if not values:
+        return struct.pack('>iii', 0, 0, _TEXT_OID)
+    return struct.pack('>iiiii', 1, 0, _TEXT_OID, len(values), 1) + b''.join(
+        _binary_field(v.encode('utf-8')) for v in values)
+
+
+def _binary_rows(rows, encode):
+    """Yield binary COPY chunks for rows, each converted to fields by 'encode'.
+
+    The header is yielded first, and the trailer last.
+    """
+    yield _BINARY_HEADER
+    for row in rows:
+        fields = encode(row)
+        yield struct.pack('>h', len(fields)) + b''.join(
+            _binary_field(f) for f in fields)
+    yield _BINARY_TRAILER
+
+
+def encode_interviews(rows, format='csv'):
+    """Yield encoded chunks of interview rows, in CSV or binary format."""
+    if format == 'binary':
+        return _binary_rows(
+            rows, lambda row: (
+                struct.pack('>i', row[0]),
+                row[1].encode('utf-8'),
+                _binary_text_array(row[2]),
+                _binary_text_array(row[3]),
+                _JSONB_VERSION + _meta_json(row[4]).encode('utf-8'),
+            ))
+    return _csv_rows(
+        rows, lambda row: (row[0], row[1], _array_literal(row[2]),
+                           _array_literal(row[3]), _meta_json(row[4])))
+
+
+def encode_athletes(ids, format='csv'):
+    """Yield encoded chunks of athlete ids, in CSV or binary format."""
+    if format == 'binary':
+        return _binary_rows(ids, lambda id: (struct.pack('>i', id), ))
+    return _csv_rows(ids, lambda id: (id, ))
+
+
+def _copy_sql(table, columns, format):
+    """Return the COPY ... FROM STDIN statement for a table."""
+    return 'COPY %s (%s) FROM STDIN WITH (FORMAT %s);' % (
+        table, ', '.join(columns), 'binary' if format == 'binary' else 'csv')
+
+
+def copy_athletes(conn, ids, format='csv', skip_existing=False):
+    """Insert athletes with the given ids, with COPY.
+
+    If skip_existing is true, ids are copied to a temporary table first, and
+    existing athletes are skipped (as with ON CONFLICT DO NOTHING).
+    """
+    with conn.cursor() as cur:
+        if not skip_existing:
+            cur.copy_expert(_copy_sql('athletes', ('id', ), format),
+                            IteratorFile(encode_athletes(ids, format)))
+            return
+        cur.execute('CREATE TEMPORARY TABLE athletes_load ' +
+                    '(LIKE athletes INCLUDING DEFAULTS);')
+        cur.copy_expert(_copy_sql('athletes_load', ('id', ), format),
+                        IteratorFile(encode_athletes(ids, format)))
+        cur.execute('INSERT INTO athletes SELECT * FROM athletes_load ' +
+                    'ON CONFLICT DO NOTHING;')
+        cur.execute('DROP TABLE athletes_load;')
+
+
+def copy_interviews(conn, rows, format='csv', skip_existing=True):
+    """Insert interview rows, with COPY. Returns the number of inserted rows.
+
+    If skip_existing is true, rows are copied to a temporary table first
+    (without the tsvector columns, which are filled by the triggers of the
+    interviews table), and rows with existing ids are skipped, as with the
+    ON CONFLICT DO NOTHING of the interview_insert procedure.
+    """
+    columns = ', '.join(INTERVIEW_COLUMNS)
+    with conn.cursor() as cur:
+        if not skip_existing:
+            cur.copy_expert(_copy_sql('interviews', INTERVIEW_COLUMNS, format),
+                            IteratorFile(encode_interviews(rows, format)))
+            return cur.rowcount
+        cur.execute('CREATE TEMPORARY TABLE interviews_load AS SELECT ' +
+                    columns + ' FROM interviews WITH NO DATA;')
+        cur.copy_expert(
+            _copy_sql('interviews_load', INTERVIEW_COLUMNS, format),
+            IteratorFile(encode_interviews(rows, format)))
+        cur.execute('INSERT INTO interviews (' + columns + ') SELECT ' +
+                    columns + ' FROM interviews_load ON CONFLICT DO NOTHING;')
+        count = cur.rowcount
+        cur.execute('DROP TABLE interviews_load;')
+        return count
+
+
+@contextlib.contextmanager
+def deferred_indexes(conn, table='interviews'):
+    """Context manager that drops secondary indexes of a table, and rebuilds
+    them on exit.
+
+    Indexes backing constraints (e.g., primary keys) are kept. Building each
+    index once after a large load is faster than updating it for every row.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            """SELECT indexname, indexdef FROM pg_indexes
+                WHERE schemaname = 'public' AND tablename = %(table)s
+                    AND indexname NOT IN (SELECT conname FROM pg_constraint);
+            """, {'table': table})
+        indexes = cur.fetchall()
+        for name, _ in indexes:
+            cur.execute(
+                psycopg2.sql.SQL('DROP INDEX {};').format(
+                    psycopg2.sql.Identifier(name)))
+    yield
+    with conn.cursor() as cur:
+        for _, definition in indexes:
+            cur.execute(definition + ';')
+
+
+def load(conn,
+         rows,
+         format='csv',
+         chunk_size=1000,
+         rebuild_indexes=False,
+         analyze=True,
+         skip_existing=True):
+    """Load interview rows, and their athletes, into the database.
+
+    Rows are copied in chunks of 'chunk_size' rows: for each chunk, the
+    athletes are copied first (as required by the foreign key), and then the
+    interviews. If skip_existing is true, existing athletes and interviews
+    are skipped (so loads may be re-run); otherwise, a duplicate id aborts
+    the load, which is slightly faster. If rebuild_indexes is true, secondary
+    indexes of the interviews table are dropped during the load, and rebuilt
+    once at the end. If analyze is true, the tables are analyzed once at the
+    end. The transaction is not committed. Returns the number of inserted
+    interviews.
+    """
+    def copy_chunk(chunk):
+        copy_athletes(conn, [r[0] for r in chunk], format, skip_existing)
+        return copy_interviews(conn, chunk, format, skip_existing)
+
+    count = 0
+    with contextlib.ExitStack() as stack:
+        if rebuild_indexes:
+            stack.enter_context(deferred_indexes(conn, 'interviews'))
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                count += copy_chunk(chunk)
+                chunk = []
+        if chunk:
+            count += copy_chunk(chunk)
+    if analyze:
+        with conn.cursor() as cur:
+            cur.execute('ANALYZE athletes;')
+            cur.execute('ANALYZE interviews;')
+    return count
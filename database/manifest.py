@@ -0,0 +1,138 @@
+"""Content-hash manifest for incremental processing of interviews.
+
+Each interview goes through a sequence of stages (e.g., normalize, tokenize,
+bow, stem, ner, meta). A stage's key is the hash of its name, its
+configuration and the hashes of its inputs' outputs. The manifest records,
+for each interview and stage, the last key and the hash of its output, and
+outputs are kept in a content-addressed cache directory. A stage is only
+recomputed when its key changes, i.e., when its input or configuration
+changed, and unchanged outputs are only loaded from the cache when a later
+stage needs them.
+
+Example:
+    stages = [manifest.Stage('tokenize', tokenize, {'version': 1}), ...]
+    m = manifest.Manifest('manifest.json', 'cache/')
+    changed, entry = m.run(id, source_hash, load_source, stages)
+    m.update(id, entry)
+    m.save()
+"""
+import collections
+import hashlib
+import json
+import os
+
+# Name of the input of the first stage
+SOURCE = 'source'
+
+# Processing stage of interviews. 'function' is called with the outputs of
+# the stages (or the source) named in 'inputs', and must return a JSON
+# serializable value. 'config' is any JSON serializable value that affects
+# the output, besides the inputs (e.g., parameters and code versions).
+Stage = collections.namedtuple('Stage',
+                               ['name', 'function', 'config', 'inputs'],
+                               defaults=[(SOURCE, )])
+
+
+def digest(value):
+    """Return the SHA-256 hex digest of a JSON serializable value."""
+    return hashlib.sha256(
+        json.dumps(value, sort_keys=True,
+                   ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def file_digest(path):
+    """Return the SHA-256 hex digest of the contents of a file."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(65536), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class Manifest(object):
+    """Manifest of stage keys and output hashes of interviews.
+
+    The manifest is a JSON file mapping interview ids to {stage: [key,
+    output_hash]}. Stage outputs are stored as JSON files in 'cache_dir',
+    named after their hashes, so the manifest must be removed along with the
+    cache directory. With no path, only the cache is used (e.g., by worker
+    processes running stages for a manifest of another process).
+    """
+    def __init__(self, path, cache_dir):
+        self.path = path
+        self.cache_dir = cache_dir
+        self.entries = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def _cache_path(self, stage, output_hash):
+        return os.path.join(self.cache_dir, stage, output_hash[:2],
+                            output_hash + '.json')
+
+    def load_output(self, stage, output_hash):
+        """Return a stage output from the cache."""
+        with open(self._cache_path(stage, output_hash)) as f:
+            return json.load(f)
+
+    def store_output(self, stage, output_hash, output):
+        """Store a stage output in the cache, if not stored yet."""
+        path = self._cache_path(stage, output_hash)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(output, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def run(self, id, source_hash, load_source, stages, entry=None):
+        """Run the stages of an interview, recomputing only changed ones.
+
+        'load_source' is called (at most once) to get the source, whose hash
+        is 'source_hash'. 'entry' is the manifest entry of the interview
+        (defaults to its entry in this manifest). Returns a tuple of (dict
+        of outputs of the recomputed stages, new entry); outputs of stages
+        whose output hash did not change are omitted. The manifest itself is
+        not changed, see update().
+        """
+        old_entry = self.entries.get(str(id), {}) if entry is None else entry
+        new_entry = {}
+        hashes = {SOURCE: source_hash}
+        values = {}
+        changed = {}
+
+        def value(name):
+            if name not in values:
+                values[name] = (load_source() if name == SOURCE else
+                                self.load_output(name, hashes[name]))
+            return values[name]
+
+        for stage in stages:
+            key = digest([stage.name, stage.config] +
+                         [hashes[name] for name in stage.inputs])
+            old_key, old_hash = old_entry.get(stage.name, (None, None))
+            if key == old_key:
+                hashes[stage.name] = old_hash
+            else:
+                output = stage.function(
+                    *[value(name) for name in stage.inputs])
+                output_hash = digest(output)
+                self.store_output(stage.name, output_hash, output)
+                hashes[stage.name] = output_hash
+                values[stage.name] = output
+                if output_hash != old_hash:
+                    changed[stage.name] = output
+            new_entry[stage.name] = [key, hashes[stage.name]]
+        return changed, new_entry
+
+    def update(self, id, entry):
+        """Set the manifest entry of an interview."""
+        self.entries[str(id)] = entry
+
+    def save(self):
+        """Save the manifest, replacing its file atomically."""
+        tmp_path = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f, sort_keys=True)
+        os.replace(tmp_path, self.path)
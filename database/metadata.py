@@ -0,0 +1,95 @@
+"""Metadata generation for interviews: tokenization and bags-of-words.
+
+The generated 'meta' dict has the same format as the 'meta' column of the
+interviews table:
+
+    {'text': {'bow': {...}, 'bow_stemmed': {...}},
+     'questions': {'bow': {...}, 'bow_stemmed': {...}},
+     'answers': {'bow': {...}, 'bow_stemmed': {...}}}
+
+Bags-of-words are counted in a single pass over the tokens, instead of
+counting each distinct token with list.count().
+"""
+import collections
+import re
+
+import nltk.tokenize
+
+# Fields of the meta dict, and their keys in the interview dict
+FIELDS = {'text': 'text', 'questions': 'bold', 'answers': 'nonbold'}
+
+# Tokens with a single trailing dot (e.g., "fim.")
+DOT_RE = re.compile(r'^[^\.]+\.$')
+
+
+def tokenize(paragraphs):
+    """Return the lowercase tokens of a list of paragraphs, with NLTK.
+
+    Trailing dots are removed from tokens.
+    """
+    tokens = [
+        y for x in [
+            nltk.tokenize.word_tokenize(i, language='portuguese')
+            for i in nltk.tokenize.sent_tokenize('\n'.join(paragraphs).lower(),
+                                                 language='portuguese')
+        ] for y in x
+    ]
+    return [tok[:-1] if DOT_RE.match(tok) else tok for tok in tokens]
+
+
+def split_interview(interview):
+    """Return the tokens of each field of an interview dict."""
+    return {
+        field: tokenize(interview[key])
+        for field, key in FIELDS.items()
+    }
+
+
+def count_tokens(tokens, stopwords):
+    """Return the counts of tokens not in 'stopwords', as a dict."""
+    return {
+        token: count
+        for token, count in collections.Counter(tokens).items()
+        if token not in stopwords
+    }
+
+
+def stem_bow(bow, stemmer):
+    """Return a stemmed bag-of-words, adding counts of tokens with the same
+    stem."""
+    bow_stemmed = {}
+    for token, count in bow.items():
+        stem = stemmer.stem(token)
+        bow_stemmed[stem] = bow_stemmed.get(stem, 0) + count
+    return bow_stemmed
+
+
+def bag_of_words(tokens, stopwords, stemmer):
+    """Return the bag-of-words (stemmed or not) of a list of tokens.
+
+    Tokens in 'stopwords' are discarded. Counts of tokens with the same stem
+    are added in 'bow_stemmed'.
+    """
+    bow = count_tokens(tokens, stopwords)
+    return {'bow': bow, 'bow_stemmed': stem_bow(bow, stemmer)}
+
+
+def generate_meta(interview_split, stopwords, stemmer):
+    """Return the meta dict of an interview, from its tokens per field."""
+    return {
+        field: bag_of_words(interview_split[field], stopwords, stemmer)
+        for field in FIELDS
+    }
+
+
+def named_entities(doc, offset=0):
+    """Return the named entities of a spaCy Doc, as a list of dicts.
+
+    'offset' is added to character offsets, for Docs of a part of a text.
+    """
+    return [{
+        'text': ent.text,
+        'start_char': ent.start_char + offset,
+        'end_char': ent.end_char + offset,
+        'label': ent.label_
+    } for ent in doc.ents]
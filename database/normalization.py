@@ -0,0 +1,160 @@
+"""Format detection and normalization of interview transcripts.
+
+Documents converted by docx2json (dicts with 'text', 'bold' and 'nonbold'
+lists of paragraphs) come in several formats, each described by a rule of
+the rule table. A document is classified by the first rule whose pattern
+matches one of its given paragraphs, and the rule's split function
+separates questions ('bold') from answers ('nonbold') in a single pass over
+the paragraphs, stripping them of surrounding spaces. Documents matching no
+rule are only stripped.
+
+Rules are compiled once, and other tables may be given to classify() and
+normalize(), e.g., to add formats:
+    rules = normalization.RULES + [
+        normalization.Rule('new-format', re.compile(r'^Pergunta: '), (0, ),
+                           normalization.split_speakers,
+                           {'skip': 0, 'separator': ': ',
+                            'questioners': {'Pergunta'}})]
+    interview = normalization.normalize(interview, rules)
+"""
+import collections
+import re
+
+# Version of the split functions, to be increased when their behavior changes
+# (rule definitions are described by describe_rules())
+VERSION = 1
+
+# Format rule: documents whose paragraphs at indexes 'paragraphs' (of the
+# 'text' list) match 'pattern' are split by split(interview, **options)
+Rule = collections.namedtuple(
+    'Rule', ['name', 'pattern', 'paragraphs', 'split', 'options'])
+
+
+def split_marked(interview, header):
+    """Split a document whose questions are marked in bold.
+
+    The 'header' paragraph is removed from the start of the text and of the
+    questions, and from the start of the first remaining question, as by the
+    previous interview_insert procedure.
+    """
+    text = list(interview['text'])
+    bold = list(interview['bold'])
+    if text and text[0] == header:
+        del text[0]
+    if bold and bold[0] == header:
+        del bold[0]
+    if bold and header + ' ' in bold[0]:
+        bold[0] = bold[0].replace(header + ' ', '')
+    return ([s.strip(' ') for s in text], [s.strip(' ') for s in bold],
+            [s.strip(' ') for s in interview['nonbold']])
+
+
+def split_speakers(interview, skip, separator, questioners):
+    """Split a document whose paragraphs start with the speaker's name.
+
+    The first 'skip' paragraphs are removed. Paragraphs are split at the
+    first 'separator', and the speaker's name is removed from the text.
+    Paragraphs of speakers in 'questioners' are questions, and the others
+    (including paragraphs without a speaker) are answers. Questions marked
+    in bold by docx2json are kept.
+    """
+    text = []
+    bold = [s.strip(' ') for s in interview['bold']]
+    nonbold = []
+    for paragraph in interview['text'][skip:]:
+        parts = paragraph.split(separator, 1)
+        content = parts[-1].strip(' ')
+        text.append(content)
+        if len(parts) == 2 and parts[0] in questioners:
+            bold.append(content)
+        else:
+            nonbold.append(content)
+    return text, bold, nonbold
+
+
+def split_alternating(interview, start):
+    """Split a document of alternating questions and answers.
+
+    Paragraphs up to the first one containing 'start' (inclusive) are
+    removed, if there is one and it is not the last paragraph. Remaining
+    paragraphs are questions and answers, alternately.
+    """
+    paragraphs = interview['text']
+    for idx, paragraph in enumerate(paragraphs[:-1]):
+        if start in paragraph:
+            paragraphs = paragraphs[idx + 1:]
+            break
+    text = [s.strip(' ') for s in paragraphs]
+    return text, text[0::2], text[1::2]
+
+
+RULES = [
+    Rule('bold-nonbold', re.compile(r'^Início da transcrição$'), (0, ),
+         split_marked, {'header': 'Início da transcrição'}),
+    Rule('athlete-name', re.compile(r'Atleta: '), (0, ), split_speakers, {
+        'skip': 2,
+        'separator': ': ',
+        'questioners': {'Kátia', 'Entrevistador'}
+    }),
+    Rule('one-one-abbr', re.compile(r'USP – '), (1, 2), split_speakers, {
+        'skip': 1,
+        'separator': ' – ',
+        'questioners': {'USP'}
+    }),
+    Rule('black-colored', re.compile(r' nascid[ao] em '), (0, ),
+         split_alternating, {'start': 'Entrevista realizada em '}),
+    Rule('all-nonbold-names', re.compile(r'Transcrição '), (0, ),
+         split_speakers, {
+             'skip': 1,
+             'separator': ': ',
+             'questioners': {'Kátia', 'Entrevistador', 'ENTREVISTADORA'}
+         }),
+]
+
+
+def describe_rules(rules=RULES):
+    """Return a JSON serializable description of a rule table.
+
+    The description has the pattern (and flags), paragraphs, split function
+    and options of each rule, so it changes whenever a rule does (e.g., for
+    cache keys of normalized documents). Sets of options are sorted.
+    """
+    def value(option):
+        if isinstance(option, (set, frozenset)):
+            return sorted(option)
+        return option
+
+    return [{
+        'name': rule.name,
+        'pattern': rule.pattern.pattern,
+        'flags': int(rule.pattern.flags),
+        'paragraphs': list(rule.paragraphs),
+        'split': rule.split.__name__,
+        'options': {key: value(option)
+                    for key, option in rule.options.items()},
+    } for rule in rules]
+
+
+def classify(interview, rules=RULES):
+    """Return the first rule matching a document, or None."""
+    text = interview['text']
+    for rule in rules:
+        if any(
+                rule.pattern.search(text[idx]) for idx in rule.paragraphs
+                if idx < len(text)):
+            return rule
+    return None
+
+
+def normalize(interview, rules=RULES):
+    """Return a normalized copy of a document converted by docx2json.
+
+    Other keys of the document are kept.
+    """
+    rule = classify(interview, rules)
+    if rule is None:
+        text, bold, nonbold = ([s.strip(' ') for s in interview[key]]
+                               for key in ('text', 'bold', 'nonbold'))
+    else:
+        text, bold, nonbold = rule.split(interview, **rule.options)
+    return dict(interview, text=text, bold=bold, nonbold=nonbold)
@@ -0,0 +1,185 @@
+"""Parallel processing pipeline for interview documents.
+
+Pipeline stages (document conversion, tokenization, stopword filtering,
+stemming and named entity recognition) are mapped over a process pool, and
+results are returned in input order. NLP models are loaded once per worker
+process, on first use, and reused for all documents handled by the worker.
+
+Example:
+    with pipeline.Pipeline(workers=8, chunksize=4) as p:
+        interviews = p.convert(paths)
+        metas = p.generate_meta(interviews)
+"""
+import concurrent.futures
+import json
+import multiprocessing.util
+import os
+
+import docx2json
+
+import lexicon
+import metadata
+import stemming
+
+# Settings and models of the current worker process
+_settings = {}
+_models = {}
+
+
+def _init_worker(settings, parent_pid=None):
+    """Initialize a worker process with the pipeline settings.
+
+    In worker processes (started by the process with id parent_pid), the stem
+    cache is saved when the process exits. multiprocessing.parent_process()
+    is not used, as it requires Python 3.8.
+    """
+    _settings.clear()
+    _settings.update(settings)
+    _models.clear()
+    if parent_pid is not None and os.getppid() == parent_pid:
+        multiprocessing.util.Finalize(None, _save_stem_cache, exitpriority=10)
+
+
+def _save_stem_cache():
+    """Save the stem cache of the current worker, if it has a file."""
+    if 'stemmer' in _models and _settings['stem_cache_path']:
+        _models['stemmer'].save(merge=True)
+
+
+def get_stemmer():
+    """Return the stemmer of the current worker, creating it on first use."""
+    if 'stemmer' not in _models:
+        _models['stemmer'] = stemming.CachedStemmer(
+            lexicon.stemmer(),
+            maxsize=_settings['stem_cache_size'],
+            path=_settings['stem_cache_path'],
+            name=lexicon.STEMMER)
+    return _models['stemmer']
+
+
+def get_stopwords():
+    """Return the stopword set of the current worker, loading it once."""
+    return lexicon.stopwords()
+
+
+def get_nlp():
+    """Return the spaCy model of the current worker, loading it once.
+
+    Only the entity recognition components are enabled. Returns None if no
+    spaCy model is set.
+    """
+    if 'nlp' not in _models:
+        if _settings['spacy_model']:
+            import entities  # Only needed for named entity recognition
+            _models['nlp'] = entities.load_model(_settings['spacy_model'])
+        else:
+            _models['nlp'] = None
+    return _models['nlp']
+
+
+def convert_document(path):
+    """Return the interview dict of a .docx or .json file."""
+    if path.lower().endswith('.json'):
+        with open(path) as f:
+            return json.load(f)
+    return json.loads(docx2json.convert(path))
+
+
+def named_entities(paragraphs):
+    """Return the named entities of a list of paragraphs, with the spaCy
+    model of the current worker."""
+    import entities
+    return entities.extract(get_nlp(), [paragraphs],
+                            batch_size=_settings['ner_batch_size'],
+                            max_chars=_settings['ner_max_chars'])[0]
+
+
+def process_interview(interview):
+    """Return the meta dict of an interview dict.
+
+    Named entities are included if a spaCy model is set.
+    """
+    meta = metadata.generate_meta(metadata.split_interview(interview),
+                                  get_stopwords(), get_stemmer())
+    if get_nlp() is not None:
+        meta['named_entities'] = named_entities(interview['text'])
+    return meta
+
+
+class Pipeline(object):
+    """Process pool for pipeline stages, with ordered results.
+
+    'workers' is the number of processes (None for the number of CPUs, 0 to
+    run stages serially in the current process), and 'chunksize' the number
+    of documents sent to a worker at a time. If 'stem_cache_path' is given,
+    the stem cache is loaded from it, and saved back when the pool is shut
+    down (or with save_stem_cache(), when running serially). Long texts are
+    split into parts of up to 'ner_max_chars' characters for entity
+    recognition, and the parts of a text are processed in batches of
+    'ner_batch_size'.
+    Must be used as a context manager, which shuts the pool down on exit.
+    """
+    def __init__(self,
+                 workers=None,
+                 chunksize=1,
+                 spacy_model='pt_core_news_sm',
+                 stem_cache_path=None,
+                 stem_cache_size=100000,
+                 ner_batch_size=64,
+                 ner_max_chars=100000):
+        self.workers = os.cpu_count() if workers is None else workers
+        self.chunksize = chunksize
+        self.settings = {
+            'spacy_model': spacy_model,
+            'stem_cache_path': stem_cache_path,
+            'stem_cache_size': stem_cache_size,
+            'ner_batch_size': ner_batch_size,
+            'ner_max_chars': ner_max_chars,
+        }
+        self._executor = None
+
+    def __enter__(self):
+        if self.workers > 0:
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                self.workers,
+                initializer=_init_worker,
+                initargs=(self.settings, os.getpid()))
+        else:
+            _init_worker(self.settings)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        else:
+            self.save_stem_cache()
+
+    def save_stem_cache(self):
+        """Save the stem cache of the current process, in serial mode.
+
+        Worker processes save their caches on exit.
+        """
+        if self._executor is None:
+            _save_stem_cache()
+
+    def imap(self, function, iterable):
+        """Return an iterator of function(item) for each item, in input order.
+
+        'function' must be a module-level function, so it can be pickled.
+        """
+        if self._executor is None:
+            return map(function, iterable)
+        return self._executor.map(function, iterable, chunksize=self.chunksize)
+
+    def map(self, function, iterable):
+        """Return a list of function(item) for each item, in input order."""
+        return list(self.imap(function, iterable))
+
+    def convert(self, paths):
+        """Return the interview dicts of a list of files."""
+        return self.map(convert_document, paths)
+
+    def generate_meta(self, interviews):
+        """Return the meta dicts of a list of interview dicts."""
+        return self.map(process_interview, interviews)
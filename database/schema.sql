@@ -58,6 +58,11 @@ CREATE INDEX interviews_idx_tsquestions ON public.interviews USING gin (tsquesti
 -- DROP INDEX public.interviews_idx_tstext;
 CREATE INDEX interviews_idx_tstext ON public.interviews USING gin (tstext);
 
+-- Index: interviews_idx_tsweighted
+-- DROP INDEX public.interviews_idx_tsweighted;
+-- Questions (weight A) and answers (weight B), for weighted searches
+CREATE INDEX interviews_idx_tsweighted ON public.interviews USING gin ((setweight(tsquestions, 'A') || setweight(tsanswers, 'B')));
+
 -- Trigger: interviews_trigg_textarrays
 -- DROP TRIGGER interviews_trigg_textarrays ON public.interviews;
 CREATE TRIGGER interviews_trigg_textarrays BEFORE INSERT OR UPDATE ON public.interviews
@@ -68,6 +73,36 @@ CREATE TRIGGER interviews_trigg_textarrays BEFORE INSERT OR UPDATE ON public.int
 CREATE TRIGGER interviews_trigg_tstext BEFORE INSERT OR UPDATE ON public.interviews
     FOR EACH ROW EXECUTE PROCEDURE tsvector_update_trigger('tstext', 'pg_catalog.portuguese', 'text');
 
+-- Table: public.table_versions
+-- DROP TABLE public.table_versions;
+-- Version counters for cache invalidation, incremented on every change
+CREATE TABLE public.table_versions (
+    table_name name NOT NULL,
+    version bigint NOT NULL DEFAULT 0,
+    CONSTRAINT table_versions_pkey PRIMARY KEY (table_name)
+);
+INSERT INTO public.table_versions (table_name) VALUES ('interviews');
+GRANT SELECT ON public.table_versions TO api;
+GRANT ALL ON public.table_versions TO api_admin;
+
+-- FUNCTION: public.table_versions_update_trigger()
+-- DROP FUNCTION public.table_versions_update_trigger();
+CREATE FUNCTION public.table_versions_update_trigger()
+    RETURNS trigger
+    LANGUAGE 'plpgsql'
+    AS $BODY$
+    begin
+        update public.table_versions set version = version + 1
+            where table_name = TG_TABLE_NAME;
+      return null;
+    end
+$BODY$;
+
+-- Trigger: interviews_trigg_version
+-- DROP TRIGGER interviews_trigg_version ON public.interviews;
+CREATE TRIGGER interviews_trigg_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON public.interviews
+    FOR EACH STATEMENT EXECUTE PROCEDURE public.table_versions_update_trigger();
+
 -- Table: public.api_users
 -- DROP TABLE public.api_users;
 CREATE TABLE public.api_users (
@@ -85,43 +120,30 @@ CREATE EXTENSION plpython3u;
 CREATE OR REPLACE PROCEDURE interview_insert (IN id integer, IN docx text)
 /* Procedure in PL/Python for insertion of an interview into the "interviews" table
 
-Converts an JSON formatted string, generated by docx2json (https://pypi.org/project/docx2json/),
-extracting metadata and inserting into the "interviews" table.
+Converts an JSON formatted string, generated by docx2json (https://pypi.org/project/docx2json/)
+and normalized by normalization.py, extracting metadata and inserting into the "interviews" table.
 NLTK is used for metadata extraction.
 
 Args:
     id (int): ID number of the interviewee
-    docx (str): JSON string of the document to be inserted (converted by docx2json)
+    docx (str): JSON string of the document to be inserted (converted by docx2json, normalized)
 */
 LANGUAGE plpython3u
 AS $$
 # Imports
+import collections
 import json
 import re
+import sys
 import nltk.tokenize
 import nltk.corpus
 import nltk.stem
-import spacy
 
 # Convert JSON string to a dict variable
 interview = json.loads(docx)
 
-# Assuming "bold-nonbold" pattern for all input interviews
-# Preprocessing interview
-if interview['text'][0] == 'Início da transcrição':
-    del interview['text'][0]
-if interview['bold'][0] == 'Início da transcrição':
-    del interview['bold'][0]
-if 'Início da transcrição ' in interview['bold'][0]:
-    interview['bold'][0] = interview['bold'][0].replace(
-        'Início da transcrição ', '')
-#   Removing trailing spaces
-for idx2, s in enumerate(interview['text']):
-    interview['text'][idx2] = s.strip(' ')
-for idx2, s in enumerate(interview['bold']):
-    interview['bold'][idx2] = s.strip(' ')
-for idx2, s in enumerate(interview['nonbold']):
-    interview['nonbold'][idx2] = s.strip(' ')
+# Documents are normalized by the caller (see normalization.py), with
+# questions and answers already split into "bold" and "nonbold"
 
 # Generating metadata
 
@@ -162,68 +184,51 @@ for idx, tok in enumerate(interview_split['answers']):
     if re.match(dot_re, tok):
         interview_split['answers'][idx] = tok[:-1]
 
-# Generating token set, removing stopwords
-tokens = {
-    'text':
-        set(interview_split['text']) -
-        set(nltk.corpus.stopwords.words('portuguese')),
-    'questions':
-        set(interview_split['questions']) -
-        set(nltk.corpus.stopwords.words('portuguese')),
-    'answers':
-        set(interview_split['answers']) -
-        set(nltk.corpus.stopwords.words('portuguese'))
-}
-
 # Generating bag-of-words (stemmed or not) for insertion at the database
-# Recognizing named entities with recommended algorithms from NLTK
+# Tokens are counted in a single pass, removing stopwords in the process
+# Stopwords are read once per session, and kept in GD
+if 'stopwords' not in GD:
+    GD['stopwords'] = frozenset(nltk.corpus.stopwords.words('portuguese'))
+stopwords = GD['stopwords']
 stemmer = nltk.stem.rslp.RSLPStemmer()
 # stemmer = nltk.stem.snowball.SnowballStemmer('portuguese') # optional
-meta = {
-    'text': {
-        'bow': {},
-        'bow_stemmed': {}
-    },
-    'questions': {
-        'bow': {},
-        'bow_stemmed': {}
-    },
-    'answers': {
-        'bow': {},
-        'bow_stemmed': {}
+# Stems are cached in GD, shared by all calls in the same session, and
+# the cache is cleared when it grows too large
+stem_cache = GD.setdefault('stem_cache', {})
+if len(stem_cache) > 100000:
+    stem_cache.clear()
+meta = {}
+for field in ('text', 'questions', 'answers'):
+    bow = {
+        token: count
+        for token, count in collections.Counter(
+            interview_split[field]).items() if token not in stopwords
     }
-}
-for token in tokens['text']:
-    meta['text']['bow'][token] = interview_split['text'].count(token)
-    meta['text']['bow_stemmed'][
-        stemmer.stem(token)] = meta['text']['bow_stemmed'].get(
-            stemmer.stem(token), 0) + meta['text']['bow'][token]
-for token in tokens['questions']:
-    meta['questions']['bow'][token] = interview_split['questions'].count(token)
-    meta['questions']['bow_stemmed'][stemmer.stem(
-        token)] = meta['questions']['bow_stemmed'].get(
-            stemmer.stem(token), 0) + meta['questions']['bow'][token]
-for token in tokens['answers']:
-    meta['answers']['bow'][token] = interview_split['answers'].count(token)
-    meta['answers']['bow_stemmed'][stemmer.stem(
-        token)] = meta['answers']['bow_stemmed'].get(
-            stemmer.stem(token), 0) + meta['answers']['bow'][token]
+    bow_stemmed = {}
+    for token, count in bow.items():
+        stem = stem_cache.get(token)
+        if stem is None:
+            stem = stem_cache[token] = stemmer.stem(token)
+        bow_stemmed[stem] = bow_stemmed.get(stem, 0) + count
+    meta[field] = {'bow': bow, 'bow_stemmed': bow_stemmed}
 
 # Extracting named entities with spaCy
-nlp = spacy.load('pt_core_news_sm')
-doc = nlp('\n'.join(json_arr[idx]['text']))
-meta['named_entities'] = [{
-    'text': ent.text,
-    'start_char': ent.start_char,
-    'end_char': ent.end_char,
-    'label': ent.label_
-} for ent in doc.ents]
+# entities.py (installed in /opt/app, with metadata.py) splits the text in the
+# same parts as the offline pipeline, so both produce the same entities
+# The model is loaded once per session, with only the components used by the
+# entity recognizer
+if '/opt/app' not in sys.path:
+    sys.path.append('/opt/app')
+import entities
+if 'nlp' not in GD:
+    GD['nlp'] = entities.load_model('pt_core_news_sm')
+meta['named_entities'] = entities.extract(GD['nlp'], [interview['text']])[0]
 
 # Inserting data into the "interviews" table
 plan = plpy.prepare(
     """INSERT INTO interviews (id, text, questions, answers, meta)
         VALUES
-            ($1, $2, $3, $4, to_jsonb($5))
+            ($1, $2, $3, $4, $5::jsonb)
         ON CONFLICT DO NOTHING;""", [
     "integer",
     "text",
@@ -0,0 +1,117 @@
+"""Memoized stemming for metadata generation.
+
+Stemming with RSLP is rule-based and slow, while the vocabulary of the
+interviews is largely shared, so stems are cached across interviews and
+fields. The cache may be saved to a JSON file and loaded in later runs. The
+file records the identity of the stemmer that produced it, and is discarded
+when loaded by a different stemmer, so changing the metadata stemmer (e.g.,
+from RSLP to Snowball) never reuses stale stems.
+
+Example:
+    stemmer = stemming.CachedStemmer(nltk.stem.rslp.RSLPStemmer(),
+                                     path='stems.json')
+    meta = metadata.generate_meta(interview_split, stopwords, stemmer)
+    stemmer.save()
+"""
+import collections
+import json
+import os
+import threading
+
+
+class CachedStemmer(object):
+    """Stemmer wrapper with a bounded LRU cache of stems.
+
+    Has the same stem() method as NLTK stemmers, so it may be used in their
+    place. At most 'maxsize' stems are kept, discarding the least recently
+    used ones. If 'path' is given and exists, the cache is loaded from it.
+    The identity of the stemmer is its class, and 'name', if given (e.g.,
+    lexicon.STEMMER, or the language of a Snowball stemmer).
+    """
+    def __init__(self, stemmer, maxsize=100000, path=None, name=None):
+        self.stemmer = stemmer
+        self.maxsize = maxsize
+        self.path = path
+        self.identity = '%s.%s' % (type(stemmer).__module__,
+                                   type(stemmer).__qualname__)
+        if name is not None:
+            self.identity += ':' + name
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if path and os.path.exists(path):
+            self.load(path)
+
+    def stem(self, token):
+        """Return the stem of a token, from the cache if possible."""
+        with self._lock:
+            stem = self._cache.get(token)
+            if stem is not None:
+                self._cache.move_to_end(token)
+                self.hits += 1
+                return stem
+            self.misses += 1
+        stem = self.stemmer.stem(token)
+        with self._lock:
+            self._cache[token] = stem
+            if len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return stem
+
+    def hit_ratio(self):
+        """Return the ratio of cache hits, or None if nothing was stemmed."""
+        total = self.hits + self.misses
+        return self.hits / total if total else None
+
+    def stats(self):
+        """Return a dict with the cache size, hits, misses and hit ratio."""
+        with self._lock:
+            return {
+                'size': len(self._cache),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hit_ratio(),
+            }
+
+    def _read(self, path):
+        """Return the stems of a JSON file, or an empty dict if they were
+        produced by another stemmer (or by a version without identities)."""
+        with open(path) as f:
+            data = json.load(f)
+        if data.get('stemmer') != self.identity:
+            return {}
+        return data['stems']
+
+    def load(self, path=None):
+        """Load stems from a JSON file, keeping the cache bounded.
+
+        Stems of a different stemmer are discarded.
+        """
+        stems = self._read(path or self.path)
+        with self._lock:
+            self._cache.update(stems)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+
+    def save(self, path=None, merge=False):
+        """Save the cached stems to a JSON file, with the stemmer identity.
+
+        If merge is true, stems already in the file (of the same stemmer) are
+        kept, so processes sharing a file do not discard each other's stems.
+        The file is written to a temporary file first, and then renamed, so
+        an interrupted run never leaves a truncated cache.
+        """
+        path = path or self.path
+        stems = {}
+        if merge and os.path.exists(path):
+            stems = self._read(path)
+        with self._lock:
+            stems.update(self._cache)
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump({'stemmer': self.identity, 'stems': stems},
+                      f,
+                      ensure_ascii=False)
+        os.replace(tmp_path, path)
@@ -0,0 +1,422 @@
+"""Synthetic interviews for scale testing, learned from the real corpus.
+
+Use "-h" for more help. A CorpusModel is learned from the interviews of the
+database (or from interview rows in memory), keeping:
+
+    - the frequencies of the terms of questions and answers (from the 'bow'
+      metadata, so no tokenization is needed), and the ratio of tokens of
+      each field that are not stopwords;
+    - the distribution of the number of question/answer pairs of the
+      interviews, and of the number of tokens of questions and answers;
+    - the ratio of tokens of terms that occur only once in the corpus, used
+      as the rate of new terms in generated interviews, so the vocabulary
+      keeps growing with the number of interviews, as in a real corpus.
+
+The model is saved to a JSON file, and generates interview rows for the
+loader (see loader.py), deterministically from a seed: each interview has
+its own random generator, seeded by the seed and its id, so any range of ids
+is reproducible. Stopwords are drawn uniformly, as they are not indexed in
+the tsvector columns. The 'meta' of generated rows has bags-of-words of each
+field (without named entities).
+
+Example:
+    model = synthetic.CorpusModel.learn(synthetic.fetch_rows(conn))
+    loader.load(conn, model.generate(1000000, first_id=100, seed=0),
+                format='binary', rebuild_indexes=True)
+"""
+import argparse
+import collections
+import itertools
+import json
+import os
+import random
+import sys
+
+import psycopg2
+
+import lexicon
+import loader
+import metadata
+import stemming
+from insert_interviews import PasswordPromptAction, config
+
+# Fields of the model, and their index in (questions, answers, meta) rows
+FIELDS = ('questions', 'answers')
+
+MODEL_VERSION = 1
+
+
+def fetch_rows(conn, itersize=1000):
+    """Yield (questions, answers, meta) rows of the interviews table, with a
+    server-side cursor."""
+    with conn.cursor(name='synthetic_learn') as cur:
+        cur.itersize = itersize
+        cur.execute('SELECT questions, answers, meta FROM interviews;')
+        yield from cur
+
+
+class Distribution(object):
+    """Discrete distribution of values, sampled by their weights."""
+    def __init__(self, values, weights):
+        self.values = list(values)
+        self.weights = list(weights)
+        self.cum_weights = list(itertools.accumulate(self.weights))
+
+    @classmethod
+    def from_counter(cls, counter):
+        """Return the distribution of the counts of a Counter."""
+        items = sorted(counter.items())
+        return cls([v for v, _ in items], [w for _, w in items])
+
+    def sample(self, rng, k=1):
+        """Return a list of k values, drawn with a random generator."""
+        return rng.choices(self.values, cum_weights=self.cum_weights, k=k)
+
+    def mean(self):
+        """Return the mean of numeric values."""
+        return sum(v * w for v, w in zip(self.values, self.weights)) / max(
+            self.cum_weights[-1], 1)
+
+    def to_dict(self):
+        return {'values': self.values, 'weights': self.weights}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['values'], data['weights'])
+
+
+def _is_term(token):
+    """Return whether a token of a bag-of-words is a word (not punctuation)."""
+    return any(c.isalnum() for c in token)
+
+
+class CorpusModel(object):
+    """Statistical model of interviews, for generation of synthetic ones.
+
+    'terms' and 'lengths' map each of FIELDS to a Distribution of terms and
+    of paragraph lengths (in tokens), and 'pairs' is the Distribution of
+    question/answer pairs per interview. 'content_ratio' and 'novelty' map
+    each field to the ratio of non-stopword tokens, and of new terms.
+    """
+    def __init__(self, terms, lengths, pairs, content_ratio, novelty):
+        self.terms = terms
+        self.lengths = lengths
+        self.pairs = pairs
+        self.content_ratio = content_ratio
+        self.novelty = novelty
+        self._stopwords = sorted(lexicon.stopwords())
+        self._stopword_set = lexicon.stopwords()
+        self._stemmer = stemming.CachedStemmer(lexicon.stemmer())
+
+    @classmethod
+    def learn(cls, rows):
+        """Return the model of (questions, answers, meta) rows, in a single
+        pass. Paragraph lengths are counted in whitespace-separated tokens."""
+        terms = {field: collections.Counter() for field in FIELDS}
+        lengths = {field: collections.Counter() for field in FIELDS}
+        tokens = dict.fromkeys(FIELDS, 0)
+        pairs = collections.Counter()
+        for row in rows:
+            meta = row[2] if isinstance(row[2], dict) else json.loads(row[2])
+            pairs[min(len(row[0]), len(row[1]))] += 1
+            for field, paragraphs in zip(FIELDS, row[:2]):
+                for paragraph in paragraphs:
+                    size = len(paragraph.split())
+                    lengths[field][size] += 1
+                    tokens[field] += size
+                terms[field].update(meta[field]['bow'])
+        if not pairs:
+            raise ValueError('no interviews to learn from')
+        content_ratio, novelty = {}, {}
+        for field in FIELDS:
+            terms[field] = collections.Counter({
+                term: count
+                for term, count in terms[field].items() if _is_term(term)
+            })
+            content = sum(terms[field].values())
+            content_ratio[field] = min(content / max(tokens[field], 1), 1.0)
+            novelty[field] = sum(1 for c in terms[field].values()
+                                 if c == 1) / max(content, 1)
+        return cls(
+            {f: Distribution.from_counter(terms[f])
+             for f in FIELDS},
+            {f: Distribution.from_counter(lengths[f])
+             for f in FIELDS}, Distribution.from_counter(pairs),
+            content_ratio, novelty)
+
+    def to_dict(self):
+        """Return the JSON serializable dict of the model."""
+        return {
+            'version': MODEL_VERSION,
+            'terms': {f: d.to_dict()
+                      for f, d in self.terms.items()},
+            'lengths': {f: d.to_dict()
+                        for f, d in self.lengths.items()},
+            'pairs': self.pairs.to_dict(),
+            'content_ratio': self.content_ratio,
+            'novelty': self.novelty,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Return the model of a dict returned by to_dict()."""
+        if data.get('version') != MODEL_VERSION:
+            raise ValueError('unsupported model version: %s' %
+                             data.get('version'))
+        return cls(
+            {f: Distribution.from_dict(d)
+             for f, d in data['terms'].items()},
+            {f: Distribution.from_dict(d)
+             for f, d in data['lengths'].items()},
+            Distribution.from_dict(data['pairs']), data['content_ratio'],
+            data['novelty'])
+
+    def save(self, path):
+        """Save the model to a JSON file."""
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path):
+        """Return the model saved in a JSON file."""
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+    def summary(self):
+        """Return a dict of summary statistics of the model."""
+        return {
+            'interviews': self.pairs.cum_weights[-1],
+            'mean_pairs': self.pairs.mean(),
+            'vocabulary': {f: len(d.values)
+                           for f, d in self.terms.items()},
+            'mean_length': {f: d.mean()
+                            for f, d in self.lengths.items()},
+            'content_ratio': self.content_ratio,
+            'novelty': self.novelty,
+        }
+
+    def _new_term(self, rng, field):
+        """Return a new term, joining the halves of two known terms."""
+        a, b = self.terms[field].sample(rng, 2)
+        return a[:(len(a) + 1) // 2] + b[len(b) // 2:]
+
+    def _paragraph(self, rng, field):
+        """Return the tokens of a generated paragraph of a field."""
+        size = self.lengths[field].sample(rng)[0]
+        content = sum(1 for _ in range(size)
+                      if rng.random() < self.content_ratio[field])
+        tokens = self.terms[field].sample(rng, content)
+        novelty = self.novelty[field]
+        for i in range(content):
+            if rng.random() < novelty:
+                tokens[i] = self._new_term(rng, field)
+        tokens += (rng.choice(self._stopwords) for _ in range(size - content))
+        rng.shuffle(tokens)
+        return tokens
+
+    def interview(self, interview_id, seed=0):
+        """Return the generated interview row of an id, for the loader:
+        (id, text, questions, answers, meta)."""
+        rng = random.Random('%d:%d' % (seed, interview_id))
+        pairs = max(self.pairs.sample(rng)[0], 1)
+        paragraphs = {field: [] for field in FIELDS}
+        texts = {field: [] for field in FIELDS}
+        for _ in range(pairs):
+            for field, mark in zip(FIELDS, ('?', '.')):
+                tokens = self._paragraph(rng, field)
+                paragraphs[field].append(tokens)
+                text = ' '.join(tokens)
+                texts[field].append(text[:1].upper() + text[1:] + mark)
+        tokens = {
+            field: [t for p in paragraphs[field] for t in p]
+            for field in FIELDS
+        }
+        tokens['text'] = tokens['questions'] + tokens['answers']
+        meta = {
+            field: metadata.bag_of_words(tokens[field], self._stopword_set,
+                                         self._stemmer)
+            for field in metadata.FIELDS
+        }
+        text = '\n'.join(
+            itertools.chain.from_iterable(
+                zip(texts['questions'], texts['answers'])))
+        return (interview_id, text, texts['questions'], texts['answers'],
+                meta)
+
+    def generate(self, count, first_id=1, seed=0):
+        """Yield 'count' generated interview rows, with consecutive ids."""
+        for interview_id in range(first_id, first_id + count):
+            yield self.interview(interview_id, seed)
+
+
+def generate_argparser():
+    """Return ArgumentParser object for the generator."""
+    parser = argparse.ArgumentParser(
+        description='Python script to generate synthetic interviews, ' +
+        'learned from the interviews of GEO database, and load them into ' +
+        'the database.',
+        epilog='Report bugs to <https://github.com/andremsouza/ic-geo>')
+    parser.add_argument('model',
+                        type=str,
+                        help='JSON file of the corpus model. It is learned ' +
+                        'from the database if it does not exist.',
+                        metavar='MODEL')
+    parser.add_argument('--learn',
+                        action='store_true',
+                        help='learn the model from the database, even if ' +
+                        'MODEL exists')
+    parser.add_argument('-n',
+                        '--count',
+                        action='store',
+                        default=0,
+                        type=int,
+                        required=False,
+                        help='number of interviews to generate and load ' +
+                        '(default=0)',
+                        metavar='COUNT',
+                        dest='count')
+    parser.add_argument('-s',
+                        '--seed',
+                        action='store',
+                        default=0,
+                        type=int,
+                        required=False,
+                        help='seed of the generated interviews (default=0)',
+                        metavar='SEED',
+                        dest='seed')
+    parser.add_argument('--first-id',
+                        action='store',
+                        default=None,
+                        type=int,
+                        required=False,
+                        help='id of the first generated interview ' +
+                        '(default=the largest id in the database + 1)',
+                        metavar='ID',
+                        dest='first_id')
+    parser.add_argument('-f',
+                        '--format',
+                        action='store',
+                        default='binary',
+                        type=str,
+                        choices=['csv', 'binary'],
+                        required=False,
+                        help='COPY format of the loader (default="binary")',
+                        metavar='FORMAT',
+                        dest='format')
+    parser.add_argument('-b',
+                        '--batch-size',
+                        action='store',
+                        default=1000,
+                        type=int,
+                        required=False,
+                        help='number of rows of each COPY (default=1000)',
+                        metavar='BATCH',
+                        dest='batch_size')
+    parser.add_argument('--rebuild-indexes',
+                        action='store_true',
+                        help='drop secondary indexes during the load, and ' +
+                        'rebuild them at the end')
+    parser.add_argument('--sample',
+                        action='store_true',
+                        help='print the first generated interview as JSON, ' +
+                        'instead of loading')
+    parser.add_argument('-H',
+                        '--host',
+                        action='store',
+                        default=config.HOSTNAME,
+                        type=str,
+                        required=False,
+                        help='database server host or socket directory ' +
+                        '(default=config.HOSTNAME)',
+                        metavar='HOSTNAME',
+                        dest='hostname')
+    parser.add_argument('-p',
+                        '--port',
+                        action='store',
+                        default=config.PORT,
+                        type=int,
+                        required=False,
+                        help='database server port ' + '(default=config.PORT)',
+                        metavar='PORT',
+                        dest='port')
+    parser.add_argument('-d',
+                        '--dbname',
+                        action='store',
+                        default=config.DBNAME,
+                        type=str,
+                        required=False,
+                        help='database name to connect to ' +
+                        '(default=config.DBNAME)',
+                        metavar='DBNAME',
+                        dest='dbname')
+    parser.add_argument('-u',
+                        '--username',
+                        action='store',
+                        default=config.USERNAME,
+                        type=str,
+                        required=False,
+                        help='database user name ' +
+                        '(default=config.USERNAME)',
+                        metavar='USERNAME',
+                        dest='username')
+    parser.add_argument('--password',
+                        action=PasswordPromptAction,
+                        default=config.PASSWORD,
+                        type=str,
+                        required=False,
+                        help='password prompt ' + '(default=config.PASSWORD)',
+                        metavar='',
+                        dest='password')
+
+    return parser
+
+
+if __name__ == "__main__":
+    # Get arguments and connect to database
+    parser = generate_argparser()
+    args = parser.parse_args()
+    conn = psycopg2.connect(host=args.hostname,
+                            port=args.port,
+                            dbname=args.dbname,
+                            user=args.username,
+                            password=args.password)
+    # Delete sensitive data
+    del args.password
+
+    try:
+        # Learn or load the model
+        if args.learn or not os.path.exists(args.model):
+            print('Learning corpus model from the database...')
+            model = CorpusModel.learn(fetch_rows(conn))
+            conn.rollback()
+            model.save(args.model)
+        else:
+            model = CorpusModel.load(args.model)
+        print(json.dumps(model.summary(), indent=2), file=sys.stderr)
+
+        if args.first_id is None:
+            with conn.cursor() as cur:
+                cur.execute('SELECT COALESCE(MAX(id), 0) FROM interviews;')
+                args.first_id = cur.fetchone()[0] + 1
+            conn.rollback()
+        if args.sample:
+            print(json.dumps(model.interview(args.first_id, args.seed),
+                             ensure_ascii=False,
+                             indent=2))
+        elif args.count:
+            # Generate and load interviews, streamed into COPY
+            print('Loading %d interviews from id %d...' %
+                  (args.count, args.first_id))
+            count = loader.load(conn,
+                                model.generate(args.count, args.first_id,
+                                               args.seed),
+                                format=args.format,
+                                chunk_size=args.batch_size,
+                                rebuild_indexes=args.rebuild_indexes)
+            conn.commit()
+            print('Loaded %d interviews' % count)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
@@ -5,14 +5,12 @@
 # %%
 import psycopg2
 import os
-import docx2json
-import json
-import re
-import random
-import nltk.tokenize
-import nltk.corpus
-import nltk.stem
-import spacy
+import nltk
+
+import loader
+import normalization
+import pipeline
+import synthetic
 
 try:
     import config  # Try to import attributes from config.py
@@ -31,6 +29,8 @@ except Exception as e:  # If no config.py, define Object with empty attributes
     config.DBNAME = ''
     config.USERNAME = ''
     config.PASSWORD = ''
+    config.PIPELINE_WORKERS = None
+    config.PIPELINE_CHUNKSIZE = 1
 
 # %%
 nltk.download('punkt')
@@ -72,305 +72,128 @@ print("Interviews (number of documents = %d):" % len(input_files),
 # ### Converting input files to JSON with docx2json
 
 # %%
-# Convert all documents into a JSON (dict) list
-json_arr = [json.loads(docx2json.convert(f)) for f in input_files]
+# Convert all documents into a JSON (dict) list, in parallel
+with pipeline.Pipeline(workers=config.PIPELINE_WORKERS,
+                       chunksize=config.PIPELINE_CHUNKSIZE,
+                       spacy_model=None) as p:
+    json_arr = p.convert(input_files)
 
 # %% [markdown]
-# ### Simple pattern recognition
+# ### Checking normalization against the previous pattern loops
 
 # %%
-# Separating pattern indexes
-# I may need to make those recognitions more complex, depending on new
-# patterns and possible false match in existing ones
-json_patterns = {}
-json_patterns['bold-nonbold'] = [
-    idx for idx, f in enumerate(json_arr)
-    if f['text'][0] == 'Início da transcrição'
-]
-json_patterns['athlete-name'] = [
-    idx for idx, f in enumerate(json_arr) if 'Atleta: ' in f['text'][0]
-]
-json_patterns['one-one-abbr'] = [
-    idx for idx, f in enumerate(json_arr)
-    if 'USP – ' in f['text'][1] or 'USP – ' in f['text'][2]
-]
-json_patterns['black-colored'] = [
+# The previous per-pattern loops of this script, for a single document.
+# Differences from them, intended in normalization.py, are not reproduced:
+# - the black-colored header flag was not reset between documents, so the
+#   header was only removed from the first black-colored document;
+# - documents were processed by every matching pattern, not the first one;
+# - documents matching no pattern were not stripped (interview_insert used
+#   to strip them);
+# - documents with fewer than 3 paragraphs raised IndexError.
+def strip_paragraphs(f):
+    for key in ('text', 'bold', 'nonbold'):
+        f[key] = [s.strip(' ') for s in f[key]]
+
+
+def split_speaker_paragraphs(f, separator, questionset):
+    f['nonbold'] = []
+    for idx2, s in enumerate(f['text']):
+        f['text'][idx2] = s.strip(' ')
+        splitpar = s.split(separator, 1)
+        if (len(splitpar) == 2):
+            f['text'][idx2] = splitpar[1]
+            if (splitpar[0] in questionset):
+                f['bold'].append(splitpar[1])
+            else:
+                f['nonbold'].append(splitpar[1])
+        else:
+            f['nonbold'].append(splitpar[0])
+    strip_paragraphs(f)
+
+
+def previous_normalize(f):
+    f = {key: list(value) for key, value in f.items()}
+    text = f['text'] + ['', '', '']
+    if text[0] == 'Início da transcrição':
+        del f['text'][0]
+        if f['bold'][0] == 'Início da transcrição':
+            del f['bold'][0]
+        if 'Início da transcrição ' in f['bold'][0]:
+            f['bold'][0] = f['bold'][0].replace('Início da transcrição ', '')
+        strip_paragraphs(f)
+    elif 'Atleta: ' in text[0]:
+        del f['text'][0:2]
+        split_speaker_paragraphs(f, ': ', {'Kátia', 'Entrevistador'})
+    elif 'USP – ' in text[1] or 'USP – ' in text[2]:
+        del f['text'][0]
+        split_speaker_paragraphs(f, ' – ', {'USP'})
+    elif ' nascida em ' in text[0] or ' nascido em ' in text[0]:
+        f['nonbold'] = []
+        f['bold'] = []
+        check = False
+        for idx2, s in enumerate(f['text']):
+            if (not check):
+                check = 'Entrevista realizada em ' in s
+            else:
+                del f['text'][0:idx2]
+                break
+        for idx2, s in enumerate(f['text']):
+            if (idx2 % 2 == 0):
+                f['bold'].append(s)
+            else:
+                f['nonbold'].append(s)
+        strip_paragraphs(f)
+    elif 'Transcrição ' in text[0]:
+        del f['text'][0]
+        split_speaker_paragraphs(f, ': ',
+                                 {'Kátia', 'Entrevistador', 'ENTREVISTADORA'})
+    else:
+        strip_paragraphs(f)
+    return f
+
+
+mismatches = [
     idx for idx, f in enumerate(json_arr)
-    if (' nascida em ' in f['text'][0] or ' nascido em ' in f['text'][0])
+    if previous_normalize(f) != normalization.normalize(f)
 ]
-json_patterns['all-nonbold-names'] = [
-    idx for idx, f in enumerate(json_arr) if 'Transcrição' in f['text'][0]
-]
-json_patterns
+if mismatches:
+    raise AssertionError('Normalization differs for documents %s' %
+                         [input_files_ids[idx] for idx in mismatches])
 
 # %% [markdown]
-# ### Processing each pattern
+# ### Simple pattern recognition and normalization
 
 # %%
-# Processing 'bold-nonbold' pattern files
-# Removing 'Início da transcrição' from 'bold-nonbold' pattern files
-for idx in json_patterns['bold-nonbold']:
-    if json_arr[idx]['text'][0] == 'Início da transcrição':
-        del json_arr[idx]['text'][0]
-    if json_arr[idx]['bold'][0] == 'Início da transcrição':
-        del json_arr[idx]['bold'][0]
-    if 'Início da transcrição ' in json_arr[idx]['bold'][0]:
-        json_arr[idx]['bold'][0] = json_arr[idx]['bold'][0].replace(
-            'Início da transcrição ', '')
-#   Removing trailing spaces
-    for idx2, s in enumerate(json_arr[idx]['text']):
-        json_arr[idx]['text'][idx2] = s.strip(' ')
-    for idx2, s in enumerate(json_arr[idx]['bold']):
-        json_arr[idx]['bold'][idx2] = s.strip(' ')
-    for idx2, s in enumerate(json_arr[idx]['nonbold']):
-        json_arr[idx]['nonbold'][idx2] = s.strip(' ')
-
-# %%
-# Processing 'athlete-name' pattern files
-# Removing names from paragraph authors and trailing spaces, along other
-# redundant information
-questionset = set(['Kátia', 'Entrevistador'
-                   ])  # to determine if the paragraph is 'bold' or 'nonbold'
-for idx in json_patterns['athlete-name']:
-    if 'Atleta: ' in json_arr[idx]['text'][0]:
-        del json_arr[idx]['text'][0:2]
-        json_arr[idx]['nonbold'] = []
-        for idx2, s in enumerate(json_arr[idx]['text']):
-            json_arr[idx]['text'][idx2] = s.strip(' ')
-            splitpar = s.split(': ', 1)
-            if (len(splitpar) == 2):
-                json_arr[idx]['text'][idx2] = splitpar[1]
-                if (splitpar[0] in questionset):
-                    json_arr[idx]['bold'].append(splitpar[1])
-                else:
-                    json_arr[idx]['nonbold'].append(splitpar[1])
-            else:
-                json_arr[idx]['nonbold'].append(splitpar[0])
-#   Removing trailing spaces
-    for idx2, s in enumerate(json_arr[idx]['text']):
-        json_arr[idx]['text'][idx2] = s.strip(' ')
-    for idx2, s in enumerate(json_arr[idx]['bold']):
-        json_arr[idx]['bold'][idx2] = s.strip(' ')
-    for idx2, s in enumerate(json_arr[idx]['nonbold']):
-        json_arr[idx]['nonbold'][idx2] = s.strip(' ')
-
-# %%
-# Processing 'one-one-abbr' pattern files
-# Removing names from paragraph authors and trailing spaces, along other
-# redundant information
-questionset = set(['USP'])
-for idx in json_patterns['one-one-abbr']:
-    if ('USP – ' in json_arr[idx]['text'][1]
-            or 'USP – ' in json_arr[idx]['text'][2]):
-        del json_arr[idx]['text'][0]
-        json_arr[idx]['nonbold'] = []
-        for idx2, s in enumerate(json_arr[idx]['text']):
-            json_arr[idx]['text'][idx2] = s.strip(' ')
-            splitpar = s.split(' – ', 1)
-            if (len(splitpar) == 2):
-                json_arr[idx]['text'][idx2] = splitpar[1]
-                if (splitpar[0] in questionset):
-                    json_arr[idx]['bold'].append(splitpar[1])
-                else:
-                    json_arr[idx]['nonbold'].append(splitpar[1])
-            else:
-                json_arr[idx]['nonbold'].append(splitpar[0])
-#   Removing trailing spaces
-    for idx2, s in enumerate(json_arr[idx]['text']):
-        json_arr[idx]['text'][idx2] = s.strip(' ')
-    for idx2, s in enumerate(json_arr[idx]['bold']):
-        json_arr[idx]['bold'][idx2] = s.strip(' ')
-    for idx2, s in enumerate(json_arr[idx]['nonbold']):
-        json_arr[idx]['nonbold'][idx2] = s.strip(' ')
-
-# %%
-# Processing 'black-colored' pattern files
-check = False
-for idx in json_patterns['black-colored']:
-    json_arr[idx]['nonbold'] = []
-    json_arr[idx]['bold'] = []
-    # Removing unwanted information
-    for idx2, s in enumerate(json_arr[idx]['text']):
-        if (not check):
-            check = 'Entrevista realizada em ' in s
-        else:
-            del json_arr[idx]['text'][0:idx2]
-            break
-# Separating questions and answers
-    for idx2, s in enumerate(json_arr[idx]['text']):
-        if (idx2 % 2 == 0):
-            json_arr[idx]['bold'].append(s)
-        else:
-            json_arr[idx]['nonbold'].append(s)
-# Removing trailing spaces
-    for idx2, s in enumerate(json_arr[idx]['text']):
-        json_arr[idx]['text'][idx2] = s.strip(' ')
-    for idx2, s in enumerate(json_arr[idx]['bold']):
-        json_arr[idx]['bold'][idx2] = s.strip(' ')
-    for idx2, s in enumerate(json_arr[idx]['nonbold']):
-        json_arr[idx]['nonbold'][idx2] = s.strip(' ')
-
-# %%
-# Processing 'all-nonbold-names' pattern files
-
-# Processing 'athlete-name' pattern files
-# Removing names from paragraph authors and trailing spaces, along other
-# redundant information
-questionset = set(['Kátia', 'Entrevistador', 'ENTREVISTADORA'
-                   ])  # to determine if the paragraph is 'bold' or 'nonbold'
-for idx in json_patterns['all-nonbold-names']:
-    if 'Transcrição ' in json_arr[idx]['text'][0]:
-        del json_arr[idx]['text'][0]
-        json_arr[idx]['nonbold'] = []
-        for idx2, s in enumerate(json_arr[idx]['text']):
-            json_arr[idx]['text'][idx2] = s.strip(' ')
-            splitpar = s.split(': ', 1)
-            if (len(splitpar) == 2):
-                json_arr[idx]['text'][idx2] = splitpar[1]
-                if (splitpar[0] in questionset):
-                    json_arr[idx]['bold'].append(splitpar[1])
-                else:
-                    json_arr[idx]['nonbold'].append(splitpar[1])
-            else:
-                json_arr[idx]['nonbold'].append(splitpar[0])
-#   Removing trailing spaces
-    for idx2, s in enumerate(json_arr[idx]['text']):
-        json_arr[idx]['text'][idx2] = s.strip(' ')
-    for idx2, s in enumerate(json_arr[idx]['bold']):
-        json_arr[idx]['bold'][idx2] = s.strip(' ')
-    for idx2, s in enumerate(json_arr[idx]['nonbold']):
-        json_arr[idx]['nonbold'][idx2] = s.strip(' ')
+# Classifying documents by pattern, and splitting questions and answers
+json_patterns = {}
+for idx, f in enumerate(json_arr):
+    rule = normalization.classify(f)
+    json_patterns.setdefault(rule.name if rule else None, []).append(idx)
+json_arr = [normalization.normalize(f) for f in json_arr]
+json_patterns
 
 # %% [markdown]
 # ## Generating META Information
 
 # %%
-# Duplicate, remove punctation and split into single words for each interview
-# Create set of tokens for each interview, removing stopwords in the process
-interviews_split = []
-tokens = []
-for idx, x in enumerate(json_arr):
-    # Tokenize using NLTK
-    interviews_split.append({
-        'text': [
-            y for x in [
-                nltk.tokenize.word_tokenize(i, language='portuguese')
-                for i in nltk.tokenize.sent_tokenize(
-                    '\n'.join(x['text']).lower(), language='portuguese')
-            ] for y in x
-        ],
-        'questions': [
-            y for x in [
-                nltk.tokenize.word_tokenize(i, language='portuguese')
-                for i in nltk.tokenize.sent_tokenize(
-                    '\n'.join(x['bold']).lower(), language='portuguese')
-            ] for y in x
-        ],
-        'answers': [
-            y for x in [
-                nltk.tokenize.word_tokenize(i, language='portuguese')
-                for i in nltk.tokenize.sent_tokenize(
-                    '\n'.join(x['nonbold']).lower(), language='portuguese')
-            ] for y in x
-        ],
-    })
-
-    # Removing tokens with trailing dots.
-    dot_re = r'^[^\.]+\.$'
-    for idx2, tok in enumerate(interviews_split[-1]['text']):
-        if re.match(dot_re, tok):
-            interviews_split[-1]['text'][idx2] = tok[:-1]
-    for idx2, tok in enumerate(interviews_split[-1]['questions']):
-        if re.match(dot_re, tok):
-            interviews_split[-1]['questions'][idx2] = tok[:-1]
-    for idx2, tok in enumerate(interviews_split[-1]['answers']):
-        if re.match(dot_re, tok):
-            interviews_split[-1]['answers'][idx2] = tok[:-1]
-
-    # Generating token set, removing stopwords
-    tokens.append({
-        'text':
-        set(interviews_split[idx]['text']) -
-        set(nltk.corpus.stopwords.words('portuguese')),
-        'questions':
-        set(interviews_split[idx]['questions']) -
-        set(nltk.corpus.stopwords.words('portuguese')),
-        'answers':
-        set(interviews_split[idx]['answers']) -
-        set(nltk.corpus.stopwords.words('portuguese'))
-    })
-
-# %%
-# Generating bag-of-words (stemmed or not) for insertion at the database
-stemmer = nltk.stem.rslp.RSLPStemmer()
-# stemmer = nltk.stem.snowball.SnowballStemmer('portuguese') # optional
-metas = []
-for idx, x in enumerate(interviews_split):
-    meta = {
-        'text': {
-            'bow': {},
-            'bow_stemmed': {}
-        },
-        'questions': {
-            'bow': {},
-            'bow_stemmed': {}
-        },
-        'answers': {
-            'bow': {},
-            'bow_stemmed': {}
-        }
-    }
-    for token in tokens[idx]['text']:
-        meta['text']['bow'][token] = x['text'].count(token)
-        meta['text']['bow_stemmed'][
-            stemmer.stem(token)] = meta['text']['bow_stemmed'].get(
-                stemmer.stem(token), 0) + meta['text']['bow'][token]
-    for token in tokens[idx]['questions']:
-        meta['questions']['bow'][token] = x['questions'].count(token)
-        meta['questions']['bow_stemmed'][stemmer.stem(
-            token)] = meta['questions']['bow_stemmed'].get(
-                stemmer.stem(token), 0) + meta['questions']['bow'][token]
-    for token in tokens[idx]['answers']:
-        meta['answers']['bow'][token] = x['answers'].count(token)
-        meta['answers']['bow_stemmed'][stemmer.stem(
-            token)] = meta['answers']['bow_stemmed'].get(
-                stemmer.stem(token), 0) + meta['answers']['bow'][token]
-    metas.append(meta)
-
-# %%
-# Extracting named entities with spaCy
-nlp = spacy.load('pt_core_news_sm')
-for idx, meta in enumerate(metas):
-    doc = nlp('\n'.join(json_arr[idx]['text']))
-    meta['named_entities'] = [{
-        'text': ent.text,
-        'start_char': ent.start_char,
-        'end_char': ent.end_char,
-        'label': ent.label_
-    } for ent in doc.ents]
+# Tokenizing, removing stopwords, generating bag-of-words (stemmed or not)
+# and extracting named entities with spaCy, in parallel
+# Each worker loads the NLP models once, and the persisted stem cache
+with pipeline.Pipeline(workers=config.PIPELINE_WORKERS,
+                       chunksize=config.PIPELINE_CHUNKSIZE,
+                       spacy_model='pt_core_news_sm',
+                       stem_cache_path='stem_cache.json') as p:
+    metas = p.generate_meta(json_arr)
 
 # %% [markdown]
 # ## Insertion of data into the database
 
 # %%
 try:
-    cur = conn.cursor()
-    for idx, data in enumerate(json_arr):
-        cur.execute("""INSERT INTO athletes (id) VALUES (%(id)s);""",
-                    {'id': input_files_ids[idx]})
-        cur.execute(
-            """INSERT INTO interviews (id, text, questions, answers, meta)
-                VALUES
-                    (%(id)s, %(texto)s, %(perguntas)s, %(respostas)s, %(meta)s)
-                ON CONFLICT DO NOTHING;""", {
-                'id': input_files_ids[idx],
-                'texto': '\n'.join(data['text']),
-                'perguntas': data['bold'],
-                'respostas': data['nonbold'],
-                'meta': json.dumps(metas[idx])
-            })
+    loader.load(conn, ((input_files_ids[idx], '\n'.join(data['text']),
+                        data['bold'], data['nonbold'], metas[idx])
+                       for idx, data in enumerate(json_arr)))
     conn.commit()
-    cur.close()
 except Exception as e:
     print(e)
     conn.rollback()
@@ -379,27 +202,19 @@ except Exception as e:
 # ## Making an additional number of insertions, for tests with a high number of rows
 
 # %%
+# Synthetic interviews follow the term frequencies, lengths and structure of
+# the real ones (see synthetic.py), instead of repeating the same documents
 num_iterations = 10000
+corpus_model = synthetic.CorpusModel.learn(
+    (data['bold'], data['nonbold'], metas[idx])
+    for idx, data in enumerate(json_arr))
+
 try:
-    cur = conn.cursor()
-    for i in range(num_iterations):
-        idx = random.randint(0, len(input_files_ids) - 1)
-        data = json_arr[idx]
-        cur.execute("""INSERT INTO athletes (id) VALUES (%(id)s);""",
-                    {'id': 100 + i})
-        cur.execute(
-            """INSERT INTO interviews (id, text, questions, answers, meta)
-                VALUES
-                    (%(id)s, %(texto)s, %(perguntas)s, %(respostas)s, %(meta)s)
-                ON CONFLICT DO NOTHING;""", {
-                'id': 100 + i,
-                'texto': '\n'.join(data['text']),
-                'perguntas': data['bold'],
-                'respostas': data['nonbold'],
-                'meta': json.dumps(metas[idx])
-            })
+    loader.load(conn,
+                corpus_model.generate(num_iterations, first_id=100, seed=0),
+                format='binary',
+                rebuild_indexes=True)
     conn.commit()
-    cur.close()
 except Exception as e:
     print(e)
     conn.rollback()
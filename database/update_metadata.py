@@ -0,0 +1,343 @@
+"""Script to update metadata of interviews in GEO database incrementally.
+
+Use "-h" for more help.
+
+Metadata is generated in stages (normalize, tokenize, bow, stem, ner, meta),
+recorded in a content-hash manifest (see manifest.py). On each run, only the
+stages whose input (document contents) or configuration (e.g., stopwords,
+stemmer, spaCy model) changed are recomputed, and only the "meta" column of
+interviews whose metadata changed is updated. The text, questions and
+answers columns are not changed: documents with new contents must be
+inserted again.
+"""
+import argparse
+import sys
+
+import nltk
+import psycopg2
+import psycopg2.extras
+
+import lexicon
+import manifest
+import metadata
+import normalization
+import pipeline
+from insert_interviews import PasswordPromptAction, config
+from insert_interviews_batch import list_documents
+
+# Versions of the stage functions, to be increased when they change
+STAGE_VERSION = 1
+
+
+def normalize(source):
+    """Stage: normalize the interview dict of a document."""
+    return normalization.normalize(source)
+
+
+def tokenize(interview):
+    """Stage: tokenize each field of an interview."""
+    return metadata.split_interview(interview)
+
+
+def bow(interview_split):
+    """Stage: count tokens of each field, removing stopwords."""
+    return {
+        field: metadata.count_tokens(tokens, pipeline.get_stopwords())
+        for field, tokens in interview_split.items()
+    }
+
+
+def stem(bows):
+    """Stage: stem the bag-of-words of each field."""
+    return {
+        field: metadata.stem_bow(counts, pipeline.get_stemmer())
+        for field, counts in bows.items()
+    }
+
+
+def ner(interview):
+    """Stage: extract named entities from the text of an interview."""
+    return pipeline.named_entities(interview['text'])
+
+
+def meta(bows, stems, *named_entities):
+    """Stage: assemble the meta dict of an interview."""
+    result = {
+        field: {
+            'bow': bows[field],
+            'bow_stemmed': stems[field]
+        }
+        for field in metadata.FIELDS
+    }
+    if named_entities:
+        result['named_entities'] = named_entities[0]
+    return result
+
+
+def generate_stages(args):
+    """Return the list of stages for the given arguments."""
+    stages = [
+        manifest.Stage('normalize', normalize, {
+            'version': STAGE_VERSION,
+            'normalization': normalization.VERSION,
+            'rules': normalization.describe_rules()
+        }),
+        manifest.Stage('tokenize', tokenize, {
+            'version': STAGE_VERSION,
+            'language': 'portuguese'
+        }, ('normalize', )),
+        manifest.Stage(
+            'bow', bow, {
+                'version': STAGE_VERSION,
+                'stopwords': sorted(lexicon.stopwords())
+            }, ('tokenize', )),
+        manifest.Stage('stem', stem, {
+            'version': STAGE_VERSION,
+            'stemmer': lexicon.STEMMER
+        }, ('bow', )),
+    ]
+    if args.spacy_model:
+        stages.append(
+            manifest.Stage('ner', ner, {
+                'version': STAGE_VERSION,
+                'model': args.spacy_model,
+                'max_chars': args.ner_max_chars
+            }, ('normalize', )))
+        stages.append(
+            manifest.Stage('meta', meta, {'version': STAGE_VERSION},
+                           ('bow', 'stem', 'ner')))
+    else:
+        stages.append(
+            manifest.Stage('meta', meta, {'version': STAGE_VERSION},
+                           ('bow', 'stem')))
+    return stages
+
+
+def process_document(item):
+    """Run the stages of a document, in a worker process.
+
+    'item' is a tuple of (id, path, entry, stages, cache_dir). Returns a
+    tuple of (id, new meta dict or None if unchanged, new entry).
+    """
+    id, path, entry, stages, cache_dir = item
+    changed, new_entry = manifest.Manifest(None, cache_dir).run(
+        id, manifest.file_digest(path),
+        lambda: pipeline.convert_document(path), stages, entry)
+    return id, changed.get('meta'), new_entry
+
+
+def generate_argparser():
+    """Return ArgumentParser object for metadata update."""
+    parser = argparse.ArgumentParser(
+        description='Python script to update metadata of interviews in GEO ' +
+        'database, recomputing only what changed since the last run.',
+        epilog='Report bugs to <https://github.com/andremsouza/ic-geo>')
+    parser.add_argument('source',
+                        type=str,
+                        help='directory with the source files of the ' +
+                        'interviews, named after their ids, or manifest ' +
+                        'file (CSV with "id,path" lines, or JSON object).',
+                        metavar='SOURCE')
+    parser.add_argument('-t',
+                        '--type',
+                        action='store',
+                        default='docx',
+                        type=str,
+                        choices=['docx', 'json'],
+                        required=False,
+                        help='type of file for input. ' +
+                        'May be either "docx" or "json" ' + '(default="docx")',
+                        metavar='FILETYPE',
+                        dest='filetype')
+    parser.add_argument('-m',
+                        '--manifest',
+                        action='store',
+                        default='metadata_manifest.json',
+                        type=str,
+                        required=False,
+                        help='manifest file of processed stages ' +
+                        '(default="metadata_manifest.json")',
+                        metavar='MANIFEST',
+                        dest='manifest')
+    parser.add_argument('--cache-dir',
+                        action='store',
+                        default='metadata_cache',
+                        type=str,
+                        required=False,
+                        help='directory for outputs of stages ' +
+                        '(default="metadata_cache")',
+                        metavar='CACHE-DIR',
+                        dest='cache_dir')
+    parser.add_argument('--stem-cache',
+                        action='store',
+                        default='stem_cache.json',
+                        type=str,
+                        required=False,
+                        help='file for the stem cache ' +
+                        '(default="stem_cache.json")',
+                        metavar='STEM-CACHE',
+                        dest='stem_cache')
+    parser.add_argument('--spacy-model',
+                        action='store',
+                        default='pt_core_news_sm',
+                        type=str,
+                        required=False,
+                        help='spaCy model for named entity recognition, or ' +
+                        'empty to skip it (default="pt_core_news_sm")',
+                        metavar='MODEL',
+                        dest='spacy_model')
+    parser.add_argument('--ner-max-chars',
+                        action='store',
+                        default=100000,
+                        type=int,
+                        required=False,
+                        help='maximum length of text parts for named ' +
+                        'entity recognition (default=100000)',
+                        metavar='MAX-CHARS',
+                        dest='ner_max_chars')
+    parser.add_argument('-w',
+                        '--workers',
+                        action='store',
+                        default=config.PIPELINE_WORKERS,
+                        type=int,
+                        required=False,
+                        help='number of processes ' +
+                        '(default=config.PIPELINE_WORKERS, or number of CPUs)',
+                        metavar='WORKERS',
+                        dest='workers')
+    parser.add_argument('-c',
+                        '--chunksize',
+                        action='store',
+                        default=config.PIPELINE_CHUNKSIZE,
+                        type=int,
+                        required=False,
+                        help='number of documents sent to a process at a ' +
+                        'time (default=config.PIPELINE_CHUNKSIZE)',
+                        metavar='CHUNKSIZE',
+                        dest='chunksize')
+    parser.add_argument('-n',
+                        '--dry-run',
+                        action='store_true',
+                        default=False,
+                        required=False,
+                        help='only report changes, without updating the ' +
+                        'database or the manifest',
+                        dest='dry_run')
+    parser.add_argument('-H',
+                        '--host',
+                        action='store',
+                        default=config.HOSTNAME,
+                        type=str,
+                        required=False,
+                        help='database server host or socket directory ' +
+                        '(default=config.HOSTNAME)',
+                        metavar='HOSTNAME',
+                        dest='hostname')
+    parser.add_argument('-p',
+                        '--port',
+                        action='store',
+                        default=config.PORT,
+                        type=int,
+                        required=False,
+                        help='database server port ' + '(default=config.PORT)',
+                        metavar='PORT',
+                        dest='port')
+    parser.add_argument('-d',
+                        '--dbname',
+                        action='store',
+                        default=config.DBNAME,
+                        type=str,
+                        required=False,
+                        help='database name to connect to ' +
+                        '(default=config.DBNAME)',
+                        metavar='DBNAME',
+                        dest='dbname')
+    parser.add_argument('-u',
+                        '--username',
+                        action='store',
+                        default=config.USERNAME,
+                        type=str,
+                        required=False,
+                        help='database user name ' +
+                        '(default=config.USERNAME)',
+                        metavar='USERNAME',
+                        dest='username')
+    parser.add_argument('--password',
+                        action=PasswordPromptAction,
+                        default=config.PASSWORD,
+                        type=str,
+                        required=False,
+                        help='password prompt ' + '(default=config.PASSWORD)',
+                        metavar='',
+                        dest='password')
+
+    return parser
+
+
+if __name__ == "__main__":
+    # Get arguments, documents and manifest
+    parser = generate_argparser()
+    args = parser.parse_args()
+    nltk.download('punkt')
+    nltk.download('stopwords')
+    nltk.download('rslp')
+    documents = list_documents(args.source, args.filetype)
+    stages = generate_stages(args)
+    m = manifest.Manifest(args.manifest, args.cache_dir)
+
+    # Run stages in a process pool, recomputing only what changed
+    updates = []
+    recomputed = {stage.name: 0 for stage in stages}
+    with pipeline.Pipeline(workers=args.workers,
+                           chunksize=args.chunksize,
+                           spacy_model=args.spacy_model or None,
+                           stem_cache_path=args.stem_cache,
+                           ner_max_chars=args.ner_max_chars) as p:
+        items = [(id, path, m.entries.get(str(id), {}), stages,
+                  args.cache_dir) for id, path in documents]
+        for id, new_meta, entry in p.imap(process_document, items):
+            old_entry = m.entries.get(str(id), {})
+            for stage in stages:
+                old_key = old_entry.get(stage.name, [None])[0]
+                if old_key != entry[stage.name][0]:
+                    recomputed[stage.name] += 1
+            if new_meta is None:
+                m.update(id, entry)
+            else:
+                updates.append((id, new_meta, entry))
+    print('Recomputed stages (of %d interviews):' % len(documents),
+          recomputed)
+    print('Interviews with changed metadata: %d' % len(updates))
+    if args.dry_run:
+        sys.exit(0)
+
+    # Update the meta column of changed interviews, in a single transaction
+    conn = psycopg2.connect(host=args.hostname,
+                            port=args.port,
+                            dbname=args.dbname,
+                            user=args.username,
+                            password=args.password)
+    # Delete sensitive data
+    del args.password
+    try:
+        with conn.cursor() as cur:
+            for id, new_meta, entry in updates:
+                cur.execute(
+                    'UPDATE interviews SET meta = %(meta)s WHERE id = %(id)s;',
+                    {
+                        'id': id,
+                        'meta': psycopg2.extras.Json(new_meta)
+                    })
+                if cur.rowcount:
+                    m.update(id, entry)
+                else:
+                    print('Warning: interview %d not found' % id,
+                          file=sys.stderr)
+        conn.commit()
+    except (Exception, psycopg2.Error):
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    # Record changes only after they are committed
+    m.save()